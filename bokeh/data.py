@@ -1,22 +1,168 @@
 import numpy as np
 import pandas
+
+def _as_column(values):
+    # need to cast pandas as numpy so we can operate on whole columns
+    column = np.asarray(values)
+    if column.dtype.kind == 'M' and column.ndim == 1:
+        # keep Timestamps, which the JSON encoder knows how to handle
+        column = np.asarray(pandas.DatetimeIndex(column).tolist(),
+                            dtype=object)
+    return column
+
+def _missing(column):
+    """ Returns a boolean array flagging the float NaNs in column, or
+    None if there are none.
+    """
+    if column.dtype.kind == 'f':
+        missing = np.isnan(column)
+    elif column.dtype.kind == 'O':
+        missing = np.fromiter(
+            (isinstance(v, float) and v != v for v in column),
+            dtype=bool, count=len(column))
+    else:
+        return None
+    if column.ndim > 1:
+        # only whole-row values are substituted in the records output
+        return None
+    if not missing.any():
+        return None
+    return missing
+
+def make_columns(**kwargs):
+    """ Columnar counterpart of make_source.
+
+    Returns (columns, validity).  **columns** maps each field name to an
+    ndarray, left as is.  **validity** maps the names of the columns which
+    contain missing (NaN) values to a boolean array which is False where
+    the value is missing.  Columns without missing values are not in
+    **validity**.
+    """
+    columns = {}
+    validity = {}
+    for name, values in kwargs.items():
+        column = _as_column(values)
+        columns[name] = column
+        missing = _missing(column)
+        if missing is not None:
+            validity[name] = ~missing
+    return columns, validity
+
+def columns_to_records(columns, validity=None):
+    """ Converts the output of make_columns into a list of one dict per
+    row, the layout ObjectArrayDataSource and the pandas models expect.
+    Missing values are replaced by the string "NaN".
+    """
+    if validity is None:
+        validity = {}
+    names = list(columns.keys())
+    lists = []
+    for name in names:
+        values = columns[name].tolist()
+        if name in validity:
+            for idx in np.flatnonzero(~validity[name]):
+                values[idx] = "NaN"
+        lists.append(values)
+    return [dict(zip(names, row)) for row in zip(*lists)]
+
 def make_source(**kwargs):
-    # need to cast pandas as numpy so we can rowindex easily
-    for k in kwargs.keys():
-        if isinstance(kwargs[k], pandas.Series):
-            kwargs[k] = kwargs[k].view(np.ndarray)
-    output = []
-    flds = list(kwargs.keys())
-    for idx, _ in enumerate(next(i for i in kwargs.values())):
-        point = {}
-        for f in flds:
-            val = kwargs[f][idx]
-            if isinstance(val, float) and  np.isnan(val):
-                val = "NaN"
-            elif isinstance(val, np.ndarray):
-                val = val.tolist()
-            else:
-                val = kwargs[f][idx]
-            point[f] = val
-        output.append(point)
-    return output
+    """ Returns a list of one dict per row, built from the vector kwargs.
+    NaNs are encoded as the string "NaN".
+    """
+    columns, validity = make_columns(**kwargs)
+    return columns_to_records(columns, validity)
+
+def _column_changes(old, new):
+    """ Returns the indices at which the 1d columns old and new differ,
+    or None if they can't be compared elementwise
+    """
+    old = np.asarray(old)
+    new = np.asarray(new)
+    if old.shape != new.shape or old.ndim != 1:
+        return None
+    try:
+        changed = np.asarray(old != new)
+    except Exception:
+        return None
+    if changed.shape != old.shape:
+        return None
+    if old.dtype.kind == 'f' and new.dtype.kind == 'f':
+        changed &= ~(np.isnan(old) & np.isnan(new))
+    return np.flatnonzero(changed)
+
+def diff_columns(old, new, max_fraction=0.5):
+    """ Computes a patch which turns the column dict **old** into **new**.
+
+    Returns a dict mapping the names of changed columns to one of
+
+        {'slice' : [start, stop], 'values' : values}
+        {'indices' : indices, 'values' : values}
+        {'replace' : values}
+
+    where a column is replaced outright once more than **max_fraction** of
+    it changed.  Unchanged columns are left out.  Returns None if the set
+    of columns differs, in which case the whole dict should be resent.
+    """
+    if set(old.keys()) != set(new.keys()):
+        return None
+    patch = {}
+    for name, column in new.items():
+        if column is old[name]:
+            continue
+        indices = _column_changes(old[name], column)
+        if indices is None or len(indices) > max_fraction * len(column):
+            patch[name] = {'replace' : column}
+        elif len(indices) == 0:
+            continue
+        elif indices[-1] - indices[0] + 1 == len(indices):
+            start, stop = int(indices[0]), int(indices[-1]) + 1
+            patch[name] = {'slice' : [start, stop],
+                           'values' : np.asarray(column)[start:stop]}
+        else:
+            patch[name] = {'indices' : indices,
+                           'values' : np.asarray(column)[indices]}
+    return patch
+
+def apply_column_patch(data, patch):
+    """ Applies a patch from diff_columns to the column dict **data**, in
+    place where the columns allow it.  Returns data.
+    """
+    for name, change in patch.items():
+        if 'replace' in change:
+            data[name] = change['replace']
+            continue
+        column = data[name]
+        values = change['values']
+        if isinstance(column, np.ndarray):
+            if not column.flags.writeable:
+                column = data[name] = column.copy()
+        else:
+            values = np.asarray(values).tolist()
+        if 'slice' in change:
+            start, stop = change['slice']
+            column[start:stop] = values
+        else:
+            for idx, val in zip(np.asarray(change['indices']).tolist(), values):
+                column[idx] = val
+    return data
+
+def stream_columns(data, new_data, rollover=None):
+    """ Appends the values in the column dict **new_data** to the matching
+    columns of **data**, keeping only the last **rollover** rows of each if
+    given.  List columns are extended in place, array columns are replaced
+    by the concatenated array.  Returns data.
+    """
+    for name, values in new_data.items():
+        column = data.get(name, [])
+        if isinstance(column, np.ndarray) or isinstance(values, np.ndarray):
+            column = np.concatenate([np.asarray(column), np.asarray(values)])
+            if rollover is not None:
+                column = column[-rollover:]
+        else:
+            if not isinstance(column, list):
+                column = list(column)
+            column.extend(values)
+            if rollover is not None and len(column) > rollover:
+                del column[:-rollover]
+        data[name] = column
+    return data
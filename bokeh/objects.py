@@ -7,6 +7,9 @@ plot server or serialized into JS for embedding in HTML or an IPython
 notebook.
 """
 import os
+import numpy as np
+from collections import OrderedDict
+from contextlib import contextmanager
 from uuid import uuid4
 from functools import wraps
 
@@ -14,12 +17,16 @@ from six import add_metaclass
 from six.moves.urllib.parse import urlsplit
 
 import warnings
+import weakref
 import logging
 logger = logging.getLogger(__file__)
 
+from .data import stream_columns
+from .protocol import apply_precision_columns
 from .properties import (HasProps, MetaHasProps, Any, Dict, Enum,
         Either, Float, Instance, Int, List, String, Color, Pattern, Percent,
-        Size, LineProps, FillProps, TextProps, Include, Bool)
+        Size, LineProps, FillProps, TextProps, Include, Bool,
+        lookup_descriptor, untracked, ref_generation)
 
 class Viewable(MetaHasProps):
     """ Any plot object (Data Model) which has its own View Model in the
@@ -95,22 +102,59 @@ def json_apply(fragment, check_func, func):
     """recursively searches through a nested dict/lists
     if check_func(fragment) is True, then we return
     func(fragment)
+
+    Containers in which nothing was replaced are returned as they are,
+    not copied.  Arrays are not searched
     """
     if check_func(fragment):
         return func(fragment)
     elif isinstance(fragment, list):
-        output = []
-        for val in fragment:
-            output.append(json_apply(val, check_func, func))
-        return output
+        output = None
+        for idx, val in enumerate(fragment):
+            # items which aren't containers are handled here rather than
+            # by a call per item, data columns can be long
+            if check_func(val):
+                new = func(val)
+            elif isinstance(val, (list, dict)):
+                new = json_apply(val, check_func, func)
+            else:
+                new = val
+            if new is not val and output is None:
+                output = list(fragment[:idx])
+            if output is not None:
+                output.append(new)
+        return fragment if output is None else output
     elif isinstance(fragment, dict):
-        output = {}
+        output = None
         for k, val in fragment.items():
-            output[k] = json_apply(val, check_func, func)
-        return output
+            new = json_apply(val, check_func, func)
+            if new is not val:
+                if output is None:
+                    output = dict(fragment)
+                output[k] = new
+        return fragment if output is None else output
     else:
         return fragment
 
+def json_find(fragment, check_func, found=None):
+    """returns a list of the parts of the nested dict/lists fragment for
+    which check_func is True, without copying anything
+    """
+    if found is None:
+        found = []
+    if check_func(fragment):
+        found.append(fragment)
+    elif isinstance(fragment, list):
+        for val in fragment:
+            if check_func(val):
+                found.append(val)
+            elif isinstance(val, (list, dict)):
+                json_find(val, check_func, found)
+    elif isinstance(fragment, dict):
+        for val in fragment.values():
+            json_find(val, check_func, found)
+    return found
+
 def resolve_json(fragment, models):
     check_func = is_ref
     def func(fragment):
@@ -123,44 +167,142 @@ def resolve_json(fragment, models):
 
 def traverse_plot_object(plot_object):
     """iterate through an objects properties
-    if it has_ref, json_apply through it and accumulate
+    if it has_ref, search through it and accumulate
     all PlotObjects into children.  return all objects found
     """
     children = set()
     def check_func(fragment):
         return isinstance(fragment, PlotObject)
-    def func(obj):
-        children.add(obj)
-        return obj
     for prop in plot_object.properties_with_refs():
         val = getattr(plot_object, prop)
-        json_apply(val, check_func, func)
+        if isinstance(val, PlotObject):
+            children.add(val)
+        elif val is not None:
+            children.update(json_find(val, check_func))
     return children
 
 def recursively_traverse_plot_object(plot_object,
                                      traversed_ids=None,
                                      children=None):
-    if not children: children = set()
-    if not traversed_ids: traversed_ids = set()
-    if plot_object._id in traversed_ids:
+    """returns the set of plot_object and all the PlotObjects reachable
+    from it.  The walk is iterative, and visits every object once
+    """
+    if children is None: children = set()
+    if traversed_ids is None: traversed_ids = set()
+    stack = [plot_object]
+    while stack:
+        obj = stack.pop()
+        if obj._id in traversed_ids:
+            continue
+        traversed_ids.add(obj._id)
+        children.add(obj)
+        stack.extend(child for child in obj.references()
+                     if child._id not in traversed_ids)
+    return children
+
+class _KeyedRef(weakref.ref):
+    """ A weak reference which remembers the id of its object """
+
+    __slots__ = ('key',)
+
+    def __new__(cls, obj, callback):
+        self = weakref.ref.__new__(cls, obj, callback)
+        self.key = obj._id
+        return self
+
+    def __init__(self, obj, callback):
+        super(_KeyedRef, self).__init__(obj, callback)
+
+class ReferenceGraph(object):
+    """ The references between PlotObjects, kept per session so that
+    reachability queries don't re-scan every object.  An object's
+    references are only looked up again when one of its properties with
+    references changed (see HasProps._refs_changed).  Apart from the
+    result of the last query, objects are only weakly referenced, so the
+    graph doesn't keep them alive.
+    """
+
+    def __init__(self):
+        # id -> (weakref to the object, ids of the objects it references or
+        # None if it wasn't scanned yet)
+        self._edges = {}
+        # (ids of the roots, ref_generation(), result) of the last query
+        self._last = None
+        edges = self._edges
+        def forget(ref):
+            entry = edges.get(ref.key)
+            if entry is not None and entry[0] is ref:
+                del edges[ref.key]
+        self._forget = forget
+
+    def _scan(self, obj):
+        edges = self._edges
+        forget = self._forget
+        # clear the flag first, so changes made while scanning are seen
+        # next time
+        obj._refs_changed = False
+        children = list(obj.references())
+        edges[obj._id] = (_KeyedRef(obj, forget),
+                          [child._id for child in children])
+        for child in children:
+            if child._id not in edges:
+                edges[child._id] = (_KeyedRef(child, forget), None)
         return children
-    else:
-        immediate_children = plot_object.references()
-        children.add(plot_object)
-        traversed_ids.add(plot_object._id)
-        children.update(immediate_children)
-        for child in list(children):
-            if child not in traversed_ids:
-                recursively_traverse_plot_object(
-                    child,
-                    traversed_ids=traversed_ids,
-                    children=children)
+
+    def references(self, obj):
+        """ Returns the PlotObjects which obj references """
+        edges = self._edges
+        entry = edges.get(obj._id)
+        if entry is None or entry[1] is None or entry[0]() is not obj \
+           or obj._refs_changed:
+            return self._scan(obj)
+        children = []
+        for _id in entry[1]:
+            child = edges.get(_id)
+            child = child[0]() if child is not None else None
+            if child is None:
+                # forgotten in the meantime
+                return self._scan(obj)
+            children.append(child)
         return children
 
+    def reachable(self, *roots):
+        """ Returns the set of roots and all the PlotObjects reachable
+        from them.  Until some reference changes, the same set is returned
+        again without walking the graph, it must not be modified.
+        """
+        key = tuple(obj._id for obj in roots)
+        generation = ref_generation()
+        if self._last is not None and self._last[:2] == (key, generation):
+            return self._last[2]
+        seen = set()
+        result = set()
+        stack = list(roots)
+        while stack:
+            obj = stack.pop()
+            if obj._id in seen:
+                continue
+            seen.add(obj._id)
+            result.add(obj)
+            stack.extend(child for child in self.references(obj)
+                         if child._id not in seen)
+        self._last = (key, generation, result)
+        return result
+
+    def discard(self, *objects):
+        """ Forgets the references of objects, e.g. when they are deleted """
+        for obj in objects:
+            self._edges.pop(obj._id, None)
+        self._last = None
+
 @add_metaclass(Viewable)
 class PlotObject(HasProps):
     """ Base class for all plot-related objects """
 
+    __slots__ = ('_id', '_dirty', '_callbacks_dirty', '_callbacks',
+                 '_callback_queue', '_block_callbacks', '_batch_depth',
+                 '_batch_events', '_batch_dirty', '_pushed')
+
     session = Instance   # bokeh.session.Session
 
     def __init__(self, *args, **kwargs):
@@ -173,9 +315,16 @@ class PlotObject(HasProps):
         self._dirty = True
         self._callbacks_dirty = False
         self._callbacks = {}
-        self._callback_queue = []
+        # events held back while callbacks are blocked, and during a
+        # batch.  Allocated when first needed, most objects never have any
+        self._callback_queue = None
         self._block_callbacks = False
-        if '_block_events'  not in kwargs:
+        self._batch_depth = 0
+        self._batch_events = None
+        self._batch_dirty = False
+        # whether the object was pushed to (or loaded from) a session
+        self._pushed = False
+        if not kwargs.pop('_block_events', False):
             super(PlotObject, self).__init__(*args, **kwargs)
             self.setup_events()
         else:
@@ -194,15 +343,20 @@ class PlotObject(HasProps):
             raise RuntimeError("Unable to find 'id' attribute in JSON: %r" % attrs)
         _id = attrs.pop('id')
 
-        if not instance:
-            instance = cls(id=_id, _block_events=True)
-
         ref_props = {}
-        for p in instance.properties_with_refs():
+        for p in cls.properties_with_refs():
             if p in attrs:
                 ref_props[p] = attrs.pop(p)
+
+        if not instance:
+            # a new object has no callbacks or state to update, so the
+            # values are stored directly
+            instance = cls(id=_id, _block_events=True)
+            instance._hydrate(attrs)
+            instance._hydrating = True
+        else:
+            instance.update(**attrs)
         instance._ref_props = ref_props
-        instance.update(**attrs)
         return instance
 
     def finalize(self, models):
@@ -210,8 +364,10 @@ class PlotObject(HasProps):
         models is a dict of id->model mappings
         """
         if hasattr(self, "_ref_props"):
-            props = resolve_json(self._ref_props, models)
-            self.update(**props)
+            if self.__dict__.pop("_hydrating", False):
+                self._hydrate(resolve_json(self._ref_props, models))
+            else:
+                self.update(**resolve_json(self._ref_props, models))
         self.setup_events()
 
     def references(self):
@@ -262,6 +418,63 @@ class PlotObject(HasProps):
         attrs['id'] = self._id
         return attrs
 
+    def changes_since_push(self):
+        """ Returns the names of the properties which changed since this
+        object was last pushed to, or loaded from, a session: the ones
+        which were assigned, and the containers which were mutated in place.
+
+        Returns None when the whole object has to be sent, because it was
+        never pushed, or because it was marked _dirty by hand without any
+        detectable change.
+        """
+        if not self._pushed:
+            return None
+        changed = self.dirty_vars()
+        if not changed and self._dirty:
+            return None
+        return changed
+
+    def vm_serialize_changes(self):
+        """ Like vm_serialize(), but only includes the attributes which
+        changed since the last push (see changes_since_push), along with
+        the id and any attribute which doesn't map to a property
+        """
+        attrs = self.vm_serialize()
+        changed = self.changes_since_push()
+        if changed is None:
+            return attrs
+        props = self.properties()
+        return dict((k, v) for k, v in attrs.items()
+                    if k in changed or k not in props)
+
+    def _mark_clean(self, names=None):
+        """ Records that the session has the current state of this object,
+        or only of its attributes **names**.  Other changes stay dirty.
+        """
+        self._pushed = True
+        if names is None:
+            self._dirty = False
+            self.reset_dirty_vars()
+            return
+        if self._dirty_mask:
+            self.reset_dirty_vars(names)
+            # marked dirty by hand if nothing changed, which still holds
+            self._dirty = bool(self._dirty_mask)
+
+    def _mark_dirty(self, names=None):
+        """ Undoes _mark_clean(), when storing this object, or only its
+        attributes **names**, failed
+        """
+        self._dirty = True
+        if names is None:
+            # sent whole, so it's sent whole again
+            self._pushed = False
+            return
+        index = self.__slot_index__
+        for name in names:
+            if name in index:
+                self._dirty_mask |= 1 << index[name]
+
     def update(self, **kwargs):
         for k,v in kwargs.items():
             setattr(self, k, v)
@@ -308,6 +521,90 @@ class PlotObject(HasProps):
                 getattr(callback['obj'], callback['callbackname'])(
                     self, attrname, old, new)
 
+    def _trigger_events(self, events):
+        """several attributes of self changed, call the callbacks of all
+        of them, each callback once.  A callback registered for more than
+        one of the changed attributes gets them all in one call: a tuple of
+        the attribute names, and dicts of their old and new values
+        """
+        calls = OrderedDict()
+        for event in events:
+            for callback in self._callbacks.get(event[0], ()):
+                key = (id(callback['obj']), callback['callbackname'])
+                calls.setdefault(key, (callback, []))[1].append(event)
+        for callback, matched in calls.values():
+            if len(matched) == 1:
+                attrname, old, new = matched[0]
+            else:
+                attrname = tuple(e[0] for e in matched)
+                old = dict((e[0], e[1]) for e in matched)
+                new = dict((e[0], e[2]) for e in matched)
+            getattr(callback['obj'], callback['callbackname'])(
+                self, attrname, old, new)
+
+    @contextmanager
+    def batch(self):
+        """ Context manager which holds back the change events of this
+        object until the end of the block::
+
+            with source.batch():
+                source.data = data
+                source.selected = []
+
+        The events are coalesced per attribute (old value from the first
+        change, new value from the last), and each callback is called
+        once, see _trigger_events.  The object is only marked dirty, and so only pushed by
+        store_all(), once the block exits.  Batches can be nested, the
+        outermost one delivers the events.
+        """
+        self._begin_batch()
+        try:
+            yield self
+        finally:
+            self._end_batch()
+
+    def _queue_event(self, attrname, old, new):
+        """ Holds back the event of a change while callbacks are blocked,
+        see Session.execute_callback_queue
+        """
+        if self._callback_queue is None:
+            self._callback_queue = []
+        self._callback_queue.append((attrname, old, new))
+
+    def _begin_batch(self):
+        if not self._batch_depth:
+            self._batch_events = []
+        self._batch_depth += 1
+
+    def _end_batch(self):
+        self._batch_depth -= 1
+        if self._batch_depth:
+            return
+        changes = OrderedDict()
+        for attrname, old, new in self._batch_events:
+            if attrname in changes:
+                changes[attrname][1] = new
+            else:
+                changes[attrname] = [old, new]
+        self._batch_events = None
+        events = []
+        for attrname, (old, new) in changes.items():
+            prop = lookup_descriptor(self.__class__, attrname)
+            if not prop.unchanged(self, new, old):
+                events.append((attrname, old, new))
+        if self._batch_dirty:
+            # containers were mutated in place
+            self._batch_dirty = False
+            self._dirty = True
+        if not events:
+            return
+        self._dirty = True
+        if self._block_callbacks:
+            for event in events:
+                self._queue_event(*event)
+        else:
+            self._trigger_events(events)
+
 
     def create_html_snippet(
             self, server=False, embed_base_url="", embed_save_loc=".",
@@ -334,10 +631,10 @@ class PlotObject(HasProps):
             return self._build_server_snippet(embed_base_url)[1]
         embed_filename = "%s.embed.js" % self._id
         full_embed_save_loc = os.path.join(embed_save_loc, embed_filename)
-        js_code, embed_snippet = self._build_static_embed_snippet(
-            static_path, embed_base_url)
-        with open(full_embed_save_loc,"w") as f:
-            f.write(js_code)
+        embed_snippet = self._build_static_embed_snippet(
+            static_path, embed_base_url, include_js=False)[1]
+        with open(full_embed_save_loc,"wb") as f:
+            self.session.embed_js(self._id, static_path, file=f)
         return embed_snippet
 
     def inject_snippet(
@@ -348,7 +645,7 @@ class PlotObject(HasProps):
             server, embed_base_url, embed_save_loc, static_path)
 
     def _build_server_snippet(self, base_url=False):
-        sess = self._session
+        sess = self.session
         modelid = self._id
         typename = self.__view_model__
         if not base_url:
@@ -374,16 +671,20 @@ class PlotObject(HasProps):
         '''
         return "", e_str % f_dict
 
-    def _build_static_embed_snippet(self, static_path, embed_base_url):
+    def _build_static_embed_snippet(self, static_path, embed_base_url,
+                                    include_js=True):
 
 
         embed_filename = "%s.embed.js" % self._id
         full_embed_path = embed_base_url + embed_filename
 
-        js_str = self._session.embed_js(self._id, static_path)
+        if include_js:
+            js_str = self.session.embed_js(self._id, static_path)
+        else:
+            js_str = None
 
 
-        sess = self._session
+        sess = self.session
         modelid = self._id
         typename = self.__view_model__
         embed_filename = full_embed_path
@@ -421,6 +722,17 @@ class ColumnDataSource(DataSource):
     cont_ranges = Dict()
     discrete_ranges = Dict()
 
+    # How numeric columns are reduced for output, either one policy for
+    # all columns or a dict of column name to policy.  Policies are
+    # 'float32', 'delta' (for increasing timestamps) or an int number of
+    # significant digits; see protocol.apply_precision.
+    precision = Any
+
+    # Set to True to compare newly assigned data to the current data by a
+    # digest of their contents, so that re-assigning identical data is not
+    # pushed again.  Hashing costs about as much as one pass over the data.
+    hash_content = False
+
     def __init__(self, *args, **kw):
         """ Modify the basic DataSource/PlotObj constructor so that if we
         are called with a single argument that is a dict, then we treat
@@ -434,9 +746,15 @@ class ColumnDataSource(DataSource):
             if isinstance(raw_data, pd.DataFrame):
                 new_data = {}
                 for colname in raw_data:
-                    new_data[colname] = raw_data[colname].tolist()
+                    column = raw_data[colname]
+                    if column.dtype.kind == 'M':
+                        # left whole, the serializer converts datetime
+                        # columns to epoch milliseconds in one pass
+                        new_data[colname] = column
+                    else:
+                        new_data[colname] = column.tolist()
                 raw_data = new_data
-        for name, data in raw_data.iteritems():
+        for name, data in raw_data.items():
             self.add(data, name)
         super(ColumnDataSource, self).__init__(**kw)
 
@@ -460,6 +778,30 @@ class ColumnDataSource(DataSource):
         except (ValueError, KeyError):
             warnings.warn("Unable to find column '%s' in datasource" % name)
 
+    def vm_serialize(self):
+        attrs = super(ColumnDataSource, self).vm_serialize()
+        attrs['data'] = apply_precision_columns(attrs['data'], self.precision)
+        return attrs
+
+    def stream(self, new_data, rollover=None):
+        """ Appends the rows in **new_data**, a dict of column name to
+        sequence of new values, to the end of the columns.  If **rollover**
+        is given, only the last **rollover** rows are kept.
+
+        If the source belongs to a plot server session, only the new rows
+        are sent to the server, rather than the entire source.
+        """
+        session = self.session
+        if session is not None and hasattr(session, "store_stream"):
+            # the session gets the new rows, data doesn't need pushing
+            with untracked(self.data):
+                stream_columns(self.data, new_data, rollover)
+            session.store_stream(self, apply_precision_columns(
+                new_data, self.precision), rollover)
+        else:
+            stream_columns(self.data, new_data, rollover)
+            self._dirty = True
+
 
 class ObjectArrayDataSource(DataSource):
     # List of tuples of values
@@ -628,7 +970,7 @@ class Plot(PlotObject):
 
     def _get_script_inject_snippet(self):
         from .session import HTMLFileSession
-        if isinstance(self._session, HTMLFileSession):
+        if isinstance(self.session, HTMLFileSession):
             self.script_inject_snippet
             return ""
         else:
@@ -708,7 +1050,7 @@ class GMapPlot(PlotObject):
             'lng': self.center_lng,
             'zoom': self.zoom_level
         }
-        self._session.raw_js_snippets(self)
+        self.session.raw_js_snippets(self)
         return data
 
     @classmethod
@@ -127,7 +127,7 @@ class PandasPlotSource(ColumnDataSource):
     def get_data(self, obj=None, attrname=None, old=None, new=None):
         data = self.source.get_data(self.transform())
         #ugly:
-        self._selected =  np.nonzero(data['data']['_selected'])[0]
+        self._set_raw('selected', np.nonzero(data['data']['_selected'])[0])
         self.maxlength = data.pop('maxlength')
         self.totallength = data.pop('totallength')
         self.column_names = data['column_names']
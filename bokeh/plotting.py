@@ -4,6 +4,7 @@ from __future__ import absolute_import, print_function
 """
 import copy
 from collections import Iterable
+from contextlib import contextmanager
 from functools import wraps
 import itertools
 from numbers import Number
@@ -195,7 +196,9 @@ def output_server(docname, url="default", **kwargs):
     existing document with this name, it will be overwritten.
 
     Additional keyword arguments like **username**, **userapikey**,
-    and **base_url** can be supplied.
+    and **base_url** can be supplied.  With **push_interval** (in seconds)
+    plots are uploaded from a background thread instead of blocking each
+    plotting call, see PlotServerSession.wait().
     Generally, this should be called at the beginning of an interactive session
     or the top of a script.
     """
@@ -286,6 +289,8 @@ def show(browser=None, new="tab"):
     """
     output_type = _config["output_type"]
     session = _config["session"]
+    if session and session.defer("plotting.show", show, browser, new):
+        return
     # Map our string argument to the webbrowser.open argument
     new_param = {'tab': 2, 'window': 1}[new]
     if browser is not None:
@@ -298,6 +303,7 @@ def show(browser=None, new="tab"):
                             new=new_param)
     elif output_type == "server":
         session.store_all()
+        session.wait()
         controller.open(_config["output_url"] + "/bokeh", new=new_param)
 
     elif output_type == "notebook":
@@ -311,6 +317,8 @@ def save(filename=None):
     up to the server.
     """
     session = _config["session"]
+    if session and session.defer("plotting.save", save, filename):
+        return
     if _config["output_type"] == "file":
         if filename is not None:
             oldfilename = session.filename
@@ -323,9 +331,34 @@ def save(filename=None):
     elif _config["output_type"] == "server":
         session.plotcontext._dirty = True
         session.store_all()
+        session.wait()
     else:
         warnings.warn("save() does nothing for non-file-based output mode.")
 
+@contextmanager
+def batch():
+    """ Context manager in which plotting calls don't upload or save the
+    plots right away.  At the end of the block, the models which changed
+    are uploaded once (or the output file is saved once), and show() or
+    save() calls made inside of it run after that::
+
+        with batch():
+            hold()
+            for y in ys:
+                line(x, y)
+    """
+    session = _config["session"]
+    if not session:
+        raise RuntimeError(
+            'No output mode active, call one of: { output_file(...), output_server(...), output_notebook(...) } before plotting'
+        )
+    with session.deferred():
+        yield session
+
+def _show_stored(session, *objects):
+    session.wait()
+    session.show(*objects)
+
 def visual(func):
     """ Decorator to wrap functions that might create visible plot objects
     and need to be displayed or cause a refresh of the output.
@@ -368,8 +401,10 @@ def visual(func):
                 (output_type == "notebook" and output_url is not None):
             # push the plot data to a plot server
             session.store_all()
-            if output_type == "notebook":
-                session.show(plot, *session_objs)
+            if output_type == "notebook" and not session.defer(
+                    ("show", plot._id), _show_stored, session, plot,
+                    *session_objs):
+                _show_stored(session, plot, *session_objs)
 
         else: # File output mode
             # Store plot into HTML file
@@ -583,13 +618,13 @@ class GlyphFunction(object):
             legend = self._get_legend(plot)
             if not legend:
                 legend = self._make_legend(plot)
+            # the renderer lists inside legends aren't observed, so the
+            # entry is replaced rather than appended to
             mappings = legend.legends
-            mappings.setdefault(legend_name, []).append(glyph_renderer)
-            legend._dirty = True
+            mappings[legend_name] = mappings.get(legend_name, []) + [glyph_renderer]
 
         if select_tool :
             select_tool.renderers.append(glyph_renderer)
-            select_tool._dirty = True
 
         plot.renderers.append(glyph_renderer)
 
@@ -619,7 +654,6 @@ class GlyphFunction(object):
     def _make_legend(self, plot):
         legend = Legend(plot=plot)
         plot.renderers.append(legend)
-        plot._dirty = True
         return legend
 
     def _get_select_tool(self, plot):
@@ -7,7 +7,14 @@ classes and implement convenience behaviors like default values, etc.
 from six import string_types, add_metaclass
 
 from copy import copy
+from contextlib import contextmanager
 import inspect
+import weakref
+try:
+    from types import MappingProxyType as _frozendict
+except ImportError:
+    # python 2 has no read-only dict view
+    _frozendict = dict
 import numpy as np
 import logging
 logger = logging.getLogger(__name__)
@@ -15,13 +22,54 @@ logger = logging.getLogger(__name__)
 def _dummy(*args,**kw):
     return None
 
+class _Unset(object):
+    """ Marks the property slots of an instance which were never set """
+    __slots__ = ()
+    def __repr__(self):
+        return "<unset>"
+
+_UNSET = _Unset()
+
+# bumped whenever a property with references changes on any object, so
+# that reachability results can be cached until the next change
+_ref_generation = 0
+
+def ref_generation():
+    return _ref_generation
+
+def _refs_changed(obj):
+    global _ref_generation
+    obj._refs_changed = True
+    _ref_generation += 1
+
 class BaseProperty(object):
+    """ Property values are stored in the _slots list of each instance, at
+    the index MetaHasProps assigned to the property name for the class
+    (see HasProps).  Slots which were never set hold _UNSET, so defaults
+    are not stored per instance.
+    """
     def __init__(self, default=None):
         """ This is how the descriptor is created in the class declaration """
         self.default = default
         # This gets set by the class decorator at class creation time
         self.name = "unnamed"
 
+    def default_factory(self):
+        """ Returns a function creating the default value for a new
+        instance, for properties whose default can't be shared between
+        instances, or None
+        """
+        return None
+
+    def _raw(self, obj):
+        """ Returns the value stored for this property on obj, or _UNSET """
+        if obj is None:
+            return _UNSET
+        return obj._slots[obj.__slot_index__[self.name]]
+
+    def _store(self, obj, value):
+        obj._slots[obj.__slot_index__[self.name]] = value
+
     @classmethod
     def autocreate(cls, name=None):
         """ Called by the metaclass to create a
@@ -32,32 +80,80 @@ class BaseProperty(object):
         return cls()
 
     def __get__(self, obj, type=None):
-        return getattr(obj, "_"+self.name, self.default)
+        value = self._raw(obj)
+        if value is _UNSET:
+            return self.default
+        return value
+
+    # lists and dicts longer than this are only compared by identity
+    compare_max_length = 32
 
     def matches(self, new, old):
+        """ Whether assigning new over old is not a change.  Arrays, and
+        large lists and dicts, are compared by identity: comparing their
+        contents can cost as much as sending them, and their in place
+        changes are tracked anyway (see Observed)
+        """
+        if new is old:
+            return True
+        if self._large(new) or self._large(old):
+            return False
         try:
-            return new == old
-        except Exception as e:
-            logger.warning("could not compare %s and %s for property %s",
-                           new, old, self.name)
+            return bool(new == old)
+        except Exception:
+            # e.g. containers of arrays, which compare elementwise
+            return False
+
+    def _large(self, value, nested=True):
+        if isinstance(value, np.ndarray):
+            return True
+        if isinstance(value, (list, tuple, dict)):
+            if len(value) > self.compare_max_length:
+                return True
+            if nested and isinstance(value, dict):
+                return any(self._large(v, False) for v in value.values())
         return False
 
+    def unchanged(self, obj, new, old):
+        """ Whether assigning new over old, on obj, is not a change """
+        return self.matches(new, old)
+
     def __set__(self, obj, value):
+        index = obj.__slot_index__[self.name]
+        was_set = obj._slots[index] is not _UNSET
         old = self.__get__(obj)
-        obj._changed_vars.add(self.name)
-        if ("_"+self.name in obj.__dict__) and self.matches(value, old):
+        obj._changed_mask |= 1 << index
+        if was_set and self.unchanged(obj, value, old):
+            return
+        obj._slots[index] = value
+        obj._dirty_mask |= 1 << index
+        if obj.__ref_mask__ >> index & 1:
+            _refs_changed(obj)
+        if getattr(obj, '_batch_depth', 0):
+            # PlotObject.batch() delivers the events, and marks the
+            # object dirty, on exit
+            obj._batch_events.append((self.name, old, value))
             return
-        setattr(obj, "_"+self.name, value)
         obj._dirty = True
         if hasattr(obj, '_trigger'):
             if hasattr(obj, '_block_callbacks') and obj._block_callbacks:
-                obj._callback_queue.append((self.name, old, value))
+                obj._queue_event(self.name, old, value)
             else:
                 obj._trigger(self.name, old, value)
 
     def __delete__(self, obj):
-        if hasattr(obj, "_"+self.name):
-            delattr(obj, "_"+self.name)
+        self._store(obj, _UNSET)
+
+    def hydrate(self, obj, value):
+        """ Stores a value loaded from json on a new obj (see
+        PlotObject.load_json), without change detection, dirty marking or
+        events
+        """
+        index = obj.__slot_index__[self.name]
+        obj._slots[index] = value
+        obj._changed_mask |= 1 << index
+        if obj.__ref_mask__ >> index & 1:
+            _refs_changed(obj)
 
 
 class Include(BaseProperty):
@@ -154,9 +250,8 @@ class DataSpec(BaseProperty):
         However, if the user has also overridden the "units" or "default"
         settings, then a dictionary is returned.
         """
-        attrname = "_" + self.name
-        if hasattr(obj, attrname):
-            setval = getattr(obj, attrname)
+        setval = self._raw(obj)
+        if setval is not _UNSET:
             if isinstance(setval, string_types) and self.default is None:
                 # A string representing the field
                 return setval
@@ -185,14 +280,11 @@ class DataSpec(BaseProperty):
                 arg = {"field": field, "default": default}
         super(DataSpec, self).__set__(obj, arg)
 
-    def __delete__(self, obj):
-        if hasattr(obj, self.name + "_dict"):
-            delattr(obj, self.name + "_dict")
-        super(DataSpec, self).__delete__(self, obj)
-
     def to_dict(self, obj):
         # Build the complete dict
-        setval = getattr(obj, "_"+self.name, None)
+        setval = self._raw(obj)
+        if setval is _UNSET:
+            setval = None
         if isinstance(setval, string_types):
             d = {"field": setval, "units": self.units}
             if self.default is not None:
@@ -344,9 +436,8 @@ class ColorSpec(DataSpec):
         # that we do not call self.to_dict() in any circumstance, because
         # this could lead to formatting color tuples as "rgb(R,G,B)" instead
         # of keeping them as tuples.
-        attrname = "_" + self.name
-        if hasattr(obj, attrname):
-            setval = getattr(obj, attrname)
+        setval = self._raw(obj)
+        if setval is not _UNSET:
             if self.isconst(setval) or isinstance(setval, tuple):
                 # Fixed color value
                 return setval
@@ -371,6 +462,10 @@ class ColorSpec(DataSpec):
             else:
                 return self.field
 
+    def hydrate(self, obj, value):
+        self._isset = True
+        super(ColorSpec, self).hydrate(obj, value)
+
     def __set__(self, obj, arg):
         self._isset = True
         if isinstance(arg, tuple):
@@ -386,7 +481,9 @@ class ColorSpec(DataSpec):
         super(ColorSpec, self).__set__(obj, arg)
 
     def to_dict(self, obj):
-        setval = getattr(obj, "_" + self.name, None)
+        setval = self._raw(obj)
+        if setval is _UNSET:
+            setval = None
         if setval is not None:
             if self.isconst(setval):
                 # Hexadecimal or named color
@@ -495,14 +592,56 @@ class MetaHasProps(type):
         class_dict["__container_props__"] = container_names
         if dataspecs:
             class_dict["_dataspecs"] = dataspecs
-        return type.__new__(cls, class_name, bases, class_dict)
+        newcls = type.__new__(cls, class_name, bases, class_dict)
+
+        # Give every property of the class, including inherited ones, an
+        # index into the per instance _slots list.  Bases can be combined
+        # in any way, so the indices are per class.
+        mro = inspect.getmro(newcls)
+        allnames = set()
+        for c in mro:
+            allnames.update(c.__dict__.get("__properties__", ()))
+        slot_names = sorted(allnames)
+        newcls.__slot_names__ = slot_names
+        newcls.__slot_index__ = dict((name, idx) for idx, name in
+                                     enumerate(slot_names))
+        newcls.__unset_slots__ = [_UNSET] * len(slot_names)
+
+        # The lookup tables of HasProps.properties() and friends, built
+        # once here and stored on the class itself, so a subclass never
+        # picks up the tables of its base through attribute lookup
+        newcls.__all_properties__ = frozenset(allnames)
+        newcls.__all_properties_with_refs__ = \
+            accumulate_from_subclasses(newcls, "__properties_with_refs__")
+        newcls.__all_container_props__ = \
+            accumulate_from_subclasses(newcls, "__container_props__")
+        ref_mask = 0
+        for name in newcls.__all_properties_with_refs__:
+            ref_mask |= 1 << newcls.__slot_index__[name]
+        newcls.__ref_mask__ = ref_mask
+        all_dataspecs = {}
+        for c in reversed(mro):
+            all_dataspecs.update(c.__dict__.get("_dataspecs", {}))
+        newcls.__all_dataspecs__ = _frozendict(all_dataspecs)
+        newcls.__all_dataspec_names__ = frozenset(all_dataspecs)
+        descriptors = {}
+        factories = {}
+        for name in slot_names:
+            prop = next(c.__dict__[name] for c in mro if name in c.__dict__)
+            if isinstance(prop, BaseProperty):
+                descriptors[name] = prop
+                factory = prop.default_factory()
+                if factory is not None:
+                    factories[name] = factory
+        newcls.__descriptors__ = _frozendict(descriptors)
+        newcls.__default_factories__ = _frozendict(factories)
+        return newcls
 
 def accumulate_from_subclasses(cls, propname):
     s = set()
     for c in inspect.getmro(cls):
-        if issubclass(c, HasProps):
-            s.update(getattr(c, propname))
-    return s
+        s.update(c.__dict__.get(propname, ()))
+    return frozenset(s)
 
 def lookup_descriptor(cls, propname):
     for c in inspect.getmro(cls):
@@ -512,26 +651,80 @@ def lookup_descriptor(cls, propname):
 
 @add_metaclass(MetaHasProps)
 class HasProps(object):
+    # Property values live in _slots, indexed through the class'
+    # __slot_index__.  _changed_mask has the bits of the slots which were
+    # assigned to, see changed_vars(), and _dirty_mask the bits of the
+    # slots whose value changed since the last reset_dirty_vars().
+    # _refs_changed is set when a property with references changes, see
+    # objects.ReferenceGraph
+    __slots__ = ('_slots', '_changed_mask', '_dirty_mask', '_refs_changed',
+                 '__dict__', '__weakref__')
+
+    def __new__(cls, *args, **kwargs):
+        obj = super(HasProps, cls).__new__(cls)
+        obj._slots = cls.__unset_slots__[:]
+        obj._changed_mask = 0
+        obj._dirty_mask = 0
+        obj._refs_changed = True
+        return obj
+
     def __init__(self, *args, **kwargs):
         """ Set up a default initializer handler which assigns all kwargs
         that have the same names as Properties on the class
         """
-        # Initialize the mutated property handling
-        self._changed_vars = set()
-
         newkwargs = {}
-        props = self.properties()
+        props = self.__slot_index__
         for kw, val in kwargs.items():
             if kw in props:
                 setattr(self, kw, val)
             else:
                 newkwargs[kw] = val
         # Dump the rest of the kwargs in self.dict
-        self.__dict__.update(newkwargs)
-        self._changed_vars.update(newkwargs.keys())
+        if newkwargs:
+            self.__dict__.update(newkwargs)
+            self._changed_extra = tuple(newkwargs.keys())
 
         super(HasProps, self).__init__(*args)
 
+    @property
+    def _changed_vars(self):
+        """ The names of the properties (and other attributes passed to
+        the constructor) which were set on this object
+        """
+        changed = self._mask_names(self._changed_mask)
+        changed.update(self.__dict__.get('_changed_extra', ()))
+        return changed
+
+    def _mask_names(self, mask):
+        names = self.__slot_names__
+        return set(names[idx] for idx in range(len(names))
+                   if mask >> idx & 1)
+
+    def _set_raw(self, name, value):
+        """ Stores the value of property **name** without marking it as
+        changed or triggering callbacks
+        """
+        self._slots[self.__slot_index__[name]] = value
+
+    def _hydrate(self, attrs):
+        """ Stores the values in attrs, freshly loaded from json, without
+        change detection, dirty marking or events.  Keys which aren't
+        properties are set as plain attributes.
+        """
+        descriptors = self.__descriptors__
+        for name, value in attrs.items():
+            prop = descriptors.get(name)
+            if prop is not None:
+                prop.hydrate(self, value)
+            else:
+                setattr(self, name, value)
+
+    def _has_value(self, name):
+        """ Whether a value is stored for property **name**, instead of
+        it falling back to its default
+        """
+        return self._slots[self.__slot_index__[name]] is not _UNSET
+
     def clone(self):
         """ Returns a duplicate of this object with all its properties
         set appropriately.  Values which are containers are shallow-copied.
@@ -542,56 +735,44 @@ class HasProps(object):
     @classmethod
     def properties_with_refs(cls):
         """ Returns a set of the names of this object's properties that
-        have references. We traverse the class hierarchy and
-        pull together the full list of properties.
+        have references, including the inherited ones.
         """
-        if not hasattr(cls, "__cached_allprops_with_refs"):
-            s = accumulate_from_subclasses(cls,
-                                           "__properties_with_refs__")
-            cls.__cached_allprops_with_refs = s
-        return cls.__cached_allprops_with_refs
+        return cls.__all_properties_with_refs__
 
     @classmethod
     def properties_containers(cls):
-        """ Returns a list of properties that are containers
+        """ Returns a set of the names of this object's properties that
+        are containers, including the inherited ones.
         """
-        if not hasattr(cls, "__cached_allprops_containers"):
-            s = accumulate_from_subclasses(cls,
-                                           "__container_props__")
-            cls.__cached_allprops_containers = s
-        return cls.__cached_allprops_containers
+        return cls.__all_container_props__
 
     @classmethod
     def properties(cls):
-        """ Returns a set of the names of this object's properties. We
-        traverse the class hierarchy and pull together the full
-        list of properties.
+        """ Returns a set of the names of this object's properties,
+        including the inherited ones.
         """
-        if not hasattr(cls, "__cached_allprops"):
-            s = cls.class_properties()
-            cls.__cached_allprops = s
-        return cls.__cached_allprops
+        return cls.__all_properties__
 
     @classmethod
     def dataspecs(cls):
         """ Returns a set of the names of this object's dataspecs (and
-        dataspec subclasses).  Traverses the class hierarchy.
+        dataspec subclasses), including the inherited ones.
         """
-        if not hasattr(cls, "__cached_dataspecs"):
-            dataspecs = set()
-            for c in reversed(inspect.getmro(cls)):
-                if hasattr(c, "_dataspecs"):
-                    dataspecs.update(c._dataspecs.keys())
-            cls.__cached_dataspecs = dataspecs
-        return cls.__cached_dataspecs
+        return cls.__all_dataspec_names__
 
     @classmethod
     def dataspecs_with_refs(cls):
-        dataspecs = {}
-        for c in reversed(inspect.getmro(cls)):
-            if hasattr(c, "_dataspecs"):
-                dataspecs.update(c._dataspecs)
-        return dataspecs
+        """ Returns a read-only mapping of the names of this object's
+        dataspecs to their descriptors
+        """
+        return cls.__all_dataspecs__
+
+    @classmethod
+    def default_factories(cls):
+        """ Returns a read-only mapping of the names of the properties
+        whose defaults are created per instance to their factories
+        """
+        return cls.__default_factories__
 
     def changed_vars(self):
         """ Returns which variables changed since the creation of the object,
@@ -601,12 +782,53 @@ class HasProps(object):
                          self.properties_containers())
 
     def reset_changed_vars(self):
-        self._changed_vars = set()
+        self._changed_mask = 0
+        self.__dict__.pop('_changed_extra', None)
+
+    def _container_changed(self, name):
+        """ Called by the Observed container of property **name** when it
+        is mutated in place
+        """
+        bit = 1 << self.__slot_index__[name]
+        self._changed_mask |= bit
+        self._dirty_mask |= bit
+        if self.__ref_mask__ & bit:
+            _refs_changed(self)
+        if getattr(self, '_batch_depth', 0):
+            self._batch_dirty = True
+        else:
+            self._dirty = True
+
+    def dirty_vars(self):
+        """ Returns the names of the properties which were assigned a
+        different value since the creation of the object, or the last call
+        to reset_dirty_vars(), or whose container value was mutated in
+        place.
+        """
+        return self._mask_names(self._dirty_mask)
+
+    def reset_dirty_vars(self, names=None):
+        """ Resets the dirty state of the properties **names** (an
+        iterable, names which aren't properties are ignored), or of all
+        of them
+        """
+        if names is None:
+            self._dirty_mask = 0
+            slots = self._slots
+        else:
+            index = self.__slot_index__
+            indices = [index[name] for name in names if name in index]
+            for i in indices:
+                self._dirty_mask &= ~(1 << i)
+            slots = [self._slots[i] for i in indices]
+        for value in slots:
+            if isinstance(value, Observed) and value._owner is not None:
+                value._changed = ()
 
     @classmethod
     def class_properties(cls, withbases=True):
         if withbases:
-            return accumulate_from_subclasses(cls, "__properties__")
+            return set(cls.__all_properties__)
         else:
             return set(cls.__properties__)
 
@@ -628,10 +850,286 @@ class File(BaseProperty): pass
 class Bool(BaseProperty): pass
 class String(BaseProperty): pass
 
+class Observed(object):
+    """ Mixin of the containers which List, Dict and Array properties hand
+    out.  In place mutations record the changed keys (or indices) and
+    notify the object holding the container, which marks the property
+    dirty, see HasProps._container_changed()
+    """
+    __slots__ = ()
+
+    def _attach(self, owner, name):
+        self._owner = weakref.ref(owner)
+        self._name = name
+        # the set is only created on the first change
+        self._changed = ()
+        # bumped on every change, see ContainerProp.digest()
+        self._version = 0
+
+    def _detach(self):
+        self._owner = None
+
+    def _notify(self, keys=None):
+        """ keys are the changed keys or indices, None if the change
+        can't be described that way (sort, clear, ...)
+        """
+        self._version += 1
+        if self._changed is not None:
+            if keys is None:
+                self._changed = None
+            else:
+                if not self._changed:
+                    self._changed = set()
+                self._changed.update(keys)
+        owner = self._owner() if self._owner is not None else None
+        if owner is not None:
+            owner._container_changed(self._name)
+
+    @property
+    def changed_keys(self):
+        """ The keys (or indices) changed since the owner's last
+        reset_dirty_vars(), or None if the whole container changed
+        """
+        if self._changed is None:
+            return None
+        return set(self._changed)
+
+class ObservedList(Observed, list):
+    __slots__ = ('_owner', '_name', '_changed', '_version', '_digest')
+
+    def __reduce_ex__(self, protocol):
+        # copies and pickles are plain lists
+        return (list, (list(self),))
+
+    def __setitem__(self, key, value):
+        list.__setitem__(self, key, value)
+        self._notify([key] if isinstance(key, int) else None)
+
+    def __delitem__(self, key):
+        list.__delitem__(self, key)
+        self._notify()
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    def __imul__(self, n):
+        list.__imul__(self, n)
+        self._notify()
+        return self
+
+    def append(self, value):
+        list.append(self, value)
+        self._notify([len(self) - 1])
+
+    def extend(self, values):
+        start = len(self)
+        list.extend(self, values)
+        self._notify(range(start, len(self)))
+
+    def insert(self, index, value):
+        list.insert(self, index, value)
+        self._notify()
+
+    def pop(self, *args):
+        value = list.pop(self, *args)
+        self._notify()
+        return value
+
+    def remove(self, value):
+        list.remove(self, value)
+        self._notify()
+
+    def sort(self, *args, **kwargs):
+        list.sort(self, *args, **kwargs)
+        self._notify()
+
+    def reverse(self):
+        list.reverse(self)
+        self._notify()
+
+    def clear(self):
+        del self[:]
+
+class ObservedDict(Observed, dict):
+    __slots__ = ('_owner', '_name', '_changed', '_version', '_digest')
+
+    def __reduce_ex__(self, protocol):
+        return (dict, (dict(self),))
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self._notify([key])
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._notify([key])
+
+    def pop(self, key, *args):
+        present = key in self
+        value = dict.pop(self, key, *args)
+        if present:
+            self._notify([key])
+        return value
+
+    def popitem(self):
+        key, value = dict.popitem(self)
+        self._notify([key])
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        self[key] = default
+        return default
+
+    def update(self, *args, **kwargs):
+        other = dict(*args, **kwargs)
+        dict.update(self, other)
+        self._notify(other.keys())
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def clear(self):
+        dict.clear(self)
+        self._notify()
+
+class ObservedArray(Observed, np.ndarray):
+
+    def __array_finalize__(self, obj):
+        # views and results of operations on the array don't notify
+        self._owner = None
+        self._changed = None
+        self._version = 0
+
+    def __setitem__(self, key, value):
+        np.ndarray.__setitem__(self, key, value)
+        self._notify([key] if isinstance(key, int) else None)
+
+    def fill(self, value):
+        np.ndarray.fill(self, value)
+        self._notify()
+
+def _inplace_op(name):
+    op = getattr(np.ndarray, name)
+    def method(self, other):
+        result = op(self, other)
+        self._notify()
+        return result
+    method.__name__ = name
+    return method
+
+for _name in ('__iadd__', '__isub__', '__imul__', '__itruediv__',
+              '__ifloordiv__', '__imod__', '__ipow__', '__iand__',
+              '__ior__', '__ixor__', '__ilshift__', '__irshift__'):
+    if hasattr(np.ndarray, _name):
+        setattr(ObservedArray, _name, _inplace_op(_name))
+
+def observe(value, owner, name):
+    """ Returns value wrapped in an Observed container reporting to
+    property **name** of **owner**.  Plain lists and dicts are shallow
+    copied, arrays are viewed.  Other values are returned as they are.
+
+    Because of the copy, a plain list or dict assigned to a property is
+    not the one the property holds afterwards: mutations made through the
+    original reference are neither seen nor pushed.  Mutate the container
+    read back from the property instead.
+    """
+    if isinstance(value, Observed):
+        if value._owner is not None and value._owner() is owner \
+           and value._name == name:
+            return value
+        # a container can only report to one owner
+        value = value.view(np.ndarray) if isinstance(value, np.ndarray) \
+            else copy(value)
+    if isinstance(value, list):
+        result = ObservedList(value)
+    elif isinstance(value, dict):
+        result = ObservedDict(value)
+    elif isinstance(value, np.ndarray):
+        result = value.view(ObservedArray)
+    else:
+        return value
+    result._attach(owner, name)
+    return result
+
+@contextmanager
+def untracked(value):
+    """ Context manager in which in place mutations of value (an Observed
+    container, or anything else) don't mark its owner dirty
+    """
+    owner = getattr(value, '_owner', None)
+    if isinstance(value, Observed):
+        value._owner = None
+    try:
+        yield value
+    finally:
+        if isinstance(value, Observed):
+            value._owner = owner
+
 class ContainerProp(BaseProperty):
     # Base class for container-like things; this helps the auto-serialization
-    # and attribute change detection code
-    pass
+    # and attribute change detection code.  List, Dict and Array values are
+    # handed out as Observed containers.
+
+    def __get__(self, obj, type=None):
+        if obj is None:
+            factory = self.default_factory()
+            return self.default if factory is None else factory()
+        val = obj._slots[obj.__slot_index__[self.name]]
+        if val is not _UNSET:
+            return val
+        # the factories are made once per class, see MetaHasProps
+        factory = obj.__default_factories__.get(self.name)
+        if factory is None:
+            return self.default
+        # the container is handed out, and may be mutated, so it has to be
+        # kept
+        val = observe(factory(), obj, self.name)
+        self._store(obj, val)
+        return val
+
+    def __set__(self, obj, value):
+        old = self._raw(obj)
+        if value is old and isinstance(old, Observed):
+            # e.g. "obj.values += 1", the container reported the change
+            return
+        super(ContainerProp, self).__set__(obj, observe(value, obj, self.name))
+        if isinstance(old, Observed) and self._raw(obj) is not old:
+            old._detach()
+
+    def hydrate(self, obj, value):
+        super(ContainerProp, self).hydrate(obj, observe(value, obj, self.name))
+
+    def unchanged(self, obj, new, old):
+        """ Objects with a true hash_content attribute (see
+        ColumnDataSource) also compare large values by a digest of their
+        contents, so that re-assigning identical data is not a change
+        """
+        if self.matches(new, old):
+            return True
+        if getattr(obj, 'hash_content', False) and \
+           new is not None and old is not None:
+            return self.digest(new) == self.digest(old)
+        return False
+
+    @staticmethod
+    def digest(value):
+        """ protocol.content_digest of value, cached on Observed containers
+        until their next change.  Changes nested deeper than the container
+        itself (e.g. to an array in a dict) aren't seen by the cache.
+        """
+        from .protocol import content_digest
+        if not isinstance(value, Observed):
+            return content_digest(value)
+        cached = getattr(value, '_digest', None)
+        if cached is not None and cached[0] == value._version:
+            return cached[1]
+        digest = content_digest(value)
+        value._digest = (value._version, digest)
+        return digest
 
 # container types
 class List(ContainerProp):
@@ -644,6 +1142,9 @@ class List(ContainerProp):
 
     has_ref parameter tells us whether the json representation of this
     list contains references to other objects
+
+    Assigned lists are stored as an observed shallow copy (see observe()),
+    so append to ``obj.attr`` rather than to the list that was assigned.
     """
 
     def __init__(self, default=None, has_ref=False):
@@ -652,17 +1153,13 @@ class List(ContainerProp):
         self.has_ref = has_ref
         BaseProperty.__init__(self, default)
 
-    def __get__(self, obj, type=None):
-        if hasattr(obj, "_"+self.name):
-            return getattr(obj, "_"+self.name)
-        if self.default is None:
-            val = []
-        elif isinstance(self.default, list):
-            val = copy(self.default)
-        else:
-            val = self.default
-        setattr(obj, "_"+self.name, val)
-        return val
+    def default_factory(self):
+        default = self.default
+        if default is None:
+            return list
+        elif isinstance(default, list):
+            return lambda: copy(default)
+        return None
 
 class Dict(ContainerProp):
     """ If a default value is passed in, then a shallow copy of it will be
@@ -670,18 +1167,21 @@ class Dict(ContainerProp):
 
     has_ref parameter tells us whether the json representation of this
     list contains references to other objects
+
+    Assigned dicts are stored as an observed shallow copy (see observe()).
+    Values inside the dict are not observed: replace them (``obj.attr[key]
+    = new``) rather than mutating them in place.
     """
 
     def __init__(self, default={}, has_ref=False):
         BaseProperty.__init__(self, default)
         self.has_ref = has_ref
 
-    def __get__(self, obj, type=None):
-        if not hasattr(obj, "_"+self.name) and isinstance(self.default, dict):
-            setattr(obj, "_"+self.name, copy(self.default))
-            return getattr(obj, "_"+self.name)
-        else:
-            return getattr(obj, "_"+self.name, self.default)
+    def default_factory(self):
+        default = self.default
+        if isinstance(default, dict):
+            return lambda: copy(default)
+        return None
 
 class Tuple(ContainerProp):
 
@@ -693,12 +1193,11 @@ class Array(ContainerProp):
     called on it to create a copy for the default value for each use of
     this property.
     """
-    def __get__(self, obj, type=None):
-        if not hasattr(obj, "_"+self.name) and self.default is not None:
-            setattr(obj, "_"+self.name, np.asarray(self.default))
-            return getattr(obj, "_"+self.name)
-        else:
-            return getattr(obj, "_"+self.name, self.default)
+    def default_factory(self):
+        default = self.default
+        if default is not None:
+            return lambda: np.asarray(default)
+        return None
 
 # OOP things
 class Class(BaseProperty): pass
@@ -714,10 +1213,15 @@ class Instance(BaseProperty):
         # If the constructor for Instance() supplied a class name, we should
         # instantiate that class here, instead of returning the class as the
         # default object
-        if not hasattr(obj, "_"+self.name):
-             if type and self.default and isinstance(self.default, type):
-                setattr(obj, "_"+self.name, self.default())
-        return getattr(obj, "_"+self.name, None)
+        val = self._raw(obj)
+        if val is not _UNSET:
+            return val
+        if obj is not None and type and self.default and \
+           isinstance(self.default, type):
+            val = self.default()
+            self._store(obj, val)
+            return val
+        return None
 
 class This(BaseProperty):
     """ A reference to an instance of the class being defined
@@ -762,6 +1266,11 @@ class Enum(BaseProperty):
             raise ValueError("Invalid value '%r' passed to Enum." % value)
         super(Enum, self).__set__(obj, value)
 
+    def hydrate(self, obj, value):
+        if value not in self.allowed_values:
+            raise ValueError("Invalid value '%r' passed to Enum." % value)
+        super(Enum, self).hydrate(obj, value)
+
 
 Sequence = _dummy
 Mapping = _dummy
@@ -791,6 +1300,11 @@ class Pattern(BaseProperty):
                 raise RuntimeError("Invalid string being assigned to Pattern; must be space delimited numbers, e.g. '2 4 3 2'")
         super(Pattern, self).__set__(obj, arg)
 
+    def hydrate(self, obj, arg):
+        if isinstance(arg, str):
+            arg = [float(x) for x in arg.split()]
+        super(Pattern, self).hydrate(obj, arg)
+
 class Size(Float):
     """ Equivalent to an unsigned int """
 
@@ -3,9 +3,18 @@ import json
 import threading
 import logging
 import time
+import base64
+import hashlib
+import struct
+import sys
+import zlib
 from six.moves import cPickle as pickle
 import numpy as np
 import pandas as pd
+try:
+    from pandas.api.types import infer_dtype
+except ImportError:
+    from pandas.lib import infer_dtype
 
 log = logging.getLogger(__name__)
 
@@ -26,23 +35,480 @@ list data which can be serialized and deserialized
 3.  rpc protocol, a layer around the msgobject and a data object
 """
 millifactor = 10 ** 6.
+
+# dtypes which BokehJS can view directly as a typed array.  64 bit
+# integers have no typed array counterpart, so they are widened to
+# float64, which is exactly what the JSON list path gives the browser.
+binary_dtypes = {
+    'float32' : 'float32',
+    'float64' : 'float64',
+    'int8' : 'int8',
+    'int16' : 'int16',
+    'int32' : 'int32',
+    'uint8' : 'uint8',
+    'uint16' : 'uint16',
+    'uint32' : 'uint32',
+    'int64' : 'float64',
+    'uint64' : 'float64',
+    'bool' : 'uint8',
+    }
+
+def datetime64_to_ms(values):
+    """ Converts a datetime64 array (of any unit) to a float64 array of
+    milliseconds since the epoch, with NaT as NaN
+    """
+    values = np.asarray(values)
+    ms = values.astype('datetime64[us]').astype(np.int64) / 1000.0
+    missing = np.isnat(values)
+    if missing.any():
+        ms[missing] = np.nan
+    return ms
+
+def datetime_column_to_ms(obj):
+    """ Returns the datetime column **obj** as a float64 array of epoch
+    milliseconds, which is what DatetimeAxis and the datetime tickers in
+    BokehJS work with, or None if **obj** isn't a datetime column.
+
+    datetime64 arrays, DatetimeIndex, datetime Series and object arrays
+    made up of Timestamps/datetimes are converted in one pass.  Time zone
+    aware values are converted to UTC.  Naive values are taken to be UTC
+    already, so they display with the wall clock times they hold.
+    """
+    if isinstance(obj, (pd.Series, pd.Index)):
+        if obj.dtype.kind == 'M':
+            index = pd.DatetimeIndex(obj)
+            if index.tz is not None:
+                index = index.tz_convert('UTC').tz_localize(None)
+            return datetime64_to_ms(index.values)
+        values = obj.values
+    else:
+        values = obj
+    if not isinstance(values, np.ndarray):
+        return None
+    if values.dtype.kind == 'M':
+        return datetime64_to_ms(values)
+    if values.dtype.kind == 'O' and values.ndim == 1 and len(values) and \
+       infer_dtype(values, skipna=True) in ('datetime', 'datetime64'):
+        index = pd.to_datetime(values, utc=True).tz_localize(None)
+        return datetime64_to_ms(index.values)
+    return None
+
+def can_encode_binary(obj):
+    """ Returns True if **obj** is a numeric array which can be shipped
+    as a typed binary buffer rather than a JSON list
+    """
+    return isinstance(obj, (np.ndarray, pd.Series, pd.Index)) and \
+           obj.dtype.name in binary_dtypes
+
+def binary_array(obj):
+    """ Returns **obj** as a contiguous little endian array of a dtype
+    BokehJS understands, along with the metadata needed to rebuild it:
+    {'dtype' : 'float64', 'shape' : [n], 'order' : 'little'}
+    """
+    array = np.asarray(obj)
+    dtype = np.dtype(binary_dtypes[array.dtype.name]).newbyteorder('<')
+    array = np.ascontiguousarray(array, dtype=dtype)
+    meta = {'dtype' : dtype.name,
+            'shape' : list(array.shape),
+            'order' : 'little'}
+    return array, meta
+
+def encode_binary_array(obj, buffers=None):
+    """ Encodes a numeric array for transport.  If a list of **buffers**
+    is given, the raw array is appended to it and referenced by index as
+    {'__buffer__' : idx, ...}, for sending as separate binary frames.
+    Otherwise the bytes are inlined as {'__ndarray__' : base64, ...},
+    suitable for embedding in HTML or JSON documents.
+    """
+    array, meta = binary_array(obj)
+    if buffers is not None:
+        meta['__buffer__'] = len(buffers)
+        buffers.append(array)
+    else:
+        meta['__ndarray__'] = base64.b64encode(array.data).decode('ascii')
+    return meta
+
+def decode_binary_array(obj, buffers=None):
+    """ Inverse of encode_binary_array.  Returns a (read only) ndarray
+    viewing the decoded bytes.
+    """
+    if '__buffer__' in obj:
+        data = buffers[obj['__buffer__']]
+    else:
+        data = base64.b64decode(obj['__ndarray__'])
+    dtype = np.dtype(obj['dtype'])
+    if obj.get('order', 'little') == 'little':
+        dtype = dtype.newbyteorder('<')
+    else:
+        dtype = dtype.newbyteorder('>')
+    return np.frombuffer(data, dtype=dtype).reshape(obj['shape'])
+
+def is_binary_array(obj):
+    return isinstance(obj, dict) and \
+           ('__ndarray__' in obj or '__buffer__' in obj) and \
+           'dtype' in obj
+
+# Columns which occur in several data sources of a document are written
+# out once, content addressed by array_digest:
+#
+#   first occurrence   {'__shared__' : digest, '__values__' : column}
+#   later ones         {'__shared__' : digest}
+
+def array_digest(array):
+    """ Returns a hex digest of the dtype, shape and contents of **array** """
+    array = np.ascontiguousarray(array)
+    h = hashlib.sha1()
+    h.update(("%s%s" % (array.dtype.str, array.shape)).encode('ascii'))
+    h.update(array.data)
+    return h.hexdigest()
+
+def content_digest(value):
+    """ Returns a hex digest of the contents of **value**, which can be a
+    nested dict/list of arrays and scalars (e.g. the data of a
+    ColumnDataSource), to compare large values cheaply
+    """
+    h = hashlib.sha1()
+    _update_digest(h, value)
+    return h.hexdigest()
+
+def _update_digest(h, value):
+    if isinstance(value, np.ndarray):
+        h.update(b'a')
+        h.update(array_digest(value).encode('ascii'))
+    elif isinstance(value, dict):
+        h.update(('d%d' % len(value)).encode('ascii'))
+        for key in sorted(value, key=repr):
+            h.update(repr(key).encode('utf-8'))
+            _update_digest(h, value[key])
+    elif isinstance(value, (list, tuple)):
+        if value and isinstance(value[0], (int, float)):
+            array = np.asarray(value)
+            if array.dtype.kind in 'biuf':
+                # a column of numbers, hashed in one go
+                h.update(b'n')
+                h.update(array_digest(array).encode('ascii'))
+                return
+        h.update(('l%d' % len(value)).encode('ascii'))
+        for item in value:
+            _update_digest(h, item)
+    else:
+        h.update(repr(value).encode('utf-8'))
+
+def is_shared_array(obj):
+    return isinstance(obj, dict) and '__shared__' in obj
+
+class SharedArrays(object):
+    """ Tracks the columns already written to a document, so that repeats
+    can be replaced by references to the first copy.  Only numeric
+    columns of at least **min_size** elements are shared.
+    """
+    min_size = 64
+
+    def __init__(self, min_size=None):
+        if min_size is not None:
+            self.min_size = min_size
+        self.digests = set()
+        # id(column) -> (column, digest), so the same column object is
+        # only hashed once.  The column is kept to pin its id.
+        self._by_id = {}
+
+    def digest(self, column):
+        """ Returns the digest of **column**, or None if it isn't shared """
+        if id(column) in self._by_id:
+            return self._by_id[id(column)][1]
+        digest = None
+        if isinstance(column, (np.ndarray, pd.Series, pd.Index, list)) and \
+           len(column) >= self.min_size:
+            ms = datetime_column_to_ms(column)
+            array = np.asarray(column) if ms is None else ms
+            if array.dtype.kind in 'biuf':
+                digest = array_digest(array)
+        self._by_id[id(column)] = (column, digest)
+        return digest
+
+    def share(self, column):
+        """ Returns **column** wrapped as a first occurrence, a reference
+        to an earlier occurrence, or as it is if it isn't shared.
+        """
+        digest = self.digest(column)
+        if digest is None:
+            return column
+        if digest in self.digests:
+            return {'__shared__' : digest}
+        self.digests.add(digest)
+        return {'__shared__' : digest, '__values__' : column}
+
+    def share_columns(self, data):
+        return dict((name, self.share(column)) for name, column in data.items())
+
+def _shared_copy(values):
+    # every source gets its own copy, as columns are patched in place
+    if isinstance(values, list):
+        return list(values)
+    if isinstance(values, np.ndarray) and values.flags.writeable:
+        return values.copy()
+    return values
+
+def resolve_shared_columns(data, arrays):
+    """ Replaces the shared array references in the column dict **data**
+    with the arrays in **arrays** (digest -> column), in place.  Returns
+    the digests which weren't found.
+    """
+    missing = []
+    for name, column in data.items():
+        if is_shared_array(column):
+            if column['__shared__'] in arrays:
+                data[name] = _shared_copy(arrays[column['__shared__']])
+            else:
+                missing.append(column['__shared__'])
+    return missing
+
+def round_significant(values, digits):
+    """ Rounds the float array **values** to **digits** significant
+    digits, so that their JSON text is no longer than it needs to be
+    """
+    values = np.asarray(values, dtype=np.float64)
+    finite = np.isfinite(values) & (values != 0)
+    magnitude = np.zeros(values.shape)
+    magnitude[finite] = np.floor(np.log10(np.abs(values[finite])))
+    exponent = (digits - 1 - magnitude).astype(np.int64)
+    result = values.copy()
+    # dividing an exact integer by an exact power of ten gives the double
+    # nearest to the decimal, whose repr is the short one
+    up = finite & (exponent >= 0)
+    scale = 10.0 ** exponent[up]
+    result[up] = np.round(values[up] * scale) / scale
+    down = finite & (exponent < 0)
+    scale = 10.0 ** -exponent[down]
+    result[down] = np.round(values[down] / scale) * scale
+    return result
+
+def float32_shortest(values):
+    """ Returns the float32 array **values** as float64 values whose reprs
+    are the shortest decimals which still round to the same float32 values
+    (instead of the exact float64 values, whose reprs carry noise digits)
+    """
+    values = np.asarray(values, dtype=np.float32)
+    result = values.astype(np.float64)
+    todo = np.isfinite(result)
+    # 9 significant digits always round trip
+    for digits in range(6, 10):
+        if not todo.any():
+            break
+        rounded = round_significant(result[todo], digits)
+        same = rounded.astype(np.float32) == values[todo]
+        indices = np.flatnonzero(todo)[same]
+        result.flat[indices] = rounded[same]
+        todo.flat[indices] = False
+    return result
+
+def delta_encode(values):
+    """ Encodes a non decreasing column of integer values (such as epoch
+    millisecond timestamps) as its first value and the differences
+    between successive values: {'__delta__' : deltas, 'start' : first}.
+    Returns None if the column doesn't qualify.
+    """
+    ms = datetime_column_to_ms(values)
+    values = np.asarray(values) if ms is None else ms
+    if values.ndim != 1 or len(values) < 2 or values.dtype.kind not in 'iuf':
+        return None
+    deltas = np.diff(values)
+    if values.dtype.kind == 'f':
+        if not np.isfinite(values).all() or (deltas != np.round(deltas)).any():
+            return None
+    if (deltas < 0).any():
+        return None
+    deltas = deltas.astype(np.int64)
+    if len(deltas) and deltas.max() <= np.iinfo(np.int32).max:
+        deltas = deltas.astype(np.int32)
+    return {'__delta__' : deltas, 'start' : values[0].item()}
+
+def delta_decode(obj):
+    deltas = np.asarray(obj['__delta__'], dtype=np.float64)
+    values = np.empty(len(deltas) + 1)
+    values[0] = obj['start']
+    np.cumsum(deltas, out=values[1:])
+    values[1:] += obj['start']
+    return values
+
+def is_delta_array(obj):
+    return isinstance(obj, dict) and '__delta__' in obj and 'start' in obj
+
+def apply_precision(column, policy):
+    """ Returns **column** reduced according to **policy**:
+
+        'float32' : float columns are cast to float32
+        'delta' : delta_encode, for increasing integer valued columns
+        an int : float columns are rounded to that many significant digits
+
+    Columns the policy doesn't apply to are returned as they are.
+    """
+    if policy is None or isinstance(column, dict):
+        return column
+    if policy == 'delta':
+        encoded = delta_encode(column)
+        return column if encoded is None else encoded
+    array = np.asarray(column)
+    if array.dtype.kind != 'f':
+        return column
+    if policy == 'float32':
+        return array.astype(np.float32)
+    if isinstance(policy, int) and not isinstance(policy, bool):
+        return round_significant(array, policy)
+    raise ValueError("unknown precision policy %r" % (policy,))
+
+def apply_precision_columns(data, precision):
+    """ Applies a ColumnDataSource precision setting to the column dict
+    **data**, returning a new dict.  **precision** is a single policy for
+    all columns, or a dict of column name to policy.
+    """
+    if precision is None:
+        return data
+    if isinstance(precision, dict):
+        return dict((name, apply_precision(column, precision.get(name)))
+                    for name, column in data.items())
+    return dict((name, apply_precision(column, precision))
+                for name, column in data.items())
+
 class NumpyJSONEncoder(json.JSONEncoder):
+    """ JSON encoder which understands numpy and pandas values.
+
+    With **binary** set, numeric arrays are emitted with
+    encode_binary_array instead of as lists.  If **buffers** is also a
+    list, the arrays are collected there for out of band transport.
+    """
+    def __init__(self, *args, **kwargs):
+        self.binary = kwargs.pop('binary', False)
+        self.buffers = kwargs.pop('buffers', None)
+        super(NumpyJSONEncoder, self).__init__(*args, **kwargs)
+
     def default(self, obj):
-        if isinstance(obj, (np.ndarray, pd.Series)):
+        if isinstance(obj, (np.ndarray, pd.Series, pd.Index)):
+            # whole datetime columns at once, rather than per Timestamp
+            ms = datetime_column_to_ms(obj)
+            if ms is not None:
+                obj = ms
+            if self.binary and can_encode_binary(obj):
+                return encode_binary_array(obj, self.buffers)
+            if obj.dtype == np.float32:
+                return float32_shortest(obj).tolist()
             return obj.tolist()
         elif isinstance(obj, np.number):
             if isinstance(obj, np.integer):
                 return int(obj)
             else:
                 return float(obj)
-        elif isinstance(obj, pd.tslib.Timestamp):
+        elif isinstance(obj, pd.Timestamp):
             return obj.value / millifactor
+        elif isinstance(obj, np.datetime64):
+            return datetime64_to_ms(obj).item()
         else:
             return super(NumpyJSONEncoder, self).default(obj)
 
 def serialize_json(obj, encoder=NumpyJSONEncoder, **kwargs):
     return json.dumps(obj, cls=encoder, **kwargs)
-deserialize_json = json.loads
+
+def serialize_json_buffers(obj, encoder=NumpyJSONEncoder, **kwargs):
+    """ Serializes **obj** with its numeric arrays pulled out as raw
+    buffers.  Returns (jsonstring, buffers)
+    """
+    buffers = []
+    jsonstring = json.dumps(obj, cls=encoder, binary=True,
+                            buffers=buffers, **kwargs)
+    return jsonstring, buffers
+
+def deserialize_json(jsonstring, buffers=None, **kwargs):
+    """ json.loads, which also turns any encoded binary or delta arrays
+    back into numpy arrays, and resolves shared array references.
+    """
+    if isinstance(jsonstring, bytes):
+        jsonstring = jsonstring.decode('utf-8')
+    if '"__ndarray__"' not in jsonstring and '"__buffer__"' not in jsonstring \
+       and '"__delta__"' not in jsonstring and '"__shared__"' not in jsonstring:
+        return json.loads(jsonstring, **kwargs)
+    shared = {}
+    def hook(obj):
+        if is_binary_array(obj):
+            return decode_binary_array(obj, buffers)
+        if is_delta_array(obj):
+            return delta_decode(obj)
+        if is_shared_array(obj):
+            # references come after the first occurrence in the text;
+            # ones to arrays stored elsewhere are left for the caller
+            if '__values__' in obj:
+                shared[obj['__shared__']] = obj['__values__']
+                return obj['__values__']
+            if obj['__shared__'] in shared:
+                return _shared_copy(shared[obj['__shared__']])
+            return obj
+        return obj
+    return json.loads(jsonstring, object_hook=hook, **kwargs)
+
+# Data frames come in pairs: a fixed layout header followed by the payload.
+#
+#   magic   4s   b'BKAR'
+#   dtype   B    index into frame_dtypes (0xff for pickled objects)
+#   ndim    B
+#   flags   H    FLAG_* bits below
+#   shape   ndim * Q
+#
+# All fields are little endian.  For arrays the payload is the raw array
+# memory, so it can be sent and received without copies.
+frame_magic = b'BKAR'
+frame_header = struct.Struct('<4sBBH')
+frame_dtypes = ['bool', 'int8', 'uint8', 'int16', 'uint16', 'int32', 'uint32',
+                'int64', 'uint64', 'float16', 'float32', 'float64',
+                'complex64', 'complex128', 'datetime64[ns]', 'timedelta64[ns]']
+frame_dtype_codes = dict((name, code) for code, name in enumerate(frame_dtypes))
+PICKLE_CODE = 0xff
+FLAG_BIG_ENDIAN = 0x1
+FLAG_FORTRAN = 0x2
+
+_frame_structs = {}
+def _frame_struct(ndim):
+    if ndim not in _frame_structs:
+        _frame_structs[ndim] = struct.Struct('<4sBBH%dQ' % ndim)
+    return _frame_structs[ndim]
+
+_frame_dtype_cache = {}
+def _frame_dtype(code, flags):
+    key = (code, flags & FLAG_BIG_ENDIAN)
+    if key not in _frame_dtype_cache:
+        dtype = np.dtype(frame_dtypes[code])
+        if dtype.itemsize > 1:
+            dtype = dtype.newbyteorder('>' if flags & FLAG_BIG_ENDIAN else '<')
+        _frame_dtype_cache[key] = dtype
+    return _frame_dtype_cache[key]
+
+_frame_code_cache = {}
+def _frame_code(dtype):
+    """ Returns (dtype_code, flags) for an array dtype, PICKLE_CODE for
+    dtypes which can't be sent as raw memory
+    """
+    try:
+        return _frame_code_cache[dtype]
+    except KeyError:
+        pass
+    code = frame_dtype_codes.get(dtype.name, PICKLE_CODE)
+    flags = 0
+    if dtype.byteorder == '>' or \
+       (dtype.byteorder == '=' and sys.byteorder == 'big'):
+        flags |= FLAG_BIG_ENDIAN
+    _frame_code_cache[dtype] = (code, flags)
+    return code, flags
+
+def pack_frame_header(dtype_code, shape=(), flags=0):
+    return _frame_struct(len(shape)).pack(frame_magic, dtype_code, len(shape),
+                                          flags, *shape)
+
+def unpack_frame_header(header):
+    """ Returns (dtype_code, shape, flags), or None if **header** is not a
+    frame header (i.e. the pickled metadata of the old format)
+    """
+    if header[:4] != frame_magic:
+        return None
+    fields = _frame_struct(bytearray(header[5:6])[0]).unpack(header)
+    return fields[1], fields[4:], fields[3]
 
 def default_serialize_data(data):
     """
@@ -53,15 +519,78 @@ def default_serialize_data(data):
     Returns
     ---------
     output : list of length 2n, where n is the number of objects.
-        first item is pickled metadata, second is the data itself.
-        for numpy arrays
-        metadata : {'datatype' : 'numpy', 'dtype' : 'dtype', 'shape' : [2,2]}
-        data : the array itself
+        first item is a fixed layout header (see frame_header), second
+        is the data itself.
+        for numpy arrays of simple dtypes
+        header : dtype code, shape and byte order/layout flags
+        data : a memoryview on the array (no copy for contiguous arrays)
         for arbitrary python objects
-        metadata : {'datatype' : 'pickle'}
+        header : PICKLE_CODE
         data : pickled object
     """
     output = []
+    for d in data:
+        if isinstance(d, np.ndarray):
+            code, flags = _frame_code(d.dtype)
+        else:
+            code = PICKLE_CODE
+        if code == PICKLE_CODE:
+            output.append(pack_frame_header(PICKLE_CODE))
+            output.append(pickle.dumps(d, protocol=-1))
+            continue
+        if not d.flags.c_contiguous:
+            if d.flags.f_contiguous:
+                flags |= FLAG_FORTRAN
+                d = d.T
+            else:
+                d = np.ascontiguousarray(d)
+        shape = d.shape[::-1] if flags & FLAG_FORTRAN else d.shape
+        output.append(pack_frame_header(code, shape, flags))
+        output.append(d.data)
+    return output
+
+def default_deserialize_data(input, allow_pickle=False):
+    """
+    Parmeters
+    ---------
+    input : list of strings from default_serialize_data
+    allow_pickle : whether to unpickle non array objects (and the
+        headers of the older, pickled metadata format).  Unpickling runs
+        arbitrary code, only pass True for trusted, local legacy data
+
+    Returns
+    ---------
+    output : list of python objects, mostly numpy arrays.  Arrays are
+        read only views on the received frames
+    """
+    output = []
+    for curr_index in range(0, len(input), 2):
+        header = unpack_frame_header(input[curr_index])
+        payload = input[curr_index + 1]
+        if header is None:
+            if not allow_pickle:
+                raise ValueError("refusing to unpickle data message")
+            output.extend(pickle_deserialize_data(input[curr_index:curr_index + 2]))
+            continue
+        code, shape, flags = header
+        if code == PICKLE_CODE:
+            if not allow_pickle:
+                raise ValueError("refusing to unpickle data message")
+            output.append(pickle.loads(payload))
+            continue
+        array = np.frombuffer(payload, dtype=_frame_dtype(code, flags))
+        if flags & FLAG_FORTRAN:
+            array = array.reshape(shape[::-1]).T
+        else:
+            array = array.reshape(shape)
+        output.append(array)
+    return output
+
+def pickle_serialize_data(data):
+    """ The original data message format, pickled metadata dicts followed
+    by the array.  Kept for compatibility and benchmarking.
+    """
+    output = []
 
     def add_numpy(d):
         metadata =  {'dtype' : d.dtype,
@@ -89,15 +618,8 @@ def default_serialize_data(data):
 
     return output
 
-def default_deserialize_data(input):
-    """
-    Parmeters
-    ---------
-    input : list of strings from default_serialize_data
-
-    Returns
-    ---------
-    output : list of python objects, mostly numpy arrays
+def pickle_deserialize_data(input):
+    """ Decodes the output of pickle_serialize_data
     """
     output = []
     curr_index = 0
@@ -114,6 +636,63 @@ def default_deserialize_data(input):
         curr_index += 2
     return output
 
+"""
+payload compression, for http bodies (gzip/deflate content encodings) and
+websocket messages (deflate).  "deflate" is the zlib wrapped format, as in
+http and the browser DecompressionStream
+"""
+
+compression_threshold = 1024
+compression_level = 6
+_compression_wbits = {'gzip' : 16 + zlib.MAX_WBITS,
+                      'deflate' : zlib.MAX_WBITS}
+
+def _as_bytes(data):
+    if isinstance(data, bytes):
+        return data
+    if isinstance(data, memoryview):
+        return data.tobytes()
+    return data.encode('utf-8')
+
+def compress(data, encoding='gzip', level=None):
+    if level is None:
+        level = compression_level
+    compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                  _compression_wbits[encoding])
+    return compressor.compress(_as_bytes(data)) + compressor.flush()
+
+def decompress(data, encoding='gzip'):
+    return zlib.decompress(_as_bytes(data), _compression_wbits[encoding])
+
+def should_compress(data, threshold=None):
+    if threshold is None:
+        threshold = compression_threshold
+    return len(data) >= threshold
+
+def accepted_encoding(accept_encoding):
+    """picks gzip or deflate from an Accept-Encoding header value,
+    or returns None
+    """
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(","):
+        parts = item.strip().split(";")
+        name = parts[0].strip().lower()
+        quality = 1.0
+        for param in parts[1:]:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name] = quality
+    for name in ('gzip', 'deflate'):
+        if accepted.get(name, accepted.get('*', 0.0)) > 0:
+            return name
+    return None
+
 serialize_web = serialize_json
 
 deserialize_web = deserialize_json
@@ -1,6 +1,6 @@
 import uuid
 from .. import models 
-from ...objects import PlotObject, recursively_traverse_plot_object
+from ...objects import PlotObject
 from ...session import PlotContext
 import logging
 log = logging.getLogger(__name__)
@@ -95,13 +95,15 @@ def prune_and_get_valid_models(doc, session, delete=False):
     wipe out any models that are orphaned.  Also call transform_models, which
     performs any backwards compatability data transformations.  
     """
-    objs = recursively_traverse_plot_object(session.plotcontext)
+    graph = session.reference_graph
+    objs = graph.reachable(session.plotcontext)
     print("num models", len(objs))
     if delete:
-        for obj in session._models.values():
+        for obj in list(session._models.values()):
             if obj not in objs:
                 #not impl yet...
                 session.del_obj(obj)
+                graph.discard(obj)
     return objs
 
 def new_doc(flaskapp, docid, title, session, rw_users=None, r_users=None,
@@ -1,6 +1,8 @@
 import requests
 import uuid
 import logging
+import re
+import threading
 from six.moves import cPickle as pickle
 import redis
 from .. import bbmodel, protocol
@@ -9,7 +11,8 @@ from .models import docs
 import numpy as np
 logger = logging.getLogger(__name__)
 
-from ..objects import PlotObject, Plot
+from ..objects import PlotObject, Plot, ColumnDataSource
+from ..data import stream_columns
 from ..session import PlotServerSession
 
 """
@@ -27,6 +30,23 @@ def modelkey(typename, docid, modelid):
 def callbackskey(typename, docid, modelid):
     return 'bbcallback:%s:%s:%s' % (typename, docid, modelid)
 
+def streamkey(typename, docid, modelid):
+    return 'bbstream:%s:%s:%s' % (typename, docid, modelid)
+
+def arrayskey(docid):
+    return 'bbarrays:' + docid
+
+def versionkey(docid):
+    return 'bbversion:' + docid
+
+def changeskey(docid):
+    return 'bbchanges:' + docid
+
+class DocumentChanged(Exception):
+    """a document changed while it was being loaded"""
+
+shared_ref_re = re.compile(r'"__shared__": "([0-9a-f]+)"')
+
 def parse_modelkey(modelkey):
     _, typename, docid, modelid = modelkey.split(":")
     return (typename, docid, modelid)
@@ -139,6 +159,13 @@ class RedisSession(PlotServerSession):
     a user's documents.  uses redis directly.  This probably shouldn't
     inherit from PlotServerSession, we need to refactor this abit.
     """
+    # once this many stream chunks are queued up for a model, they are
+    # folded into the stored model json
+    stream_compact_length = 256
+    # how many changes the change log of a document keeps, clients which
+    # are further behind have to load the whole document again
+    change_log_length = 1000
+
     def __init__(self, redisconn, doc, 
                  root_url="http://localhost:5006/", apikey=""):
         if isinstance(doc, basestring):
@@ -147,9 +174,15 @@ class RedisSession(PlotServerSession):
             self.set_doc(doc)
         self.r = redisconn
         self._models = {}
+        self._pinned = {}
+        self._young = set()
         self.raw_js_objs = []
         self.root_url = root_url
         self.apikey = apikey
+        # PlotServerSession.__init__ isn't called, it talks to the server
+        self.version = None
+        self._written = set()
+        self._lock = threading.RLock()
         
     def set_doc(self, doc):
         self.doc = doc
@@ -164,25 +197,112 @@ class RedisSession(PlotServerSession):
             self.doc, self, delete=delete
             )
         to_keep = set([x._id for x in all_models])
-        for k in self._models.keys():
+        for k in list(self._models.keys()):
             if k not in to_keep:
                 del self._models[k]
+        if delete:
+            self.collect_arrays()
         return
+
+    def _resolve_arrays(self, data, arrays, conn=None):
+        """replaces shared array references in the column dict data with
+        the arrays stored in the document's bbarrays hash.  arrays (digest
+        -> column) caches the ones fetched, for the duration of one load.
+        Columns whose array is missing from the hash are dropped
+        """
+        if conn is None:
+            conn = self.r
+        missing = protocol.resolve_shared_columns(data, arrays)
+        if missing:
+            missing = list(set(missing))
+            for digest, text in zip(missing,
+                                    conn.hmget(arrayskey(self.docid), missing)):
+                if text is not None:
+                    arrays[digest] = protocol.deserialize_json(text)
+            if protocol.resolve_shared_columns(data, arrays):
+                for name, column in list(data.items()):
+                    if not protocol.is_shared_array(column):
+                        continue
+                    logger.error("document %s: shared array %s of column %s "
+                                 "is missing, dropping the column",
+                                 self.docid, column['__shared__'], name)
+                    del data[name]
+        return data
+
+    def _share_arrays(self, data, arrays):
+        """replaces the shareable columns in data with references, adding
+        them to arrays (digest -> serialized column).  Every referenced
+        array is written again with the model, another session may have
+        collected it since it was last stored
+        """
+        shared = protocol.SharedArrays()
+        result = {}
+        for name, column in data.items():
+            digest = shared.digest(column)
+            if digest is None:
+                result[name] = column
+                continue
+            if digest not in arrays:
+                arrays[digest] = self.serialize(column)
+            result[name] = {'__shared__' : digest}
+        return result
+
+    def collect_arrays(self):
+        """deletes the shared arrays which no model refers to anymore.
+        The document's models and arrays are watched, and the collection
+        is started over if a store changes them meanwhile, which would
+        otherwise lose the arrays of models being stored
+        """
+        dkey = dockey(self.docid)
+        akey = arrayskey(self.docid)
+        with self.r.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(dkey, akey)
+                    keys = pipe.smembers(dkey)
+                    used = set()
+                    if keys:
+                        pipe.watch(*keys)
+                        for text in pipe.mget(keys):
+                            if text is not None:
+                                if isinstance(text, bytes):
+                                    text = text.decode('utf-8')
+                                used.update(shared_ref_re.findall(text))
+                    unused = [d for d in pipe.hkeys(akey) \
+                              if (d.decode('ascii') if isinstance(d, bytes) \
+                                  else d) not in used]
+                    if not unused:
+                        return
+                    pipe.multi()
+                    pipe.hdel(akey, *unused)
+                    pipe.execute()
+                    return
+                except redis.WatchError:
+                    continue
     
     def load_all(self, asdict=False):
         doc_keys = self.r.smembers(dockey(self.docid))
         attrs = self.r.mget(doc_keys)
         if asdict:
             return attrs
+        doc_keys = list(doc_keys)
+        with self.r.pipeline(transaction=False) as pipe:
+            for k in doc_keys:
+                pipe.lrange(k.replace("bbmodel", "bbstream", 1), 0, -1)
+            streams = pipe.execute()
         data = []
-        for k, attr in zip(doc_keys, attrs):
+        arrays = {}
+        for k, attr, chunks in zip(doc_keys, attrs, streams):
             typename, _, modelid = parse_modelkey(k)
             attr = protocol.deserialize_json(attr)
+            if isinstance(attr.get('data'), dict):
+                self._resolve_arrays(attr['data'], arrays)
+            self._apply_stream(attr, chunks)
             data.append({'type' : typename,
                          'attributes' : attr})
         models = self.load_broadcast_attrs(data, events=None)
         for m in models:
-            m._dirty = False
+            m._mark_clean()
         return models
     
     def store_broadcast_attrs(self, attrs):
@@ -206,17 +326,79 @@ class RedisSession(PlotServerSession):
         keys = [modelkey(m.__view_model__, self.docid, m._id) \
                 for m in to_store]
         models = [m.vm_serialize() for m in to_store]
-        for m in models:
-            m['doc'] = self.docid
+        arrays = {}
+        for m, attrs in zip(to_store, models):
+            attrs['doc'] = self.docid
+            if self.share_arrays and isinstance(m, ColumnDataSource) and \
+               isinstance(attrs.get('data'), dict):
+                # columns are stored once per document, in the bbarrays hash
+                attrs['data'] = self._share_arrays(attrs['data'], arrays)
         models = [self.serialize(m) for m in models]
         dkey = dockey(self.docid)
         data = dict(zip(keys, models))
         for k,v in data.items():
             logger.debug('key: %s', k)
             logger.debug('val: %s', v)
-        self.r.mset(data)
-        self.r.sadd(dkey, *keys)
-        
+        # the arrays and the models referring to them are written in one
+        # transaction, collect_arrays never sees the arrays alone
+        with self.r.pipeline() as pipe:
+            if arrays:
+                pipe.hset(arrayskey(self.docid), mapping=arrays)
+            pipe.mset(data)
+            pipe.sadd(dkey, *keys)
+            # stored data now includes any streamed rows
+            pipe.delete(*[streamkey(m.__view_model__, self.docid, m._id) \
+                          for m in to_store])
+            pipe.execute()
+
+    def _apply_stream(self, attrs, chunks):
+        for chunk in chunks:
+            chunk = protocol.deserialize_json(chunk)
+            attrs['data'] = stream_columns(attrs.get('data', {}),
+                                           chunk['data'], chunk['rollover'])
+
+    def append_stream(self, typename, modelid, new_data, rollover=None,
+                      change=None, clientid=None):
+        """appends rows to the data of a stored model, without loading or
+        rewriting the model itself.  The rows are queued in a redis list
+        which load_all merges in.  change, the modelstream message for the
+        rows, is recorded by record_change in the same transaction, so that
+        no load sees the rows at the version before
+        """
+        skey = streamkey(typename, self.docid, modelid)
+        chunk = self.serialize({'data' : new_data, 'rollover' : rollover})
+        if change is None:
+            length = self.r.rpush(skey, chunk)
+        else:
+            self.record_change(change, clientid,
+                               write=lambda pipe: pipe.rpush(skey, chunk))
+            length = self.r.llen(skey)
+        if length > self.stream_compact_length:
+            self.compact_stream(typename, modelid)
+
+    def compact_stream(self, typename, modelid):
+        """folds queued stream chunks into the stored model json"""
+        mkey = modelkey(typename, self.docid, modelid)
+        skey = streamkey(typename, self.docid, modelid)
+        with self.r.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(mkey, skey)
+                    attrs = protocol.deserialize_json(pipe.get(mkey))
+                    if isinstance(attrs.get('data'), dict):
+                        self._resolve_arrays(attrs['data'], {}, pipe)
+                    self._apply_stream(attrs, pipe.lrange(skey, 0, -1))
+                    pipe.multi()
+                    pipe.set(mkey, self.serialize(attrs))
+                    pipe.delete(skey)
+                    pipe.execute()
+                    return
+                except redis.WatchError:
+                    continue
+
+    def store_stream(self, obj, new_data, rollover=None):
+        self.append_stream(obj.__view_model__, obj._id, new_data, rollover)
+
     def del_obj(self, obj):
         self.del_objs([obj])
         
@@ -225,6 +407,7 @@ class RedisSession(PlotServerSession):
             mkey = modelkey(m.__view_model__, self.docid, m._id)
             self.r.srem(dockey(self.docid), mkey)
             self.r.delete(mkey)
+            self.r.delete(streamkey(m.__view_model__, self.docid, m._id))
         
     def load_all_callbacks(self, get_json=False):
         """get_json = return json of callbacks, rather than
@@ -239,6 +422,78 @@ class RedisSession(PlotServerSession):
             return callbacks
         self.load_callbacks_json(callbacks)
         
+    def doc_version(self):
+        """the version of the document, i.e. the number of changes
+        recorded with record_change so far
+        """
+        return int(self.r.get(versionkey(self.docid)) or 0)
+
+    def load_version(self, version):
+        """loads the models as they are at version of the document.  Raises
+        DocumentChanged if a change was recorded meanwhile, as its rows
+        might have been loaded already
+        """
+        self.load()
+        if self.doc_version() != version:
+            raise DocumentChanged(self.docid)
+
+    def record_change(self, msgobj, clientid=None, write=None):
+        """appends msgobj, a websocket message with changes to the models
+        (modelpush, modelpatch, modelstream or modeldel), to the change log of the
+        document.  Sets msgobj['version'] to the new version of the
+        document, which is returned, and msgobj['origin'] to clientid, the
+        client which made the change, so that it can skip it when catching
+        up.  write, if given, is called with the transaction's pipeline to
+        queue the commands making the change, which are then applied
+        together with the version bump
+        """
+        vkey = versionkey(self.docid)
+        ckey = changeskey(self.docid)
+        if clientid is not None:
+            msgobj['origin'] = clientid
+        with self.r.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(vkey)
+                    version = int(pipe.get(vkey) or 0) + 1
+                    msgobj['version'] = version
+                    pipe.multi()
+                    if write is not None:
+                        write(pipe)
+                    pipe.set(vkey, version)
+                    pipe.rpush(ckey, self.serialize(msgobj))
+                    pipe.ltrim(ckey, -self.change_log_length, -1)
+                    pipe.execute()
+                    return version
+                except redis.WatchError:
+                    continue
+
+    def changes_since(self, since):
+        """returns the current version of the document and the serialized
+        messages of the changes made after version since, oldest first.
+        Instead of the messages, returns None if the change log doesn't go
+        back that far
+        """
+        vkey = versionkey(self.docid)
+        ckey = changeskey(self.docid)
+        with self.r.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(vkey)
+                    version = int(pipe.get(vkey) or 0)
+                    length = pipe.llen(ckey)
+                    if since >= version:
+                        return version, []
+                    # the log holds versions version - length + 1 .. version
+                    if since < version - length or since < 0:
+                        return version, None
+                    pipe.multi()
+                    pipe.lrange(ckey, since - version, -1)
+                    changes = pipe.execute()[0]
+                    return version, changes
+                except redis.WatchError:
+                    continue
+
     def store_callbacks(self, to_store):
         for callbacks in to_store:
             typename = callbacks['type']
@@ -13,7 +13,7 @@ import redis
 #server imports
 from .app import app as bokeh_app
 from . import wsmanager
-from .serverbb import ContinuumModelsStorage
+from .serverbb import ContinuumModelsStorage, RedisSession
 #import objects so that we can resolve them
 from .. import protocol, bbmodel, objects, glyphs
 bbmodel.load_special_types()
@@ -37,7 +37,18 @@ def prepare_app(rhost='127.0.0.1', rport=REDIS_PORT, start_redis=True):
     app.register_blueprint(bokeh_app)
     bokeh_app.redis_port = rport
     bokeh_app.start_redis = start_redis
-    bokeh_app.wsmanager = wsmanager.WebSocketManager()
+    bokeh_app.compression = getattr(bokeh_app, 'compression', True)
+    bokeh_app.compression_threshold = getattr(
+        bokeh_app, 'compression_threshold', protocol.compression_threshold)
+    bokeh_app.wsmanager = wsmanager.WebSocketManager(
+        compression=bokeh_app.compression,
+        compression_threshold=bokeh_app.compression_threshold)
+    bokeh_app.binary_arrays = getattr(bokeh_app, 'binary_arrays', False)
+    RedisSession.binary_arrays = bokeh_app.binary_arrays
+    # serialized document responses, per document version
+    from .views import ResponseCache
+    bokeh_app.response_cache = ResponseCache(
+        getattr(bokeh_app, 'response_cache_size', 128))
     def auth(auth, docid):
         doc = docs.Doc.load(bokeh_app.model_redis, docid)
         status = mconv.can_write_doc_api(doc, auth, bokeh_app)
@@ -0,0 +1,42 @@
+import redis
+
+from . import test_utils
+from ..serverbb import RedisSession
+from ... import protocol
+
+class TestChangeLog(test_utils.BokehServerTestCase):
+    def setUp(self):
+        super(TestChangeLog, self).setUp()
+        self.sess = RedisSession(redis.Redis(port=6899), 'defaultdoc')
+        self.sess.change_log_length = 3
+
+    def test_changes_since(self):
+        sess = self.sess
+        assert sess.doc_version() == 0
+        assert sess.changes_since(0) == (0, [])
+        for i in range(5):
+            msgobj = {'msgtype' : 'modelpatch', 'patches' : []}
+            assert sess.record_change(msgobj) == i + 1
+            assert msgobj['version'] == i + 1
+        assert sess.doc_version() == 5
+        version, changes = sess.changes_since(3)
+        assert version == 5
+        assert [protocol.deserialize_json(c)['version'] for c in changes] == [4, 5]
+        version, changes = sess.changes_since(2)
+        assert [protocol.deserialize_json(c)['version'] for c in changes] == [3, 4, 5]
+        assert sess.changes_since(5) == (5, [])
+        # truncated
+        assert sess.changes_since(1) == (5, None)
+
+    def test_origin_and_stream(self):
+        sess = self.sess
+        msgobj = {'msgtype' : 'modelstream', 'type' : 'ColumnDataSource',
+                  'id' : 'source', 'attr' : 'data', 'data' : {'x' : [1]},
+                  'rollover' : None}
+        sess.append_stream('ColumnDataSource', 'source', {'x' : [1]},
+                           change=msgobj, clientid='client')
+        assert msgobj['version'] == 1
+        assert msgobj['origin'] == 'client'
+        assert sess.r.llen('bbstream:ColumnDataSource:defaultdoc:source') == 1
+        change = protocol.deserialize_json(sess.changes_since(0)[1][0])
+        assert change['origin'] == 'client'
@@ -0,0 +1,53 @@
+import redis
+
+from . import test_utils
+from ..serverbb import RedisSession, DocumentChanged
+from ...objects import Range1d, ColumnDataSource
+
+class TestRedisSession(test_utils.BokehServerTestCase):
+    def setUp(self):
+        super(TestRedisSession, self).setUp()
+        self.sess = RedisSession(redis.Redis(port=6899), 'defaultdoc')
+
+    def test_store_all(self):
+        r = Range1d(start=1, end=2)
+        source = ColumnDataSource(data={'x' : list(range(100))})
+        self.sess.add(r, source)
+        stored = self.sess.store_all()
+        assert set(stored) == set([r, source])
+        assert not r._dirty
+        loaded = RedisSession(redis.Redis(port=6899), 'defaultdoc')
+        models = dict((m._id, m) for m in loaded.load_all())
+        assert models[r._id].end == 2
+        assert list(models[source._id].data['x']) == list(range(100))
+
+    def test_collected_arrays_are_written_again(self):
+        source = ColumnDataSource(data={'x' : list(range(100))})
+        self.sess.add(source)
+        self.sess.store_all()
+        # e.g. collect_arrays in another process, while no model used it
+        self.sess.r.delete('bbarrays:defaultdoc')
+        source.data['y'] = list(range(100, 200))
+        self.sess.store_all()
+        loaded = RedisSession(redis.Redis(port=6899), 'defaultdoc')
+        models = dict((m._id, m) for m in loaded.load_all())
+        assert list(models[source._id].data['x']) == list(range(100))
+
+    def test_missing_array_dropped(self):
+        source = ColumnDataSource(data={'x' : list(range(100)), 'y' : [1]})
+        self.sess.add(source)
+        self.sess.store_all()
+        self.sess.r.delete('bbarrays:defaultdoc')
+        loaded = RedisSession(redis.Redis(port=6899), 'defaultdoc')
+        models = dict((m._id, m) for m in loaded.load_all())
+        assert list(models[source._id].data.keys()) == ['y']
+
+    def test_load_version(self):
+        version = self.sess.doc_version()
+        self.sess.record_change({'msgtype' : 'modelpatch', 'patches' : []})
+        loaded = RedisSession(redis.Redis(port=6899), 'defaultdoc')
+        loaded.load_all = lambda: []
+        loaded.load = loaded.load_all
+        with self.assertRaises(DocumentChanged):
+            loaded.load_version(version)
+        loaded.load_version(version + 1)
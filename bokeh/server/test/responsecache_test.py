@@ -0,0 +1,23 @@
+import unittest
+
+from ..views import ResponseCache
+
+class TestResponseCache(unittest.TestCase):
+    def test_lru(self):
+        cache = ResponseCache(maxsize=2)
+        cache.put(('doc1', 1, 'a'), 'a1')
+        cache.put(('doc1', 1, 'b'), 'b1')
+        assert cache.get(('doc1', 1, 'a')) == 'a1'
+        cache.put(('doc1', 1, 'c'), 'c1')
+        # b was the least recently used
+        assert cache.get(('doc1', 1, 'b')) is None
+        assert cache.get(('doc1', 1, 'a')) == 'a1'
+
+    def test_newer_version_drops_older(self):
+        cache = ResponseCache()
+        cache.put(('doc1', 1, 'a'), 'a1')
+        cache.put(('doc2', 1, 'a'), 'other')
+        cache.put(('doc1', 2, 'b'), 'b2')
+        assert cache.get(('doc1', 1, 'a')) is None
+        assert cache.get(('doc2', 1, 'a')) == 'other'
+        assert cache.get(('doc1', 2, 'b')) == 'b2'
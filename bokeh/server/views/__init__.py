@@ -1,11 +1,127 @@
-from flask import current_app
+import threading
+from collections import OrderedDict
+
+from flask import current_app, request
+from ... import protocol
+from ..app import app
+from ..serverbb import RedisSession, DocumentChanged
+
+def _encode_json(jsonstring):
+    """the body and headers of a json response with jsonstring, which
+    is gzip/deflate encoded if larger than app.compression_threshold
+    and the client accepts it
+    """
+    headers = {}
+    if getattr(app, 'compression', False):
+        headers['Vary'] = 'Accept-Encoding'
+        encoding = protocol.accepted_encoding(
+            request.headers.get('Accept-Encoding'))
+        if encoding and protocol.should_compress(
+                jsonstring, getattr(app, 'compression_threshold', None)):
+            jsonstring = protocol.compress(jsonstring, encoding)
+            headers['Content-Encoding'] = encoding
+    return jsonstring, headers
+
 def make_json(jsonstring, status_code=200, headers={}):
     """like jsonify, except accepts string, so we can do our own custom
     json serialization.  should move this to continuumweb later
+
+    bodies larger than app.compression_threshold are gzip/deflate encoded
+    when the client accepts it
     """
+    jsonstring, encoding_headers = _encode_json(jsonstring)
+    headers = dict(headers)
+    headers.update(encoding_headers)
     return current_app.response_class(response=jsonstring,
                                       status=status_code,
                                       headers=headers,
                                       mimetype='application/json')
 
+class ResponseCache(object):
+    """a bounded LRU of encoded response bodies, keyed by (docid, version
+    of the document, ...).  Writes to a document bump its version (see
+    RedisSession.record_change), so the entries of older versions are
+    never hit again; they are dropped once a newer one is cached
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is not None:
+                self._entries[key] = value
+            return value
+
+    def put(self, key, value):
+        docid, version = key[:2]
+        with self._lock:
+            for k in [k for k in self._entries \
+                      if k[0] == docid and k[1] < version]:
+                del self._entries[k]
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
 
+def versioned_json(docid, version, name, build, headers={}):
+    """the json response with name (e.g. a typename) of the document docid
+    at version.  build() returns its serialized json, it is only called if
+    the response isn't in app.response_cache.  The response has an ETag for
+    the version, and requests with a matching If-None-Match get an empty
+    304 response
+    """
+    headers = dict(headers)
+    etag = "%s:%d:%s" % (docid, version, name)
+    headers['ETag'] = '"%s"' % etag
+    if request.if_none_match.contains(etag):
+        return current_app.response_class(status=304, headers=headers)
+    cache = getattr(app, 'response_cache', None)
+    encoding = None
+    if getattr(app, 'compression', False):
+        encoding = protocol.accepted_encoding(
+            request.headers.get('Accept-Encoding'))
+    key = (docid, version, name, encoding)
+    cached = cache.get(key) if cache is not None else None
+    if cached is None:
+        cached = _encode_json(build())
+        if cache is not None:
+            cache.put(key, cached)
+    body, encoding_headers = cached
+    headers.update(encoding_headers)
+    return current_app.response_class(response=body,
+                                      headers=headers,
+                                      mimetype='application/json')
+
+def versioned_doc_json(doc, name, build, headers={}, version_header=False):
+    """versioned_json of the document doc.  build(sess) returns the
+    serialized json from a RedisSession loaded at exactly the version of
+    the ETag (see RedisSession.load_version), the document is loaded again
+    if it changes meanwhile.  version_header adds the version as the
+    X-Bokeh-Version header
+    """
+    while True:
+        sess = RedisSession(app.bb_redis, doc)
+        version = sess.doc_version()
+        response_headers = dict(headers)
+        if version_header:
+            response_headers['X-Bokeh-Version'] = str(version)
+        def load_and_build():
+            sess.load_version(version)
+            return build(sess)
+        try:
+            return versioned_json(doc.docid, version, name, load_and_build,
+                                  headers=response_headers)
+        except DocumentChanged:
+            continue
+
+def request_data():
+    """request.data, decoded according to the Content-Encoding header
+    (PlotServerSession can gzip its uploads)
+    """
+    encoding = request.headers.get('Content-Encoding', '').strip().lower()
+    if encoding in ('gzip', 'deflate'):
+        return protocol.decompress(request.data, encoding)
+    return request.data
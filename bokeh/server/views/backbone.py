@@ -11,10 +11,11 @@ from .. import wsmanager
 from ..models import convenience
 from ..models import docs
 from ... import protocol
+from ...data import diff_columns, apply_column_patch
 from .bbauth import (check_read_authentication_and_create_client,
                     check_write_authentication_and_create_client)
 from ..crossdomain import crossdomain
-from ..views import make_json
+from ..views import make_json, request_data, versioned_doc_json
 log = logging.getLogger(__name__)
 
 
@@ -26,12 +27,18 @@ def reset(docid):
     doc = docs.Doc.load(app.model_redis, docid)
     sess = RedisSession(app.bb_redis, doc)
     sess.load()
-    for m in sess._models:
-        if not m.typename.endswith('PlotContext'):
+    deleted = []
+    for m in list(sess._models.values()):
+        if not m.__view_model__.endswith('PlotContext'):
             sess.del_obj(m)
+            deleted.append(m)
         else:
             m.children = []
             sess.store_obj(m)
+    # also bumps the version of the document
+    ws_delete(sess, deleted)
+    ws_update(sess, [m for m in sess._models.values() if m not in deleted],
+              exclude_self=False)
     return 'success'
 
 @app.route("/bokeh/bb/<docid>/rungc", methods=['GET'])
@@ -51,12 +58,42 @@ def callbacks(docid):
     sess.load()
     sess.load_all_callbacks()    
     if request.method == 'POST':
-        jsondata = protocol.deserialize_json(request.data)
+        jsondata = protocol.deserialize_json(request_data())
         sess.store_callbacks(jsondata)
     else:
         jsondata = sess.load_all_callbacks(get_json=True)
     return make_json(sess.serialize(jsondata))
 
+def data_snapshot(session, ids):
+    """the current data dicts of the models in ids, for computing
+    modelpatch messages once they have been updated
+    """
+    snapshot = {}
+    for _id in ids:
+        model = session._models.get(_id)
+        if model is not None and isinstance(getattr(model, 'data', None), dict):
+            snapshot[_id] = model.data
+    return snapshot
+
+@app.route("/bokeh/bb/<docid>/changes", methods=['GET'])
+@check_read_authentication_and_create_client
+def changes(docid):
+    """the changes made to the document after version ?since=N, as
+    {"version" : current version, "changes" : [websocket messages]}.  If
+    the change log doesn't go back that far, "resync" : true is returned
+    instead of the changes, and the client has to load the whole document
+    """
+    since = int(request.values.get('since', 0))
+    doc = docs.Doc.load(app.model_redis, docid)
+    sess = RedisSession(app.bb_redis, doc)
+    version, msgs = sess.changes_since(since)
+    if msgs is None:
+        return make_json(sess.serialize({'version' : version,
+                                         'resync' : True}))
+    msgs = [m.decode('utf-8') if isinstance(m, bytes) else m for m in msgs]
+    return make_json('{"version": %d, "changes": [%s]}' % (
+        version, ", ".join(msgs)))
+
 #bulk upsert
 @app.route("/bokeh/bb/<docid>/bulkupsert", methods=['POST'])
 @check_write_authentication_and_create_client
@@ -67,36 +104,88 @@ def bulk_upsert(docid):
     doc = docs.Doc.load(app.model_redis, docid)
     sess = RedisSession(app.bb_redis, doc)
     sess.load()
-    data = protocol.deserialize_json(request.data)
+    data = protocol.deserialize_json(request_data())
+    previous = data_snapshot(sess, [x['attributes']['id'] for x in data])
     if client == 'python':
         sess.load_broadcast_attrs(data, events=None)
     else:
         sess.load_all_callbacks()
         sess.load_broadcast_attrs(data, events='existing')
     changed = sess.store_all()
-    msg = ws_update(sess, changed)
-    return make_json(msg)
+    msg, sent = ws_update(sess, changed, previous=previous)
+    return make_json(msg, headers=changes_header(sent))
 
-def ws_update(session, models, exclude_self=True):
-    attrs = session.broadcast_attrs(models)
+def changes_header(msgobjs):
+    """the X-Bokeh-Changes header of the response to a write: the
+    versions of the changes it recorded, so that the client can tell
+    its own changes from those made by others when catching up
+    """
+    return {'X-Bokeh-Changes' : ",".join(str(m['version']) for m in msgobjs)}
+
+def ws_send(session, msgobj, clientid=None, record=True):
+    """broadcast msgobj to all subscribers of session's document, except
+    clientid.  msgobj is recorded in the document's change log first
+    (unless record is False, because that was done along with the
+    change), which sets its version.  returns the serialized message
+    """
+    if record:
+        session.record_change(msgobj, clientid)
+    if app.binary_arrays:
+        # arrays go out as raw binary frames on the websocket, and as
+        # base64 in the (json) return value
+        wsmsg, buffers = session.serialize_buffers(msgobj)
+        app.wsmanager.send("bokehplot:" + session.docid, wsmsg,
+                           exclude=set([clientid]), buffers=buffers)
+        return session.serialize(msgobj)
+    msg = session.serialize(msgobj)
+    app.wsmanager.send("bokehplot:" + session.docid, msg, exclude=set([clientid]))
+    return msg
+
+def ws_update(session, models, exclude_self=True, previous=None):
+    """push models to the browsers.  Models the browsers have seen before
+    only come with the attributes which changed.  previous maps model ids
+    to the data dicts they had before this update.  For those models we
+    send a modelpatch with just the changed column values, instead of the
+    whole data attribute.  returns the serialized modelpush and the
+    messages sent
+    """
+    attrs = session.broadcast_attrs(models, partial=True)
     if exclude_self:
         clientid = request.headers.get('Continuum-Clientid', None)
     else:
         clientid = None
-    msg = session.serialize({'msgtype' : 'modelpush',
-                             'modelspecs' : attrs
-                             })
-    app.wsmanager.send("bokehplot:" + session.docid, msg, exclude=set([clientid]))
-    return msg
-        
+    patches = []
+    if previous:
+        for attr in attrs:
+            _id = attr['attributes']['id']
+            if _id not in previous or 'data' not in attr['attributes']:
+                continue
+            patch = diff_columns(previous[_id], attr['attributes']['data'])
+            if patch is None:
+                continue
+            del attr['attributes']['data']
+            if patch:
+                patches.append({'type' : attr['type'],
+                                'id' : _id,
+                                'attr' : 'data',
+                                'columns' : patch})
+    msgobj = {'msgtype' : 'modelpush',
+              'modelspecs' : attrs
+              }
+    msg = ws_send(session, msgobj, clientid)
+    sent = [msgobj]
+    if patches:
+        sent.append({'msgtype' : 'modelpatch', 'patches' : patches})
+        ws_send(session, sent[-1], clientid)
+    return msg, sent
+
 def ws_delete(session, models):
-    attrs = sess.broadcast_attrs(models)    
-    msg = {'msgtype' : 'modeldel',
-           'modelspecs' : attrs
-           }
-    msg = session.serialize(msg)
-    app.wsmanager.send("bokehplot:" + session.docid, msg, exclude=set([clientid]))
-    return msg
+    attrs = session.broadcast_attrs(models)
+    msgobj = {'msgtype' : 'modeldel',
+              'modelspecs' : attrs
+              }
+    return ws_send(session, msgobj,
+                   request.headers.get('Continuum-Clientid', None))
     
 #backbone functionality
 
@@ -107,11 +196,12 @@ def create(docid, typename):
     sess = RedisSession(app.bb_redis, doc)
     sess.load()
     
-    modeldata = protocol.deserialize_json(request.data)
+    modeldata = protocol.deserialize_json(request_data())
     modeldata = [{'type' : typename,
                   'attributes' : modeldata}]
     sess.store_broadcast_attrs(modeldata)
-    ws_update(sess, modeldata)
+    ws_send(sess, {'msgtype' : 'modelpush', 'modelspecs' : modeldata},
+            request.headers.get('Continuum-Clientid', None))
     return sess.serialize(modeldata[0]['attributes'])
 
 @app.route("/bokeh/bb/<docid>/", methods=['GET'])
@@ -120,17 +210,20 @@ def create(docid, typename):
 def bulkget(docid, typename=None):
     include_hidden = request.values.get('include_hidden', '').lower() == 'true'
     doc = docs.Doc.load(app.model_redis, docid)
-    sess = RedisSession(app.bb_redis, doc)
-    sess.load()
-    sess.prune()    
-    all_models = sess._models.values()
-    if typename is not None:
-        attrs = sess.attrs([x for x in all_models \
-                            if x.__view_model__==typename])
-        return make_json(sess.serialize(attrs))
-    else:
-        attrs = sess.broadcast_attrs([x for x in all_models])
-        return make_json(sess.serialize(attrs))
+    # the models have to be at the version exactly, clients catching up
+    # from it would apply streamed rows a second time
+    def build(sess):
+        sess.prune()
+        all_models = sess._models.values()
+        if typename is not None:
+            attrs = sess.attrs([x for x in all_models \
+                                if x.__view_model__==typename])
+        else:
+            attrs = sess.broadcast_attrs([x for x in all_models])
+            attrs = list(sess.share_model_columns(attrs))
+        return sess.serialize(attrs)
+    return versioned_doc_json(doc, "bulkget:%s" % typename, build,
+                              version_header=True)
 
 #route for working with individual models
 @app.route("/bokeh/bb/<docid>/<typename>/<id>/",
@@ -152,10 +245,9 @@ def handle_specific_model(docid, typename, id):
 def getbyid(docid, typename, id):
     include_hidden = request.values.get('include_hidden', '').lower() == 'true'
     doc = docs.Doc.load(app.model_redis, docid)
-    sess = RedisSession(app.bb_redis, doc)
-    sess.load()
-    attr = sess.attrs([sess._models[id]])[0]
-    return make_json(sess.serialize(attr))
+    def build(sess):
+        return sess.serialize(sess.attrs([sess._models[id]])[0])
+    return versioned_doc_json(doc, "model:%s" % id, build)
 
 @check_write_authentication_and_create_client
 def update(docid, typename, id):
@@ -167,9 +259,10 @@ def update(docid, typename, id):
     sess = RedisSession(app.bb_redis, doc)
     sess.load()
     
-    modeldata = protocol.deserialize_json(request.data)
+    modeldata = protocol.deserialize_json(request_data())
     #patch id is not passed...
     modeldata['id'] = id
+    previous = data_snapshot(sess, [id])
     sess.load_all_callbacks()
     sess.load_attrs(typename, [modeldata], events='existing')
     changed = sess.store_all()
@@ -181,13 +274,15 @@ def update(docid, typename, id):
         #this is strange but ok, that means the model didn't change
         pass
     ws_update(sess, changed, exclude_self=False)
-    ws_update(sess, [model], exclude_self=True)
+    ws_update(sess, [model], exclude_self=True, previous=previous)
     log.debug("update, %s, %s", docid, typename)
     return make_json(sess.serialize(sess.attrs([model])[0]))
 
 @check_write_authentication_and_create_client
 def delete(docid, typename, id):
-    sess = RedisSession(app.bb_redis, doc)    
+    doc = docs.Doc.load(app.model_redis, docid)
+    sess = RedisSession(app.bb_redis, doc)
+    sess.load()
     model = sess._models[id]
     log.debug("DELETE, %s, %s", docid, typename)
     sess.del_obj(model)
@@ -195,6 +290,55 @@ def delete(docid, typename, id):
     return sess.serialize(sess.attrs([model])[0])
 
 
+@app.route("/bokeh/bb/<docid>/<typename>/<id>/patch", methods=['POST'])
+@check_write_authentication_and_create_client
+def patch(docid, typename, id):
+    """apply a column patch (see data.diff_columns) supplied by the
+    client, and forward it to the browsers as a modelpatch
+    """
+    doc = docs.Doc.load(app.model_redis, docid)
+    sess = RedisSession(app.bb_redis, doc)
+    sess.load()
+    model = sess._models[id]
+    patchobj = protocol.deserialize_json(request_data())
+    apply_column_patch(model.data, patchobj['columns'])
+    sess.store_objs([model])
+    msgobj = {'msgtype' : 'modelpatch',
+              'patches' : [{'type' : typename,
+                            'id' : id,
+                            'attr' : 'data',
+                            'columns' : patchobj['columns']}]}
+    ws_send(sess, msgobj, request.headers.get('Continuum-Clientid', None))
+    log.debug("patch, %s, %s", docid, typename)
+    return make_json(sess.serialize({'id' : id}),
+                     headers=changes_header([msgobj]))
+
+@app.route("/bokeh/bb/<docid>/<typename>/<id>/stream", methods=['POST'])
+@check_write_authentication_and_create_client
+def stream(docid, typename, id):
+    """append rows to the data of a ColumnDataSource, and forward them
+    to the browsers as a modelstream.  The stored document is not loaded,
+    the rows are queued in redis (see RedisSession.append_stream)
+    """
+    doc = docs.Doc.load(app.model_redis, docid)
+    sess = RedisSession(app.bb_redis, doc)
+    streamobj = protocol.deserialize_json(request_data())
+    rollover = streamobj.get('rollover')
+    clientid = request.headers.get('Continuum-Clientid', None)
+    msgobj = {'msgtype' : 'modelstream',
+              'type' : typename,
+              'id' : id,
+              'attr' : 'data',
+              'data' : streamobj['data'],
+              'rollover' : rollover}
+    # recorded together with the rows
+    sess.append_stream(typename, id, streamobj['data'], rollover,
+                       change=msgobj, clientid=clientid)
+    ws_send(sess, msgobj, clientid, record=False)
+    log.debug("stream, %s, %s", docid, typename)
+    return make_json(sess.serialize({'id' : id}),
+                     headers=changes_header([msgobj]))
+
 #rpc route
 @app.route("/bokeh/bb/rpc/<docid>/<typename>/<id>/<funcname>/",
            methods=['POST', 'OPTIONS'])
@@ -206,7 +350,7 @@ def rpc(docid, typename, id, funcname):
     sess = RedisSession(app.bb_redis, doc)
     sess.load()
     model = sess._models[id]
-    data = protocol.deserialize_json(request.data)
+    data = protocol.deserialize_json(request_data())
     args = data.get('args', [])
     kwargs = data.get('kwargs', {})
     result = getattr(model, funcname)(*args, **kwargs)
@@ -18,7 +18,7 @@ from ..models import docs
 from ..models import convenience as mconv
 from ... import protocol
 from ...exceptions import DataIntegrityException
-from ..views import make_json
+from ..views import make_json, versioned_doc_json
 from ..crossdomain import crossdomain
 from ..serverbb import RedisSession
 from flask import url_for
@@ -122,20 +122,18 @@ def get_bokeh_info(docid):
 
 def _get_bokeh_info(docid):
     doc = docs.Doc.load(app.model_redis, docid)
-    sess = RedisSession(app.bb_redis, doc)
-    sess.load()
-    sess.prune()
-    all_models = sess._models.values()
-    print("num models", len(all_models))
-    all_models = sess.broadcast_attrs(all_models)
-    returnval = {'plot_context_ref' : doc.plot_context_ref,
-                 'docid' : docid,
-                 'all_models' : all_models,
-                 'apikey' : doc.apikey}
-    returnval = sess.serialize(returnval)
-    result = make_json(returnval,
-                       headers={"Access-Control-Allow-Origin": "*"})
-    return result
+    def build(sess):
+        sess.prune()
+        all_models = sess._models.values()
+        print("num models", len(all_models))
+        all_models = list(sess.share_model_columns(sess.broadcast_attrs(all_models)))
+        returnval = {'plot_context_ref' : doc.plot_context_ref,
+                     'docid' : docid,
+                     'all_models' : all_models,
+                     'apikey' : doc.apikey}
+        return sess.serialize(returnval)
+    return versioned_doc_json(doc, "bokehinfo", build,
+                              headers={"Access-Control-Allow-Origin": "*"})
 
 @app.route('/bokeh/doc/', methods=['GET', 'OPTIONS'])
 @crossdomain(origin="*", headers=['BOKEH-API-KEY', 'Continuum-Clientid'])
@@ -205,7 +203,7 @@ def dom_embed(plot, **kwargs):
     plot2 = make_test_plot()
     return render_template(
         "embed.html", jsfiles=static_js, hemfiles=hem_js,
-        docid=plot._session.docid, docapikey=plot._session.apikey, modelid=plot._id,
+        docid=plot.session.docid, docapikey=plot.session.apikey, modelid=plot._id,
         plot2=plot2, **kwargs)
 
 def make_test_plot():
@@ -24,9 +24,19 @@ class MultiDictionary(object):
     def get(self, *args):
         return self.dict.get(*args)
 
+# clients which subscribe with compression : 'deflate' get every binary
+# frame prefixed by one of these tags
+FRAME_BUFFER = b'\x00'
+FRAME_DEFLATE = b'\x01'
+
 class WebSocketManager(object):
-    def __init__(self):
+    def __init__(self, compression=True, compression_threshold=None):
         self.sockets = {}
+        self.compression = compression
+        self.compressed_clients = set()
+        # messages shorter than this go out uncompressed, see
+        # protocol.compression_threshold for the default
+        self.compression_threshold = compression_threshold
         self.topic_clientid_map = MultiDictionary()
         self.clientid_topic_map = MultiDictionary()
         self.auth_functions = {}
@@ -79,16 +89,51 @@ class WebSocketManager(object):
 
     def remove_socket(self, clientid):
         del self.sockets[clientid]
+        self.compressed_clients.discard(clientid)
 
-    def send(self, topic, msg, exclude=None):
+    def set_compression(self, clientid, compression):
+        if self.compression and compression == 'deflate':
+            self.compressed_clients.add(clientid)
+        else:
+            self.compressed_clients.discard(clientid)
+
+    def _frames(self, text, buffers, compressed):
+        if not compressed:
+            return [(buf, True) for buf in buffers] + [(text, False)]
+        frames = [(FRAME_BUFFER + buf, True) for buf in buffers]
+        if protocol.should_compress(text, self.compression_threshold):
+            frames.append((FRAME_DEFLATE + protocol.compress(text, 'deflate'),
+                           True))
+        else:
+            frames.append((text, False))
+        return frames
+
+    def send(self, topic, msg, exclude=None, buffers=None):
+        """send msg to all subscribers of topic.  buffers is an optional
+        list of arrays referenced from msg (see protocol.serialize_json_buffers),
+        they go out as binary frames ahead of the text frame, which is what
+        tells the client the message is complete
+        """
         if exclude is None:
             exclude = set()
+        buffers = [memoryview(b).tobytes() for b in buffers or []]
+        text = topic + ":" + msg
+        # frames are built (and compressed) once per broadcast, not once
+        # per subscriber
+        frames = {}
         for clientid in tuple(self.topic_clientid_map.get(topic, [])):
             if clientid in exclude:
                 continue
             socket = self.sockets[clientid]
+            compressed = clientid in self.compressed_clients
+            if compressed not in frames:
+                frames[compressed] = self._frames(text, buffers, compressed)
             try:
-                socket.send(topic + ":" + msg)
+                for frame, binary in frames[compressed]:
+                    if binary:
+                        socket.send(frame, binary=True)
+                    else:
+                        socket.send(frame)
             except Exception as e: #what exception is this?if a client disconnects
                 log.exception(e)
                 self.remove_socket(clientid)
@@ -117,6 +162,7 @@ def run_socket(socket, manager, clientid=None):
 
             if manager.auth(auth, topic):
                 manager.subscribe(clientid, topic)
+                manager.set_compression(clientid, msgobj.get('compression'))
                 msg = protocol.serialize_web(protocol.status_obj(['subscribesuccess', topic, clientid]))
                 socket.send(topic + ":" + msg)
             else:
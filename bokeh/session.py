@@ -4,23 +4,46 @@ from __future__ import absolute_import
 """
 
 from os.path import abspath, split, join
+import atexit
+import gc
 import os.path
 import json
 import logging
+import threading
+import time
 import uuid
 import warnings
+import weakref
 import requests
+from collections import OrderedDict
+from contextlib import contextmanager
+from numbers import Number
+from types import GeneratorType
 
 from six import string_types
-from six.moves.urllib.parse import urljoin
+from six.moves.urllib.parse import urljoin, urlsplit
 
 from . import protocol, utils
-from .objects import PlotObject, Plot
-from .properties import List
+from .objects import PlotObject, Plot, ReferenceGraph
+from .properties import List, untracked
 from .exceptions import DataIntegrityException
+from .data import apply_column_patch, stream_columns
 
 logger = logging.getLogger(__file__)
 
+# stands in for the key of list items in BaseHTMLSession._serialize_iter
+_list_item = object()
+
+def _json_key(key):
+    """ Converts a dict key to the string json.dumps would use for it """
+    if isinstance(key, string_types):
+        return key
+    if key is None or isinstance(key, bool):
+        return json.dumps(key)
+    if isinstance(key, Number):
+        return json.dumps(float(key)) if isinstance(key, float) else str(key)
+    raise TypeError("key %r is not a string" % (key,))
+
 class Session(object):
     """ Sessions provide a sandbox or facility in which to manage the 'live'
     object state for a Bokeh plot.
@@ -42,13 +65,33 @@ class Session(object):
     will be associated with the given session.
     """
 
+    # If True, the session only holds weak references to its models, so
+    # that models nothing else refers to anymore are freed
+    weak_models = False
+
+    # If set, collect() is run each time this many models were added
+    collect_every = None
+
+    # nesting depth of deferred() blocks
+    _defer_depth = 0
+
+    # nesting depth of load_broadcast_attrs() calls, no models are evicted
+    # while loading
+    _load_depth = 0
+
     def __init__(self, plot=None):
         """ Initializes this session from the given PlotObject. """
         # Has the plot model changed since the last save?
         self._dirty = True
         # This stores a reference to all models in the object graph.
-        # Eventually consider making this be weakrefs?
-        self._models = {}
+        if self.weak_models:
+            self._models = weakref.WeakValueDictionary()
+        else:
+            self._models = {}
+        # id -> model kept through collect(), see pin()
+        self._pinned = {}
+        # ids of the models added since the last collect()
+        self._young = set()
 
     def __enter__(self):
         pass
@@ -68,6 +111,114 @@ class Session(object):
             else:
                 obj.session = self
                 self._models[obj._id] = obj
+                self._young.add(obj._id)
+        self._maybe_evict()
+
+    def _maybe_evict(self):
+        # not in the middle of a load, whose models only become reachable
+        # once all of them are there
+        if self.collect_every and not self._load_depth and \
+           len(self._young) >= self.collect_every:
+            # models added since the last collection may not be attached
+            # to the plotcontext yet, they are only evicted the next time
+            self._evict(spare=self._young)
+
+    def pin(self, *objects):
+        """ Keeps objects, and the models they refer to, in this session
+        when collect() is run, even if they aren't reachable from the
+        plotcontext
+        """
+        for obj in objects:
+            self._pinned[obj._id] = obj
+
+    def unpin(self, *objects):
+        """ Undoes pin() """
+        for obj in objects:
+            self._pinned.pop(obj._id, None)
+
+    def _evict(self, spare=()):
+        roots = list(self._pinned.values())
+        plotcontext = getattr(self, 'plotcontext', None)
+        if plotcontext is not None:
+            roots.append(plotcontext)
+        graph = self.reference_graph
+        keep = set(obj._id for obj in graph.reachable(*roots))
+        evicted = [obj for _id, obj in list(self._models.items())
+                   if _id not in keep and _id not in spare]
+        for obj in evicted:
+            del self._models[obj._id]
+        graph.discard(*evicted)
+        self._young = set()
+        return evicted
+
+    def collect(self):
+        """ Removes the models which are neither reachable from the
+        plotcontext nor pinned from this session, so that they can be
+        freed.  Returns a dict with the number of models 'evicted' from
+        the session and how many of them were 'freed' by that.
+        """
+        evicted = [weakref.ref(obj) for obj in self._evict()]
+        gc.collect()
+        return {'evicted': len(evicted),
+                'freed': sum(1 for ref in evicted if ref() is None)}
+
+    @property
+    def reference_graph(self):
+        """ The ReferenceGraph of the models of this session, which
+        answers reachability queries without re-scanning unchanged models
+        """
+        graph = self.__dict__.get('_reference_graph')
+        if graph is None:
+            graph = self._reference_graph = ReferenceGraph()
+        return graph
+
+    @contextmanager
+    def batch(self, models=None):
+        """ Context manager which holds back the change events of
+        **models** (by default, all the models of this session) until the
+        end of the block, see PlotObject.batch()
+        """
+        if models is None:
+            models = list(self._models.values())
+        else:
+            models = list(models)
+        for m in models:
+            m._begin_batch()
+        try:
+            yield self
+        finally:
+            for m in models:
+                m._end_batch()
+
+    @contextmanager
+    def deferred(self):
+        """ Context manager which holds back store_all() and save() until
+        the end of the block, where each runs once (if the block didn't
+        raise), see defer()
+        """
+        if not self._defer_depth:
+            self._deferred_calls = OrderedDict()
+        self._defer_depth += 1
+        try:
+            yield self
+        finally:
+            self._defer_depth -= 1
+            if not self._defer_depth:
+                calls, self._deferred_calls = self._deferred_calls, None
+        if not self._defer_depth:
+            for func, args, kwargs in calls.values():
+                func(*args, **kwargs)
+
+    def defer(self, key, func, *args, **kwargs):
+        """ Inside of a deferred() block, records func(*args, **kwargs) to
+        be called at the end of the block and returns True.  A later call
+        with the same **key** replaces the earlier one, but runs in its
+        place.  Outside of deferred() blocks, only returns False.
+        """
+        if not self._defer_depth:
+            return False
+        self._deferred_calls[key] = (func, args, kwargs)
+        return True
 
     def view(self):
         """ Triggers the OS to open a web browser pointing to the file
@@ -92,6 +243,14 @@ class BaseHTMLSession(Session):
     # The base URL for all CSS and JS
     static_url = bokeh_url
 
+    # If True, numeric arrays (i.e. ColumnDataSource columns) are serialized
+    # as base64 encoded typed buffers instead of JSON lists of numbers
+    binary_arrays = False
+
+    # If True, data columns which occur in several data sources are only
+    # written out once in exported documents
+    share_arrays = True
+
     #------------------------------------------------------------------------
     # Static file handling
     #------------------------------------------------------------------------
@@ -183,6 +342,38 @@ class BaseHTMLSession(Session):
                 return protocol.NumpyJSONEncoder.default(self, obj)
 
 
+    def _model_refs(self, objects=None):
+        """ Returns an iterator over the {'type', 'id', 'attributes'} dicts
+        for **objects** (default: all models in the session), which
+        serializes one model at a time.
+        """
+        # Manually convert our top-level models into dicts, before handing
+        # them in to the JSON encoder.  (We don't want to embed the call to
+        # vm_serialize into the PlotObjEncoder, because that would cause
+        # all the attributes to be duplicated multiple times.)
+        if objects is None:
+            objects = list(self._models.values())
+        return self.share_model_columns(self._model_ref(m) for m in objects)
+
+    def _model_ref(self, m):
+        ref = self.get_ref(m)
+        ref["attributes"] = m.vm_serialize()
+        ref["attributes"].update({"id": ref["id"], "doc": None})
+        return ref
+
+    def share_model_columns(self, refs):
+        """ Iterates over the model dicts **refs**, replacing data source
+        columns which already appeared in an earlier one by a reference,
+        if self.share_arrays is set (see protocol.SharedArrays)
+        """
+        shared = protocol.SharedArrays() if self.share_arrays else None
+        for ref in refs:
+            data = ref["attributes"].get("data")
+            if shared is not None and ref["type"] == "ColumnDataSource" \
+               and isinstance(data, dict):
+                ref["attributes"]["data"] = shared.share_columns(data)
+            yield ref
+
     def get_ref(self, obj):
         self._models[obj._id] = obj
         return {
@@ -203,6 +394,7 @@ class BaseHTMLSession(Session):
         it may differ between server-based models versus embedded.
         """
 
+        jsonkwargs.setdefault('binary', self.binary_arrays)
         try:
             self.PlotObjEncoder.session = self
             jsondata = protocol.serialize_json(
@@ -213,6 +405,62 @@ class BaseHTMLSession(Session):
             self.PlotObjEncoder.session = None
         return jsondata
 
+    def serialize_iter(self, obj, depth=4, **jsonkwargs):
+        """ Generator version of serialize(), which yields the JSON text in
+        chunks.  Dicts and lists in the top **depth** levels of **obj** are
+        written out piecewise, and only the values below that are serialized
+        whole.  For a list of model refs the default depth streams one data
+        column at a time, so the whole document never exists as one string.
+        """
+        indent = jsonkwargs.get('indent')
+        for chunk in self._serialize_iter(obj, depth, indent, 0, jsonkwargs):
+            yield chunk
+
+    def _serialize_iter(self, obj, depth, indent, level, jsonkwargs):
+        if depth == 0 or not isinstance(obj, (dict, list, GeneratorType)):
+            text = self.serialize(obj, **jsonkwargs)
+            if indent is not None and level:
+                text = text.replace("\n", "\n" + " " * (indent * level))
+            yield text
+            return
+        if indent is None:
+            sep, close = "", ""
+        else:
+            sep = "\n" + " " * (indent * (level + 1))
+            close = "\n" + " " * (indent * level)
+        if isinstance(obj, dict):
+            begin, end, items = "{", "}", obj.items()
+        else:
+            begin, end, items = "[", "]", ((_list_item, v) for v in obj)
+        yield begin
+        first = True
+        for key, val in items:
+            yield sep if first else "," + (sep or " ")
+            first = False
+            if key is not _list_item:
+                yield json.dumps(_json_key(key)) + ": "
+            for chunk in self._serialize_iter(val, depth - 1, indent,
+                                              level + 1, jsonkwargs):
+                yield chunk
+        if not first:
+            yield close
+        yield end
+
+    def serialize_buffers(self, obj, **jsonkwargs):
+        """ Like serialize(), but numeric arrays are pulled out of the JSON
+        and returned separately as raw buffers, for transports (websockets)
+        which can carry binary frames.  Returns (jsonstring, buffers)
+        """
+        try:
+            self.PlotObjEncoder.session = self
+            jsondata, buffers = protocol.serialize_json_buffers(
+                obj,
+                encoder=self.PlotObjEncoder,
+                **jsonkwargs)
+        finally:
+            self.PlotObjEncoder.session = None
+        return jsondata, buffers
+
 class HTMLFileSession(BaseHTMLSession):
     """ Produces a pile of static HTML, suitable for exporting a plot
     as a standalone HTML file.  This includes a template around the
@@ -261,37 +509,30 @@ class HTMLFileSession(BaseHTMLSession):
     def raw_js_snippets(self, obj):
         self.raw_js_objs.append(obj)
 
-    def dumps(self, js=None, css=None, rootdir=None):
-        """ Returns the HTML contents as a string
-
-        **js** and **css** can be "inline" or "relative", and they default
-        to the values of self.inline_js and self.inline_css.
-
-        If these are set to be "relative" (or self.inline_js/css are False),
-        **rootdir** can be specified to indicate the base directory from which
-        the path to the various static files should be computed.  **rootdir**
-        defaults to the value of self.rootdir.
+    def _write_with_models(self, write, text, marker, **jsonkwargs):
+        """ Writes **text** through the **write** callable, streaming the
+        JSON for all models in at the position of **marker**.
+        """
+        head, tail = text.split(marker, 1)
+        write(head)
+        for chunk in self.serialize_iter(self._model_refs(), **jsonkwargs):
+            write(chunk)
+        write(tail)
+
+    def _render_html(self, js=None, css=None, rootdir=None):
+        """ Renders the HTML page around a placeholder for the model JSON.
+        Returns (html, placeholder)
         """
         # FIXME: Handle this more intelligently
         pc_ref = self.get_ref(self.plotcontext)
         elementid = str(uuid.uuid4())
-
-        # Manually convert our top-level models into dicts, before handing
-        # them in to the JSON encoder.  (We don't want to embed the call to
-        # vm_serialize into the PlotObjEncoder, because that would cause
-        # all the attributes to be duplicated multiple times.)
-        models = []
-        for m in self._models.values():
-            ref = self.get_ref(m)
-            ref["attributes"] = m.vm_serialize()
-            ref["attributes"].update({"id": ref["id"], "doc": None})
-            models.append(ref)
+        marker = "__bokeh_all_models_%s__" % elementid
 
         jscode = self._load_template(self.js_template).render(
                     elementid = elementid,
                     modelid = pc_ref["id"],
                     modeltype = pc_ref["type"],
-                    all_models = self.serialize(models),
+                    all_models = marker,
                 )
         div = self._load_template(self.div_template).render(
                     elementid = elementid
@@ -316,33 +557,47 @@ class HTMLFileSession(BaseHTMLSession):
             rawcss = None
             cssfiles = [os.path.relpath(p,rootdir) for p in self.css_paths()]
 
-        plot_div = self._load_template(self.div_template).render(
-            elementid=elementid
-            )
-
-
-# jscode is the one I want
-
         html = self._load_template(self.html_template).render(
                     js_snippets = [jscode],
                     html_snippets = [div] + [o.get_raw_js() for o in self.raw_js_objs],
                     rawjs = rawjs, rawcss = rawcss,
                     jsfiles = jsfiles, cssfiles = cssfiles,
                     title = self.title)
-        return html
+        return html, marker
 
-    def embed_js(self, plot_id, static_root_url):
+    def write(self, f, js=None, css=None, rootdir=None):
+        """ Writes the HTML contents to the binary file object **f**,
+        encoding the models one data column at a time rather than building
+        the whole document in memory first.  Arguments are as for dumps().
+        """
+        html, marker = self._render_html(js, css, rootdir)
+        self._write_with_models(lambda s: f.write(s.encode("utf-8")),
+                                html, marker)
 
+    def dumps(self, js=None, css=None, rootdir=None):
+        """ Returns the HTML contents as a string
+
+        **js** and **css** can be "inline" or "relative", and they default
+        to the values of self.inline_js and self.inline_css.
+
+        If these are set to be "relative" (or self.inline_js/css are False),
+        **rootdir** can be specified to indicate the base directory from which
+        the path to the various static files should be computed.  **rootdir**
+        defaults to the value of self.rootdir.
+        """
+        html, marker = self._render_html(js, css, rootdir)
+        chunks = []
+        self._write_with_models(chunks.append, html, marker)
+        return "".join(chunks)
+
+    def embed_js(self, plot_id, static_root_url, file=None):
+        """ Returns the embed.js code for **plot_id** as UTF-8 bytes, or
+        streams it into the binary file object **file** if one is given.
+        """
         # FIXME: Handle this more intelligently
         pc_ref = self.get_ref(self.plotcontext)
         elementid = str(uuid.uuid4())
-
-        models = []
-        for m in self._models.values():
-            ref = self.get_ref(m)
-            ref["attributes"] = m.vm_serialize()
-            ref["attributes"].update({"id": ref["id"], "doc": None})
-            models.append(ref)
+        marker = "__bokeh_all_models_%s__" % elementid
 
         jscode = self._load_template('embed_direct.js').render(
             host = "",
@@ -350,9 +605,14 @@ class HTMLFileSession(BaseHTMLSession):
             elementid = elementid,
             modelid = pc_ref["id"],
             modeltype = pc_ref["type"],
-            plotid = plot_id,  all_models = self.serialize(models))
-        return jscode.encode("utf-8")
-
+            plotid = plot_id,  all_models = marker)
+        if file is not None:
+            self._write_with_models(lambda s: file.write(s.encode("utf-8")),
+                                    jscode, marker)
+            return
+        chunks = []
+        self._write_with_models(chunks.append, jscode, marker)
+        return "".join(chunks).encode("utf-8")
 
     def save(self, filename=None, js=None, css=None, rootdir=None):
         """ Saves the file contents.  Uses self.filename if **filename**
@@ -366,11 +626,12 @@ class HTMLFileSession(BaseHTMLSession):
         the path to the various static files should be computed.  **rootdir**
         defaults to the value of self.rootdir.
         """
-        s = self.dumps(js, css, rootdir)
+        if self.defer('save', self.save, filename, js, css, rootdir):
+            return
         if filename is None:
             filename = self.filename
         with open(filename, "wb") as f:
-            f.write(s.encode("utf-8"))
+            self.write(f, js, css, rootdir)
         return
 
     def view(self, do_save=True, new=False, autoraise=True):
@@ -399,28 +660,29 @@ class HTMLFileSession(BaseHTMLSession):
 
         If a file object is provided, then the output is appended to it.  If a
         file name is provided, then it opened for overwrite, and not append.
+        When writing to a file, the JSON is streamed out a data column at a
+        time.
 
         Mostly intended to be used for debugging.
         """
-        models = []
-        for m in self._models.values():
-            ref = self.get_ref(m)
-            ref["attributes"] = m.vm_serialize()
-            ref["attributes"].update({"id": ref["id"], "doc": None})
-            models.append(ref)
         if pretty:
             indent = 4
         else:
             indent = None
-        s = self.serialize(models, indent=indent)
+        marker = "__bokeh_all_models__"
         if file is not None:
             if isinstance(file, string_types):
                 with open(file, "w") as f:
-                    f.write(s)
+                    self._write_with_models(f.write, marker, marker,
+                                            indent=indent)
             else:
-                file.write(s)
+                self._write_with_models(file.write, marker, marker,
+                                        indent=indent)
         else:
-            return s
+            chunks = []
+            self._write_with_models(chunks.append, marker, marker,
+                                    indent=indent)
+            return "".join(chunks)
 
 
 class HTMLFragmentSession(BaseHTMLSession):
@@ -448,10 +710,212 @@ class PlotList(PlotContext):
     # everywhere, so plotlist is the generic one
     pass
 
+# the live push workers, which get to upload what is left when the
+# interpreter exits.  Weak, so that sessions can still be collected
+_push_workers = weakref.WeakSet()
+
+def _wait_for_push_workers():
+    for worker in list(_push_workers):
+        worker.wait(worker.exit_timeout)
+
+atexit.register(_wait_for_push_workers)
+
+class _PushWorker(object):
+    """ Uploads the models queued by a PlotServerSession from a background
+    thread, in one bulkupsert at most every **interval** seconds.  The
+    updates of a model queued in the meantime are merged into one.  The
+    worker only keeps a weak reference to the session, and stops once the
+    session is gone.
+    """
+
+    # how long to wait for the last uploads when the interpreter exits
+    exit_timeout = 10
+
+    def __init__(self, session, interval):
+        self._session = weakref.ref(session)
+        self.interval = interval
+        self._cond = threading.Condition()
+        # id -> broadcast attrs of the models to upload
+        self._pending = OrderedDict()
+        self._uploading = False
+        self._flush = False
+        self._stopped = False
+        # number of uploads attempted, and of the last one which failed
+        self._attempts = 0
+        self._failed = 0
+        # requests sessions aren't thread safe, this one is the worker's
+        self._http_session = requests.session()
+        self._thread = threading.Thread(target=self._run, name="bokeh-push")
+        self._thread.daemon = True
+        self._thread.start()
+        _push_workers.add(self)
+
+    @staticmethod
+    def _merge(pending, ref):
+        old = pending.get(ref['id'])
+        if old is None:
+            pending[ref['id']] = ref
+        else:
+            old['attributes'].update(ref['attributes'])
+
+    def put(self, models):
+        with self._cond:
+            for ref in models:
+                self._merge(self._pending, ref)
+
+    def flush(self):
+        with self._cond:
+            self._flush = True
+            self._cond.notify_all()
+
+    def wait(self, timeout=None):
+        """ Uploads the queued models now and waits until they were
+        uploaded.  Returns False if an upload failed or the timeout expired
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            start = self._attempts
+            self._flush = True
+            self._cond.notify_all()
+            while self._pending or self._uploading:
+                if self._failed > start or self._stopped:
+                    return False
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return self._failed <= start
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._flush and not self._stopped:
+                    self._cond.wait(self.interval)
+                self._flush = False
+                if self._stopped:
+                    return
+                session = self._session()
+                if session is None:
+                    if self._pending:
+                        logger.warning("session collected with %d models "
+                                       "not uploaded", len(self._pending))
+                    self._stopped = True
+                    self._cond.notify_all()
+                    return
+                if not self._pending:
+                    session = None
+                    continue
+                models = list(self._pending.values())
+                self._pending = OrderedDict()
+                self._uploading = True
+                self._attempts += 1
+            try:
+                session._copy_headers(self._http_session)
+                ok = session.store_broadcast_attrs(
+                    models, http_session=self._http_session).ok
+            except Exception:
+                logger.exception("storing models failed")
+                ok = False
+            # don't keep the session alive while waiting
+            session = None
+            with self._cond:
+                self._uploading = False
+                if not ok:
+                    # send them again next time, under newer updates
+                    self._failed = self._attempts
+                    pending = OrderedDict()
+                    for ref in models:
+                        pending[ref['id']] = ref
+                    for ref in self._pending.values():
+                        self._merge(pending, ref)
+                    self._pending = pending
+                self._cond.notify_all()
+
+class _Subscriber(object):
+    """ Receives the changes which the server broadcasts for the document
+    of a PlotServerSession over the /bokeh/sub websocket, on a background
+    thread, and applies them to the models of the session.
+    """
+
+    def __init__(self, session, socket):
+        self.session = session
+        self.socket = socket
+        # for catching up, requests sessions aren't thread safe
+        self.http_session = requests.session()
+        self._thread = threading.Thread(target=self._run, name="bokeh-sub")
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def close(self):
+        self.socket.close()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self):
+        import websocket
+        # binary frames carry the arrays of the next text frame
+        buffers = []
+        while True:
+            try:
+                opcode, data = self.socket.recv_data()
+            except Exception:
+                logger.debug("websocket closed", exc_info=True)
+                return
+            if opcode == websocket.ABNF.OPCODE_CLOSE:
+                return
+            if opcode == websocket.ABNF.OPCODE_BINARY:
+                buffers.append(data)
+                continue
+            try:
+                self.handle(data, buffers)
+            except Exception:
+                logger.exception("applying update from the server failed")
+            buffers = []
+
+    def handle(self, text, buffers=None):
+        """ Applies one message, "<topic>:<json>", to the session.  When
+        its version shows that messages were missed, e.g. while the
+        connection was down, the session catches up with the server first.
+        """
+        if isinstance(text, bytes):
+            text = text.decode('utf-8')
+        msgobj = protocol.deserialize_json(text.split(":", 2)[-1], buffers)
+        session = self.session
+        with session._lock:
+            version = msgobj.get('version')
+            if version is None or session.version is None:
+                session.apply_message(msgobj)
+                return
+            if version <= session.version:
+                return
+            if version == session.version + 1:
+                session.apply_message(msgobj)
+                session._set_version(version)
+                return
+        # the missed changes are fetched without holding the lock
+        session._copy_headers(self.http_session)
+        session.catch_up(http_session=self.http_session)
+
 class PlotServerSession(BaseHTMLSession):
 
+    # gzip the bodies of model uploads (bulkupsert, stream) which are
+    # larger than protocol.compression_threshold
+    compress_uploads = False
+
+    # If set, stored models are uploaded from a background thread, at most
+    # every push_interval seconds, see flush() and wait()
+    push_interval = None
 
-    def __init__(self, username=None, serverloc=None, userapikey="nokey"):
+    def __init__(self, username=None, serverloc=None, userapikey="nokey",
+                 push_interval=None):
         # This logic is based on ContinuumModelsClient.__init__ and
         # mpl.PlotClient.__init__.  There is some merged functionality here
         # since a Session is meant to capture the little bit of lower-level
@@ -480,6 +944,17 @@ class PlotServerSession(BaseHTMLSession):
         self.bbclient = None   # reference to a ContinuumModelsClient
         self.base_url = urljoin(self.root_url, "/bokeh/bb/")
         self.raw_js_objs = []
+        if push_interval is not None:
+            self.push_interval = push_interval
+        self._push_worker = None
+        self._subscriber = None
+        # the version of the document the models were loaded at, if known
+        self.version = None
+        # versions of changes this session made, which are ahead of version
+        self._written = set()
+        # held while the models are changed or gone through, the
+        # subscriber applies changes from its own thread
+        self._lock = threading.RLock()
         super(PlotServerSession, self).__init__()
 
     #------------------------------------------------------------------------
@@ -489,6 +964,11 @@ class PlotServerSession(BaseHTMLSession):
         self.raw_js_objs.append(obj)
 
     def load_doc(self, docid):
+        if docid == self.docid and self.version is not None \
+           and self.plotcontext is not None:
+            # already loaded, only fetch what changed since
+            self.catch_up()
+            return
         url = urljoin(self.root_url,"/bokeh/getdocapikey/%s" % docid)
         resp = self.http_session.get(url, verify=False)
         if resp.status_code == 401:
@@ -571,6 +1051,15 @@ class PlotServerSession(BaseHTMLSession):
         trigger events only for existing (not new objects).
         None means don't trigger any events.
         """
+        self._load_depth += 1
+        try:
+            models = self._load_broadcast_attrs(attrs, events)
+        finally:
+            self._load_depth -= 1
+        self._maybe_evict()
+        return models
+
+    def _load_broadcast_attrs(self, attrs, events):
         models = []
         created = set()
         for attr in attrs:
@@ -611,11 +1100,19 @@ class PlotServerSession(BaseHTMLSession):
             attrs.append(attr)
         return attrs
 
-    def broadcast_attrs(self, to_store):
+    def broadcast_attrs(self, to_store, partial=False):
+        """ Returns the type, id and attributes of the models in to_store.
+        If **partial** is True, models which were pushed before only
+        include the attributes which changed since (see
+        PlotObject.changes_since_push)
+        """
         models = []
         for m in to_store:
             ref = self.get_ref(m)
-            ref["attributes"] = m.vm_serialize()
+            if partial:
+                ref["attributes"] = m.vm_serialize_changes()
+            else:
+                ref["attributes"] = m.vm_serialize()
             # FIXME: Is it really necessary to add the id and doc to the
             # attributes dict? It shows up in the bbclient-based JSON
             # serializations, but I don't understand why it's necessary.
@@ -623,6 +1120,52 @@ class PlotServerSession(BaseHTMLSession):
             models.append(ref)
         return models
 
+    def ws_conn_string(self):
+        split = urlsplit(self.root_url)
+        #how to fix this in bokeh and wakari?
+        if split.scheme == 'http':
+            return "ws://%s/bokeh/sub" % split.netloc
+        else:
+            return "wss://%s/bokeh/sub" % split.netloc
+
+    def subscribe(self):
+        """ Subscribes to the changes of the current document (e.g.
+        selections or ranges changed in the browser) over the server's
+        websocket.  A background thread applies them to the models of this
+        session as they arrive, and triggers their callbacks, so there is
+        no need to poll with load_all() or load_obj().  Requires the
+        websocket-client package.
+        """
+        try:
+            import websocket
+        except ImportError:
+            raise RuntimeError("subscribe() requires websocket-client "
+                               "(https://pypi.python.org/pypi/websocket-client)")
+        self.unsubscribe()
+        topic = "bokehplot:" + self.docid
+        socket = websocket.create_connection(self.ws_conn_string())
+        socket.send(self.serialize({'msgtype' : 'subscribe',
+                                    'topic' : topic,
+                                    'auth' : self.apikey}))
+        reply = protocol.deserialize_json(socket.recv().split(":", 2)[-1])
+        if reply.get('msgtype') != 'status' or \
+           reply['status'][0] != 'subscribesuccess':
+            socket.close()
+            raise RuntimeError('subscribing to "%s" failed' % topic)
+        # the server doesn't send our own changes back to us
+        with self._lock:
+            self.http_session.headers['Continuum-Clientid'] = reply['status'][2]
+        self._subscriber = _Subscriber(self, socket)
+        self._subscriber.start()
+
+    def unsubscribe(self):
+        """ Closes the websocket opened by subscribe() """
+        if self._subscriber is not None:
+            self._subscriber.close()
+            self._subscriber = None
+            with self._lock:
+                self.http_session.headers.pop('Continuum-Clientid', None)
+
     #------------------------------------------------------------------------
     # Storing models
     #------------------------------------------------------------------------
@@ -630,39 +1173,230 @@ class PlotServerSession(BaseHTMLSession):
     def store_obj(self, obj, ref=None):
         return self.store_objs([obj])
 
-    def store_broadcast_attrs(self, attrs):
-        data = self.serialize(attrs)
+    def _copy_headers(self, http_session):
+        """ Gives **http_session**, the requests session of a background
+        thread, the headers of http_session
+        """
+        with self._lock:
+            http_session.headers = self.http_session.headers.copy()
+
+    def _upload(self, url, data, http_session=None):
+        if http_session is None:
+            http_session = self.http_session
+        headers = {}
+        if self.compress_uploads and protocol.should_compress(data):
+            data = protocol.compress(data, 'gzip')
+            headers['Content-Encoding'] = 'gzip'
+        return http_session.post(url, data=data, headers=headers)
+
+    def store_broadcast_attrs(self, attrs, http_session=None):
+        with self._lock:
+            data = self.serialize(list(self.share_model_columns(attrs)))
         url = utils.urljoin(self.base_url, self.docid + "/", "bulkupsert")
-        self.http_session.post(url, data=data)
+        response = self._upload(url, data, http_session)
+        self._record_written(response)
+        return response
 
     def store_objs(self, to_store):
-        models = self.broadcast_attrs(to_store)
-        self.store_broadcast_attrs(models)
-        for m in to_store:
-            m._dirty = False
+        with self._lock:
+            changes = [m.changes_since_push() for m in to_store]
+            # the server merges partial updates into the models it has
+            models = self.broadcast_attrs(to_store, partial=True)
+            # what changes from now on is sent by the next store
+            for m in to_store:
+                m._mark_clean()
+        if self.push_interval is not None:
+            if self._push_worker is None:
+                self._push_worker = _PushWorker(self, self.push_interval)
+            self._push_worker.put(models)
+            return
+        ok = False
+        try:
+            response = self.store_broadcast_attrs(models)
+            ok = response.ok
+            if not ok:
+                logger.error("storing models failed: %s", response.status_code)
+        finally:
+            if not ok:
+                # the next store_all() sends them again
+                with self._lock:
+                    for m, names in zip(to_store, changes):
+                        m._mark_dirty(names)
 
     def store_all(self):
-        to_store = [x for x in self._models.values() \
-                    if hasattr(x, '_dirty') and x._dirty]
+        if self.defer('store_all', self.store_all):
+            return []
+        with self._lock:
+            to_store = [x for x in self._models.values() \
+                        if hasattr(x, '_dirty') and x._dirty]
         self.store_objs(to_store)
         return to_store
 
+    def flush(self):
+        """ Starts uploading the models queued for the background push
+        (see push_interval) without waiting for the next interval
+        """
+        if self._push_worker is not None:
+            self._push_worker.flush()
+
+    def wait(self, timeout=None):
+        """ Uploads the models queued for the background push and blocks
+        until they were stored.  Returns False if an upload failed or
+        **timeout** seconds passed, True otherwise.
+        """
+        if self._push_worker is None:
+            return True
+        return self._push_worker.wait(timeout)
+
+    def store_stream(self, obj, new_data, rollover=None):
+        """ Sends rows appended to the data columns of **obj** (a
+        ColumnDataSource, see ColumnDataSource.stream) to the server,
+        which appends them to its copy and forwards them to the browsers.
+        Models queued for the background push are uploaded first.
+        """
+        self.wait()
+        url = utils.urljoin(self.base_url, self.docid + "/",
+                            obj.__view_model__ + "/", obj._id + "/", "stream")
+        data = self.serialize({'data' : new_data, 'rollover' : rollover})
+        self._record_written(self._upload(url, data))
+
+    def store_patch(self, obj, columns):
+        """ Updates some values of the data columns of **obj** (a
+        ColumnDataSource), locally and on the server, without re-sending
+        the whole data dict.  **columns** is a patch in the format of
+        data.diff_columns, e.g. {'y' : {'indices' : [3, 7], 'values' : [1, 2]}}
+        Models queued for the background push are uploaded first.
+        """
+        self.wait()
+        with self._lock, untracked(obj.data):
+            apply_column_patch(obj.data, columns)
+        url = utils.urljoin(self.base_url, self.docid + "/",
+                            obj.__view_model__ + "/", obj._id + "/", "patch")
+        self._record_written(self._upload(
+            url, self.serialize({'columns' : columns})))
+
+
+    #------------------------------------------------------------------------
+    # Applying changes made elsewhere
+    #------------------------------------------------------------------------
+
+    def _record_written(self, response):
+        """ Notes the versions of the changes a write recorded on the
+        server (its X-Bokeh-Changes header), these are not applied again
+        when catching up
+        """
+        versions = response.headers.get('X-Bokeh-Changes')
+        with self._lock:
+            if not versions or self.version is None:
+                return
+            self._written.update(int(v) for v in versions.split(","))
+            self._set_version(self.version)
+
+    def _set_version(self, version):
+        # our own changes right after version are nothing to catch up on
+        self._written = set(v for v in self._written if v > version)
+        while version + 1 in self._written:
+            version += 1
+            self._written.discard(version)
+        self.version = version
+
+    def apply_message(self, msgobj):
+        """ Applies a message with changes to the models of the current
+        document (as broadcast by the server) to the models of this session
+        """
+        handler = getattr(self, '_apply_' + msgobj.get('msgtype', ''), None)
+        if handler is not None:
+            with self._lock:
+                handler(msgobj)
+
+    def _apply_modelpush(self, msgobj):
+        specs = msgobj['modelspecs']
+        models = self.load_broadcast_attrs(specs)
+        # the server already has these attributes, local changes to the
+        # others still have to be pushed
+        for m, spec in zip(models, specs):
+            m._mark_clean(spec['attributes'])
+
+    def _apply_modelpatch(self, msgobj):
+        for patch in msgobj['patches']:
+            m = self._models.get(patch['id'])
+            if m is None:
+                continue
+            data = getattr(m, patch['attr'])
+            with untracked(data):
+                apply_column_patch(data, patch['columns'])
+            m._trigger(patch['attr'], data, data)
+
+    def _apply_modelstream(self, msgobj):
+        m = self._models.get(msgobj['id'])
+        if m is None:
+            return
+        data = getattr(m, msgobj['attr'])
+        with untracked(data):
+            stream_columns(data, msgobj['data'], msgobj.get('rollover'))
+        m._trigger(msgobj['attr'], data, data)
+
+    def _apply_modeldel(self, msgobj):
+        for spec in msgobj['modelspecs']:
+            self._models.pop(spec['id'], None)
+
+    def catch_up(self, http_session=None):
+        """ Brings the models of the current document up to date with the
+        server.  Only the changes made since they were loaded are fetched,
+        unless the server's change log doesn't go back that far, then the
+        whole document is loaded again.  Returns True if the changes were
+        enough.  Changes made by this session itself are skipped.  The
+        requests are made with **http_session**, if given.
+        """
+        if http_session is None:
+            http_session = self.http_session
+        since = self.version
+        if since is not None:
+            url = utils.urljoin(self.base_url, self.docid + "/", "changes")
+            result = protocol.deserialize_json(http_session.get(
+                url, params={'since' : since}).content)
+            if not result.get('resync'):
+                clientid = http_session.headers.get('Continuum-Clientid')
+                with self._lock:
+                    # the subscriber may have applied some of them meanwhile
+                    current = self.version if self.version is not None else since
+                    for msgobj in result['changes']:
+                        version = msgobj.get('version')
+                        if version in self._written or \
+                           (version is not None and version <= current) or \
+                           (clientid is not None and
+                            msgobj.get('origin') == clientid):
+                            continue
+                        self.apply_message(msgobj)
+                    self._set_version(max(result['version'], current))
+                return True
+        self.load_all(http_session=http_session)
+        return False
 
     #------------------------------------------------------------------------
     # Loading models
     #------------------------------------------------------------------------
 
-    def load_all(self, asdict=False):
+    def load_all(self, asdict=False, http_session=None):
         """the json coming out of this looks different than that coming
         out of load_type, because it contains id, type, attributes, whereas
         the other one just contains attributes directly
         """
+        if http_session is None:
+            http_session = self.http_session
         url = utils.urljoin(self.base_url, self.docid +"/")
-        attrs = protocol.deserialize_json(self.http_session.get(url).content)
+        response = http_session.get(url)
+        attrs = protocol.deserialize_json(response.content)
         if not asdict:
-            models = self.load_broadcast_attrs(attrs)
-            for m in models:
-                m._dirty = False
+            with self._lock:
+                version = response.headers.get('X-Bokeh-Version')
+                if version is not None:
+                    self._set_version(int(version))
+                else:
+                    self.version = None
+                models = self.load_broadcast_attrs(attrs)
+                for m in models:
+                    m._mark_clean()
             return models
         else:
             models = attrs
@@ -674,7 +1408,7 @@ class PlotServerSession(BaseHTMLSession):
         if not asdict:
             models = self.load_attrs(typename, attrs)
             for m in models:
-                m._dirty = False
+                m._mark_clean()
             return models
         else:
             models = attrs
@@ -765,15 +1499,15 @@ class PlotServerSession(BaseHTMLSession):
         if models is None:
             models = self._models.values()
         for m in models:
-            del m._callback_queue[:]
+            m._callback_queue = None
 
     def execute_callback_queue(self, models=None):
         if models is None:
             models = self._models.values()
         for m in models:
-            for cb in m._callback_queue:
+            for cb in m._callback_queue or ():
                 m._trigger(*cb)
-            del m._callback_queue[:]
+            m._callback_queue = None
     #------------------------------------------------------------------------
     # Static files
     #------------------------------------------------------------------------
@@ -829,16 +1563,7 @@ class NotebookSessionMixin(object):
         plot_ref = self.get_ref(the_plot)
         elementid = str(uuid.uuid4())
 
-        # Manually convert our top-level models into dicts, before handing
-        # them in to the JSON encoder.  (We don't want to embed the call to
-        # vm_serialize into the PlotObjEncoder, because that would cause
-        # all the attributes to be duplicated multiple times.)
-        models = []
-        for m in objects:
-            ref = self.get_ref(m)
-            ref["attributes"] = m.vm_serialize()
-            ref["attributes"].update({"id": ref["id"], "doc": None})
-            models.append(ref)
+        models = list(self._model_refs(objects))
 
         js = self._load_template(self.js_template).render(
                     elementid = elementid,
@@ -859,16 +1584,7 @@ class NotebookSessionMixin(object):
         plot_ref = self.get_ref(the_plot)
         elementid = str(uuid.uuid4())
 
-        # Manually convert our top-level models into dicts, before handing
-        # them in to the JSON encoder.  (We don't want to embed the call to
-        # vm_serialize into the PlotObjEncoder, because that would cause
-        # all the attributes to be duplicated multiple times.)
-        models = []
-        for m in objects:
-            ref = self.get_ref(m)
-            ref["attributes"] = m.vm_serialize()
-            ref["attributes"].update({"id": ref["id"], "doc": None})
-            models.append(ref)
+        models = list(self._model_refs(objects))
 
         js = self._load_template(self.js_template).render(
                     elementid = elementid,
@@ -931,14 +1647,6 @@ class NotebookSession(NotebookSessionMixin, HTMLFileSession):
 class NotebookServerSession(NotebookSessionMixin, PlotServerSession):
     """ An IPython Notebook session that is connected to a plot server.
     """
-    def ws_conn_string(self):
-        split = urlsplit(self.root_url)
-        #how to fix this in bokeh and wakari?
-        if split.scheme == 'http':
-            return "ws://%s/bokeh/sub" % split.netloc
-        else:
-            return "wss://%s/bokeh/sub" % split.netloc
-
     def dumps(self, objects):
         """ Returns the HTML contents as a string
         FIXME : signature different than other dumps
@@ -5,7 +5,7 @@ import numpy as np
 import datetime as dt
 
 from ..bbmodel import ContinuumModel, register_type
-from ..data import make_source
+from ..data import make_source, make_columns, columns_to_records
 
 class PandasDataSource(ContinuumModel):
     # FIXME: this is a little redundant with pandas_plot_data.py..
@@ -99,16 +99,23 @@ class PandasPivotModel(PandasPlotSource):
         data = data[self.get('offset'):self.get('offset')+self.get('length')]
         return data
 
-    def format_data(self, jsondata):
-        """inplace manipulation of jsondata
+    def format_columns(self, columns):
+        """inplace formatting of the output of make_columns, a column at
+        a time: floats to their precision, dates to isoformat strings
         """
         precision = self.get('precision', {})
-        for dp in jsondata:
-            for k in dp:
-                if isinstance(dp[k], float):
-                    dp[k] = "%%.%df" % precision.get(k,2) % dp[k]
-                elif isinstance(dp[k], (dt.date, dt.datetime)):
-                    dp[k] = dp[k].isoformat()
+        def format_value(k, v):
+            if isinstance(v, float):
+                return "%%.%df" % precision.get(k,2) % v
+            elif isinstance(v, (dt.date, dt.datetime)):
+                return v.isoformat()
+            return v
+        for k, col in columns.items():
+            if col.dtype.kind == 'f':
+                columns[k] = np.char.mod("%%.%df" % precision.get(k,2), col)
+            elif col.dtype.kind == 'O':
+                columns[k] = np.array([format_value(k, v) for v in col],
+                                      dtype=object)
 
     def get_data(self):
         data = super(PandasPivotModel, self).get_data()
@@ -166,8 +173,9 @@ class PandasPivotModel(PandasPlotSource):
             selected = self.get_slice(self.fulldata)['_selected']
         self.set('index', data.index.tolist())
         columns = data.columns.tolist()
-        data = make_source(**self.dataframe_to_mapping(data))
-        self.format_data(data)
+        coldata, validity = make_columns(**self.dataframe_to_mapping(data))
+        self.format_columns(coldata)
+        data = columns_to_records(coldata, validity)
 
         self.set('selected', selected)
         self.set('data', data)
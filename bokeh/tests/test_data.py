@@ -0,0 +1,112 @@
+import unittest
+import numpy as np
+import pandas as pd
+
+from bokeh.data import (make_source, make_columns, columns_to_records,
+                        diff_columns, apply_column_patch, stream_columns)
+from bokeh.objects import ColumnDataSource
+
+class MakeSourceTest(unittest.TestCase):
+
+    def test_records(self):
+        output = make_source(x=np.array([1.0, np.nan, 3.0]),
+                             y=pd.Series([4, 5, 6]))
+        self.assertEqual(output, [{'x' : 1.0, 'y' : 4},
+                                  {'x' : 'NaN', 'y' : 5},
+                                  {'x' : 3.0, 'y' : 6}])
+
+    def test_columns_keep_arrays(self):
+        x = np.array([1.0, np.nan, 3.0])
+        columns, validity = make_columns(x=x, y=np.arange(3))
+        self.assertTrue(columns['x'] is x)
+        self.assertEqual(list(validity.keys()), ['x'])
+        self.assertEqual(validity['x'].tolist(), [True, False, True])
+
+    def test_object_column_nan(self):
+        columns, validity = make_columns(z=['a', float('nan'), None])
+        self.assertEqual(columns_to_records(columns, validity),
+                         [{'z' : 'a'}, {'z' : 'NaN'}, {'z' : None}])
+
+    def test_array_values(self):
+        output = make_source(w=np.ones((2, 2)))
+        self.assertEqual(output, [{'w' : [1.0, 1.0]}, {'w' : [1.0, 1.0]}])
+
+class ColumnPatchTest(unittest.TestCase):
+
+    def test_diff_and_apply(self):
+        old = {'x' : np.arange(10.0), 'y' : list(range(10)), 'z' : ['a'] * 4}
+        new = {'x' : old['x'].copy(), 'y' : list(range(10)),
+               'z' : ['a', 'b', 'a', 'a']}
+        new['x'][3:5] = -1
+        new['y'][2] = new['y'][7] = 9
+        patch = diff_columns(old, new)
+        self.assertEqual(patch['x']['slice'], [3, 5])
+        self.assertEqual(patch['y']['indices'].tolist(), [2, 7])
+        self.assertEqual(patch['z']['slice'], [1, 2])
+        data = dict((k, list(v)) for k, v in old.items())
+        apply_column_patch(data, patch)
+        self.assertEqual(data['x'], new['x'].tolist())
+        self.assertEqual(data['y'], new['y'])
+        self.assertEqual(data['z'], new['z'])
+
+    def test_unchanged_and_nan(self):
+        old = {'x' : np.array([1.0, np.nan])}
+        self.assertEqual(diff_columns(old, {'x' : old['x'].copy()}), {})
+
+    def test_large_change_replaces(self):
+        old = {'x' : [1, 2, 3]}
+        patch = diff_columns(old, {'x' : [4, 5, 6]})
+        self.assertEqual(patch, {'x' : {'replace' : [4, 5, 6]}})
+        self.assertEqual(diff_columns(old, {'x' : [1, 2], 'y' : [1, 2]}), None)
+
+class StreamColumnsTest(unittest.TestCase):
+
+    def test_stream(self):
+        data = {'x' : np.arange(3.0), 'y' : [1, 2, 3]}
+        stream_columns(data, {'x' : [3.0, 4.0], 'y' : np.array([4, 5])})
+        self.assertTrue(np.array_equal(data['x'], np.arange(5.0)))
+        self.assertTrue(np.array_equal(data['y'], [1, 2, 3, 4, 5]))
+
+    def test_rollover(self):
+        data = {'x' : np.arange(3.0), 'y' : [1, 2, 3]}
+        stream_columns(data, {'x' : [3.0], 'y' : [4]}, rollover=2)
+        self.assertEqual(data['x'].tolist(), [2.0, 3.0])
+        self.assertEqual(data['y'], [3, 4])
+
+    def test_source_stream(self):
+        source = ColumnDataSource(data={'x' : [1, 2]})
+        source._dirty = False
+        source.stream({'x' : [3]})
+        self.assertEqual(source.data['x'], [1, 2, 3])
+        self.assertTrue(source._dirty)
+
+    def test_source_precision(self):
+        source = ColumnDataSource(data={'x' : np.array([0.123456, 1.0]),
+                                        'y' : ['a', 'b']})
+        source.precision = {'x' : 2}
+        data = source.vm_serialize()['data']
+        self.assertEqual(data['x'].tolist(), [0.12, 1.0])
+        self.assertEqual(data['y'], ['a', 'b'])
+        self.assertEqual(source.data['x'][0], 0.123456)
+
+class HashContentTest(unittest.TestCase):
+
+    def test_identical_data_not_dirty(self):
+        source = ColumnDataSource(data={"x" : np.arange(100), "y" : list(range(100))})
+        source.hash_content = True
+        source.reset_dirty_vars()
+        source.data = {"x" : np.arange(100), "y" : list(range(100))}
+        self.assertEqual(source.dirty_vars(), set())
+        source.data = {"x" : np.arange(100), "y" : list(range(1, 101))}
+        self.assertEqual(source.dirty_vars(), set(["data"]))
+
+    def test_digest_cached_until_change(self):
+        source = ColumnDataSource(data={"x" : np.arange(100)})
+        prop = source.__descriptors__["data"]
+        first = prop.digest(source.data)
+        self.assertEqual(source.data._digest[1], first)
+        source.data["y"] = np.arange(3)
+        self.assertNotEqual(prop.digest(source.data), first)
+
+if __name__ == "__main__":
+    unittest.main()
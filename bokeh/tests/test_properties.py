@@ -1,7 +1,11 @@
+import copy
+import json
 import unittest
 import numpy as np
 
-from bokeh.properties import HasProps, Int, Array, String, Enum, Float, DataSpec, ColorSpec
+from bokeh.properties import (HasProps, Int, Array, String, Enum, Float,
+    DataSpec, ColorSpec, List, Dict, Include, FillProps, ObservedList,
+    ObservedDict, ObservedArray, untracked)
 
 class Basictest(unittest.TestCase):
 
@@ -271,5 +275,203 @@ class TestColorSpec(unittest.TestCase):
         self.assertEqual(f.col, "field2")
         self.assertDictEqual(desc.to_dict(f), {"field": "field2"})
 
+class SlotStorageTest(unittest.TestCase):
+
+    def test_defaults_not_stored(self):
+        class Foo(HasProps):
+            x = Int(12)
+            y = String("hello")
+        f = Foo(y="bar")
+        self.assertEqual(f.x, 12)
+        self.assertEqual(f.y, "bar")
+        self.assertEqual(f.changed_vars(), set(["y"]))
+        self.assertFalse("_x" in f.__dict__)
+        self.assertFalse("_y" in f.__dict__)
+        del f.y
+        self.assertEqual(f.y, "hello")
+
+    def test_multiple_inheritance(self):
+        class A(HasProps):
+            a = Int(1)
+        class B(HasProps):
+            b = Int(2)
+        class C(A, B):
+            c = List
+        c = C(a=10, b=20)
+        self.assertEqual(set(C.properties()), set(["a", "b", "c"]))
+        self.assertEqual((c.a, c.b, c.c), (10, 20, []))
+        clone = c.clone()
+        self.assertEqual((clone.a, clone.b), (10, 20))
+        clone.a = 5
+        self.assertEqual(c.a, 10)
+
+    def test_include(self):
+        class Foo(HasProps):
+            body = Include(FillProps)
+        f = Foo()
+        self.assertEqual(set(f.properties()), set(["body_fill_color",
+                                                   "body_fill_alpha"]))
+        f.body_fill_alpha = 0.5
+        self.assertEqual(f.body_fill_alpha, 0.5)
+        self.assertEqual(f.body_fill_color, "gray")
+
+    def test_extra_kwargs_changed(self):
+        class Foo(HasProps):
+            x = Int(12)
+        f = Foo(x=1, extra=2)
+        self.assertEqual(f.extra, 2)
+        self.assertEqual(f.changed_vars(), set(["x", "extra"]))
+        f.reset_changed_vars()
+        self.assertEqual(f.changed_vars(), set())
+
+class ClassTablesTest(unittest.TestCase):
+
+    def test_subclass_tables(self):
+        class Base(HasProps):
+            x = Int(1)
+            items = List(has_ref=True)
+        class Derived(Base):
+            y = Dict()
+        # the base tables are built first, and must not leak into Derived
+        self.assertEqual(Base.properties(), set(["x", "items"]))
+        self.assertEqual(Derived.properties(), set(["x", "items", "y"]))
+        self.assertEqual(Derived.properties_with_refs(), set(["items"]))
+        self.assertEqual(Derived.properties_containers(), set(["y"]))
+        self.assertEqual(Base.properties_containers(), set())
+        self.assertIs(Derived.properties(), Derived.properties())
+
+    def test_dataspecs_cached(self):
+        class Foo(HasProps):
+            x = DataSpec("x")
+            color = ColorSpec("red")
+        class Bar(Foo):
+            x = DataSpec("xx")
+            y = DataSpec("y")
+        self.assertEqual(Foo.dataspecs(), set(["x", "color"]))
+        self.assertEqual(Bar.dataspecs(), set(["x", "y", "color"]))
+        self.assertIs(Bar.dataspecs_with_refs(), Bar.dataspecs_with_refs())
+        self.assertIs(Bar.dataspecs(), Bar.dataspecs())
+        self.assertIs(Bar.dataspecs_with_refs()["x"], Bar.__dict__["x"])
+
+    def test_default_factories(self):
+        class Foo(HasProps):
+            x = Int(1)
+            items = List([1, 2])
+            mapping = Dict()
+        self.assertEqual(set(Foo.default_factories()), set(["items", "mapping"]))
+        a, b = Foo(), Foo()
+        self.assertEqual(a.items, [1, 2])
+        self.assertIsNot(a.items, b.items)
+        self.assertIsNot(a.mapping, b.mapping)
+        self.assertEqual(Foo.items, [1, 2])
+
+class ObservedContainerTest(unittest.TestCase):
+
+    def make(self):
+        class Foo(HasProps):
+            items = List()
+            mapping = Dict()
+            values = Array()
+        f = Foo(items=[1, 2], mapping={"a" : 1}, values=np.arange(3))
+        f._dirty = False
+        f.reset_dirty_vars()
+        return f
+
+    def test_list(self):
+        f = self.make()
+        self.assertIsInstance(f.items, ObservedList)
+        f.items.append(3)
+        self.assertEqual(f.dirty_vars(), set(["items"]))
+        self.assertTrue(f._dirty)
+        self.assertEqual(f.items.changed_keys, set([2]))
+        f.items.sort()
+        self.assertIsNone(f.items.changed_keys)
+        f.reset_dirty_vars()
+        self.assertEqual(f.dirty_vars(), set())
+        self.assertEqual(f.items.changed_keys, set())
+
+    def test_dict(self):
+        f = self.make()
+        f.mapping["b"] = 2
+        f.mapping.update(c=3)
+        self.assertEqual(f.dirty_vars(), set(["mapping"]))
+        self.assertEqual(f.mapping.changed_keys, set(["b", "c"]))
+        self.assertEqual(f.mapping, {"a" : 1, "b" : 2, "c" : 3})
+        f.reset_dirty_vars()
+        f.mapping |= {"d" : 4}
+        self.assertEqual(f.dirty_vars(), set(["mapping"]))
+        self.assertEqual(f.mapping.changed_keys, set(["d"]))
+        self.assertIsInstance(f.mapping, ObservedDict)
+
+    def test_array(self):
+        f = self.make()
+        self.assertIsInstance(f.values, ObservedArray)
+        f.values[1] = 10
+        self.assertEqual(f.dirty_vars(), set(["values"]))
+        f.reset_dirty_vars()
+        f.values += 1
+        self.assertEqual(f.dirty_vars(), set(["values"]))
+        f.reset_dirty_vars()
+        (f.values + 1)[0] = 5
+        self.assertEqual(f.dirty_vars(), set())
+
+    def test_replaced_and_copied(self):
+        f = self.make()
+        old = f.items
+        f.items = [5]
+        f.reset_dirty_vars()
+        old.append(1)
+        self.assertEqual(f.dirty_vars(), set())
+        # assignment stores a copy, the assigned list is not observed
+        items = [1]
+        f.items = items
+        f.reset_dirty_vars()
+        items.append(2)
+        self.assertEqual(f.dirty_vars(), set())
+        self.assertEqual(f.items, [1])
+        self.assertIs(type(copy.copy(f.items)), list)
+        self.assertIs(type(copy.deepcopy(f.mapping)), dict)
+        self.assertEqual(json.loads(json.dumps(f.mapping)), {"a" : 1})
+
+    def test_untracked(self):
+        f = self.make()
+        with untracked(f.mapping):
+            f.mapping["b"] = 2
+        self.assertEqual(f.dirty_vars(), set())
+        self.assertFalse(f._dirty)
+        f.mapping["c"] = 3
+        self.assertEqual(f.dirty_vars(), set(["mapping"]))
+
+class MatchesTest(unittest.TestCase):
+
+    def test_arrays_by_identity(self):
+        class Foo(HasProps):
+            data = Dict()
+            values = Array()
+        f = Foo(data={"x" : np.arange(10)}, values=np.arange(10))
+        f.reset_dirty_vars()
+        f.values = f.values
+        f.data = {"x" : f.data["x"]}
+        self.assertEqual(f.dirty_vars(), set(["data"]))
+        f.reset_dirty_vars()
+        # equal contents, but a different array: a change, and no error
+        f.data = {"x" : np.arange(10)}
+        f.values = np.arange(10)
+        self.assertEqual(f.dirty_vars(), set(["data", "values"]))
+
+    def test_small_values_by_content(self):
+        class Foo(HasProps):
+            items = List()
+            name = String()
+        f = Foo(items=[1, 2], name="a")
+        f.reset_dirty_vars()
+        f.items = [1, 2]
+        f.name = "a"
+        self.assertEqual(f.dirty_vars(), set())
+        f.items = list(range(100))
+        f.reset_dirty_vars()
+        f.items = list(range(100))
+        self.assertEqual(f.dirty_vars(), set(["items"]))
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,202 @@
+import unittest
+import json
+import numpy as np
+import pandas as pd
+
+from bokeh import protocol
+
+class BinaryArrayTest(unittest.TestCase):
+
+    def test_list_encoding_by_default(self):
+        s = protocol.serialize_json({'x' : np.arange(3)})
+        self.assertEqual(protocol.deserialize_json(s), {'x' : [0, 1, 2]})
+
+    def test_base64_roundtrip(self):
+        data = {'x' : np.linspace(0, 1, 10),
+                'y' : np.arange(10, dtype=np.int32),
+                'z' : np.ones((2, 3), dtype=np.float32)}
+        s = protocol.serialize_json(data, binary=True)
+        self.assertTrue('__ndarray__' in s)
+        result = protocol.deserialize_json(s)
+        for k, v in data.items():
+            self.assertEqual(result[k].dtype, v.dtype)
+            self.assertEqual(result[k].shape, v.shape)
+            self.assertTrue(np.array_equal(result[k], v))
+
+    def test_int64_widened_to_float64(self):
+        s = protocol.serialize_json({'x' : np.arange(5)}, binary=True)
+        result = protocol.deserialize_json(s)['x']
+        self.assertEqual(result.dtype, np.float64)
+        self.assertTrue(np.array_equal(result, np.arange(5)))
+
+    def test_big_endian_sent_little(self):
+        x = np.arange(4, dtype='>f8')
+        meta = protocol.encode_binary_array(x)
+        self.assertEqual(meta['order'], 'little')
+        self.assertTrue(np.array_equal(protocol.decode_binary_array(meta), x))
+
+    def test_non_numeric_falls_back_to_list(self):
+        s = protocol.serialize_json({'x' : np.array(['a', 'b'])}, binary=True)
+        self.assertEqual(protocol.deserialize_json(s), {'x' : ['a', 'b']})
+
+    def test_buffers(self):
+        data = {'x' : np.linspace(0, 1, 10), 'y' : [1, 2]}
+        s, buffers = protocol.serialize_json_buffers(data)
+        self.assertEqual(len(buffers), 1)
+        self.assertTrue('__buffer__' in s)
+        raw = [memoryview(b).tobytes() for b in buffers]
+        result = protocol.deserialize_json(s, buffers=raw)
+        self.assertTrue(np.array_equal(result['x'], data['x']))
+        self.assertEqual(result['y'], [1, 2])
+
+class DataFramingTest(unittest.TestCase):
+
+    def roundtrip(self, data, **kwargs):
+        frames = protocol.default_serialize_data(data)
+        frames = [memoryview(f).tobytes() for f in frames]
+        return protocol.default_deserialize_data(frames, **kwargs)
+
+    def test_arrays(self):
+        data = [np.arange(10),
+                np.ones((3, 4), order='F'),
+                np.arange(12).reshape(3, 4)[:, ::2],
+                np.arange(3, dtype='>i4'),
+                np.array(5.0)]
+        for orig, result in zip(data, self.roundtrip(data)):
+            self.assertEqual(orig.dtype, result.dtype)
+            self.assertTrue(np.array_equal(orig, result))
+
+    def test_header_not_pickled(self):
+        frames = protocol.default_serialize_data([np.arange(4)])
+        self.assertEqual(protocol.unpack_frame_header(frames[0]),
+                         (protocol.frame_dtype_codes['int64'], (4,), 0))
+
+    def test_objects(self):
+        data = [{'a' : 1}, np.array(['a', 'bb'])]
+        result = self.roundtrip(data, allow_pickle=True)
+        self.assertEqual(result[0], {'a' : 1})
+        self.assertEqual(result[1].tolist(), ['a', 'bb'])
+
+    def test_pickle_rejected_by_default(self):
+        with self.assertRaises(ValueError):
+            self.roundtrip([{'a' : 1}])
+
+    def test_legacy_format(self):
+        frames = protocol.pickle_serialize_data([np.arange(3)])
+        frames = [memoryview(f).tobytes() for f in frames]
+        with self.assertRaises(ValueError):
+            protocol.default_deserialize_data(frames)
+        result = protocol.default_deserialize_data(frames, allow_pickle=True)
+        self.assertTrue(np.array_equal(result[0], np.arange(3)))
+
+class CompressionTest(unittest.TestCase):
+
+    def test_roundtrip(self):
+        text = protocol.serialize_json({'x' : np.linspace(0, 1, 1000)})
+        for encoding in ('gzip', 'deflate'):
+            compressed = protocol.compress(text, encoding)
+            self.assertTrue(len(compressed) < len(text))
+            self.assertEqual(protocol.decompress(compressed, encoding),
+                             text.encode('utf-8'))
+
+    def test_threshold(self):
+        self.assertFalse(protocol.should_compress("{}", 1024))
+        self.assertTrue(protocol.should_compress("x" * 1024, 1024))
+
+    def test_accepted_encoding(self):
+        self.assertEqual(protocol.accepted_encoding(None), None)
+        self.assertEqual(protocol.accepted_encoding("gzip, deflate"), "gzip")
+        self.assertEqual(protocol.accepted_encoding("deflate"), "deflate")
+        self.assertEqual(protocol.accepted_encoding("gzip;q=0, deflate"),
+                         "deflate")
+        self.assertEqual(protocol.accepted_encoding("identity"), None)
+        self.assertEqual(protocol.accepted_encoding("*"), "gzip")
+
+class PrecisionTest(unittest.TestCase):
+
+    def test_round_significant(self):
+        x = np.array([0.123456789, 123456.789, -0.000123456, 0.0, np.nan])
+        result = protocol.round_significant(x, 3)
+        self.assertEqual(result[:4].tolist(), [0.123, 123000.0, -0.000123, 0.0])
+        self.assertTrue(np.isnan(result[4]))
+
+    def test_float32_text(self):
+        x = np.array([0.1, 0.2], dtype=np.float32)
+        self.assertEqual(protocol.serialize_json(x), "[0.1, 0.2]")
+
+    def test_float32_text_is_lossless(self):
+        one = np.float32(1)
+        x = np.array([one, np.nextafter(one, np.float32(2)),
+                      np.nextafter(np.nextafter(one, np.float32(2)),
+                                   np.float32(2)),
+                      16777215, np.inf, -3.5], dtype=np.float32)
+        result = json.loads(protocol.serialize_json(x))
+        self.assertEqual(np.array(result, dtype=np.float32).tolist(), x.tolist())
+        self.assertEqual(result[3], 16777215.0)
+
+    def test_delta_roundtrip(self):
+        t = 1.4e12 + np.arange(0, 10000, 1000.0)
+        encoded = protocol.apply_precision(t, 'delta')
+        self.assertEqual(encoded['start'], 1.4e12)
+        result = protocol.deserialize_json(protocol.serialize_json(encoded))
+        self.assertTrue(np.array_equal(result, t))
+        for binary in (True, False):
+            s = protocol.serialize_json({'t' : encoded}, binary=binary)
+            self.assertTrue(np.array_equal(protocol.deserialize_json(s)['t'], t))
+
+    def test_delta_not_applicable(self):
+        x = np.array([3.0, 1.0, 2.0])
+        self.assertTrue(protocol.apply_precision(x, 'delta') is x)
+        x = np.array([1.0, 1.5])
+        self.assertTrue(protocol.apply_precision(x, 'delta') is x)
+
+    def test_time_series_size(self):
+        data = {'t' : 1.4e12 + np.arange(1000) * 1000.0,
+                'y' : np.random.random(1000)}
+        full = protocol.serialize_json(data)
+        reduced = protocol.serialize_json(protocol.apply_precision_columns(
+            data, {'t' : 'delta', 'y' : 4}))
+        self.assertTrue(len(reduced) * 2 < len(full))
+        _, buffers = protocol.serialize_json_buffers(
+            protocol.apply_precision_columns(data, {'t' : 'delta',
+                                                    'y' : 'float32'}))
+        self.assertTrue(sum(b.nbytes for b in buffers) * 2 <= 16000)
+
+class DatetimeColumnTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = pd.date_range('2014-01-01', periods=3, freq='s')
+        self.ms = [1388534400000.0, 1388534401000.0, 1388534402000.0]
+
+    def test_columns(self):
+        for column in (self.index, self.index.values, pd.Series(self.index),
+                       np.array(list(self.index), dtype=object),
+                       self.index.values.astype('datetime64[ms]')):
+            result = protocol.datetime_column_to_ms(column)
+            self.assertEqual(result.dtype, np.float64)
+            self.assertEqual(result.tolist(), self.ms)
+
+    def test_not_datetime(self):
+        self.assertEqual(protocol.datetime_column_to_ms(np.arange(3)), None)
+        self.assertEqual(protocol.datetime_column_to_ms(
+            np.array(['a', 'b'], dtype=object)), None)
+
+    def test_time_zones(self):
+        eastern = pd.Series(self.index.tz_localize('US/Eastern'))
+        result = protocol.datetime_column_to_ms(eastern)
+        self.assertEqual(result.tolist(), [x + 5 * 3600 * 1000 for x in self.ms])
+
+    def test_nat(self):
+        column = np.array([self.index.values[0], np.datetime64('NaT')])
+        result = protocol.datetime_column_to_ms(column)
+        self.assertEqual(result[0], self.ms[0])
+        self.assertTrue(np.isnan(result[1]))
+
+    def test_serialize(self):
+        s = protocol.serialize_json({'t' : self.index})
+        self.assertEqual(protocol.deserialize_json(s), {'t' : self.ms})
+        s = protocol.serialize_json({'t' : pd.Series(self.index)}, binary=True)
+        self.assertEqual(protocol.deserialize_json(s)['t'].tolist(), self.ms)
+
+if __name__ == "__main__":
+    unittest.main()
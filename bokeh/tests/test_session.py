@@ -0,0 +1,703 @@
+import unittest
+import gc
+import json
+import os
+import shutil
+import tempfile
+import threading
+import numpy as np
+
+from bokeh import protocol
+from bokeh.session import (HTMLFileSession, PlotServerSession, PlotContext,
+    _Subscriber, _PushWorker)
+from bokeh.objects import (Range1d, ColumnDataSource, Plot,
+    recursively_traverse_plot_object, resolve_json, json_find, is_ref)
+
+class StreamingSerializeTest(unittest.TestCase):
+
+    def test_serialize_iter_matches_serialize(self):
+        sess = HTMLFileSession("unused.html")
+        sess.add(Range1d(start=1, end=2))
+        obj = [{'a' : [1, {'b' : np.arange(3)}], 'c' : {}, 'd' : []},
+               list(sess._model_refs())]
+        for indent in (None, 4):
+            streamed = "".join(sess.serialize_iter(obj, indent=indent))
+            self.assertEqual(streamed, sess.serialize(obj, indent=indent))
+
+    def test_non_string_keys(self):
+        sess = HTMLFileSession("unused.html")
+        obj = [{0 : [1], 1.5 : [2], None : [3], True : [4], 'x' : [5]}]
+        streamed = "".join(sess.serialize_iter(obj))
+        self.assertEqual(streamed, sess.serialize(obj))
+        self.assertEqual(json.loads(streamed)[0]["null"], [3])
+
+    def test_dumpjson_file(self):
+        import io
+        sess = HTMLFileSession("unused.html")
+        sess.add(Range1d(start=1, end=2))
+        f = io.StringIO()
+        sess.dumpjson(pretty=False, file=f)
+        self.assertEqual(f.getvalue(), sess.dumpjson(pretty=False))
+        self.assertEqual(json.loads(f.getvalue())[0]['type'], 'Range1d')
+
+class SharedArraysTest(unittest.TestCase):
+
+    def test_shared_columns_written_once(self):
+        x = np.linspace(0, 1, 1000)
+        sess = HTMLFileSession("unused.html")
+        sources = [ColumnDataSource(data={'x' : x, 'y' : np.random.random(1000)})
+                   for i in range(3)]
+        sess.add(*sources)
+        shared = sess.dumpjson(pretty=False)
+        sess.share_arrays = False
+        unshared = sess.dumpjson(pretty=False)
+        self.assertTrue(len(shared) < len(unshared) * 0.75)
+        models = protocol.deserialize_json(shared)
+        columns = [m['attributes']['data']['x'] for m in models
+                   if m['type'] == 'ColumnDataSource']
+        self.assertEqual(len(columns), 3)
+        for column in columns:
+            self.assertEqual(column, x.tolist())
+        self.assertFalse(columns[0] is columns[1])
+
+    def test_digest(self):
+        shared = protocol.SharedArrays()
+        self.assertEqual(shared.digest(list(range(100))),
+                         shared.digest(np.arange(100)))
+        self.assertNotEqual(shared.digest(np.arange(100)),
+                            shared.digest(np.arange(100.0)))
+        self.assertEqual(shared.digest(np.arange(10)), None)
+        self.assertEqual(shared.digest(['a'] * 100), None)
+
+class Recorder(object):
+    def __init__(self):
+        self.calls = []
+
+    def changed(self, obj, attrname, old, new):
+        self.calls.append((attrname, old, new))
+
+class BatchTest(unittest.TestCase):
+
+    def test_coalesced_events(self):
+        r = Range1d(start=1, end=2)
+        rec = Recorder()
+        r.on_change('start', rec, 'changed')
+        r._dirty = False
+        with r.batch():
+            r.start = 5
+            r.start = 6
+            self.assertEqual(rec.calls, [])
+            self.assertFalse(r._dirty)
+        self.assertEqual(rec.calls, [('start', 1, 6)])
+        self.assertTrue(r._dirty)
+
+    def test_callback_called_once(self):
+        r = Range1d(start=1, end=2)
+        rec = Recorder()
+        r.on_change('start', rec, 'changed')
+        r.on_change('end', rec, 'changed')
+        with r.batch():
+            r.start = 0
+            r.start = 3
+            r.end = 10
+        self.assertEqual(rec.calls, [(('start', 'end'),
+                                      {'start' : 1, 'end' : 2},
+                                      {'start' : 3, 'end' : 10})])
+
+    def test_nested_and_reverted(self):
+        r = Range1d(start=1, end=2)
+        rec = Recorder()
+        r.on_change('start', rec, 'changed')
+        r._dirty = False
+        with r.batch():
+            with r.batch():
+                r.start = 5
+            self.assertEqual(rec.calls, [])
+            r.start = 1
+        self.assertEqual(rec.calls, [])
+        self.assertFalse(r._dirty)
+
+    def test_session_batch(self):
+        sess = HTMLFileSession("unused.html")
+        a, b = Range1d(start=1, end=2), Range1d(start=3, end=4)
+        sess.add(a, b)
+        rec = Recorder()
+        a.on_change('end', rec, 'changed')
+        b.on_change('end', rec, 'changed')
+        with sess.batch():
+            a.end = 20
+            b.end = 40
+            self.assertEqual(rec.calls, [])
+        self.assertEqual(sorted(rec.calls), [('end', 2, 20), ('end', 4, 40)])
+
+class PartialUpdateTest(unittest.TestCase):
+
+    def test_unpushed_sends_everything(self):
+        r = Range1d(start=1, end=2)
+        self.assertIsNone(r.changes_since_push())
+        self.assertEqual(r.vm_serialize_changes(), r.vm_serialize())
+
+    def test_assigned_attributes(self):
+        r = Range1d(start=1, end=2)
+        r._mark_clean()
+        self.assertEqual(r.changes_since_push(), set())
+        r.start = 5
+        self.assertEqual(r.changes_since_push(), set(["start"]))
+        self.assertEqual(r.vm_serialize_changes(), {"id" : r._id, "start" : 5})
+        r._mark_clean()
+        r.start = 5
+        self.assertEqual(r.changes_since_push(), set())
+
+    def test_containers_mutated_in_place(self):
+        source = ColumnDataSource(data={"x" : [1, 2], "y" : [3, 4]})
+        plot = Plot(title="a")
+        source._mark_clean()
+        plot._mark_clean()
+        source.selected = [1]
+        self.assertEqual(source.changes_since_push(), set(["selected"]))
+        source.data["x"] = [5, 6]
+        self.assertEqual(source.changes_since_push(), set(["selected", "data"]))
+        plot.renderers.append(Range1d())
+        self.assertEqual(plot.changes_since_push(), set(["renderers"]))
+        self.assertNotIn("title", plot.vm_serialize_changes())
+
+    def test_marked_dirty_by_hand(self):
+        source = ColumnDataSource(data={"x" : np.arange(3)})
+        source._mark_clean()
+        source.data["x"][0] = 10
+        source._dirty = True
+        self.assertIsNone(source.changes_since_push())
+
+class Response(object):
+
+    def __init__(self, ok=True):
+        self.ok = ok
+        self.status_code = 200 if ok else 500
+        self.headers = {}
+
+class BackgroundPushTest(unittest.TestCase):
+
+    def make_session(self, interval=10):
+        sess = PlotServerSession(push_interval=interval)
+        sess.docid = "doc"
+        sess.uploads = []
+        sess.responses = []
+        sess.store_broadcast_attrs = lambda attrs, http_session=None: (
+            sess.uploads.append(attrs) or
+            (sess.responses.pop(0) if sess.responses else Response()))
+        self.addCleanup(lambda: sess._push_worker and sess._push_worker.stop())
+        return sess
+
+    def test_coalesced(self):
+        sess = self.make_session()
+        r1, r2 = Range1d(start=1, end=2), Range1d()
+        sess.add(r1, r2)
+        sess.store_all()
+        self.assertFalse(r1._dirty)
+        r1.start = 5
+        r1.end = 6
+        sess.store_all()
+        r1.start = 7
+        sess.store_objs([r1])
+        self.assertEqual(sess.uploads, [])
+        self.assertTrue(sess.wait())
+        self.assertEqual(len(sess.uploads), 1)
+        attrs = dict((ref["id"], ref["attributes"]) for ref in sess.uploads[0])
+        self.assertEqual(set(attrs), set([r1._id, r2._id]))
+        self.assertEqual((attrs[r1._id]["start"], attrs[r1._id]["end"]), (7, 6))
+        self.assertTrue(sess.wait())
+        self.assertEqual(len(sess.uploads), 1)
+
+    def test_interval(self):
+        sess = self.make_session(interval=0.01)
+        uploaded = threading.Event()
+        store = sess.store_broadcast_attrs
+        sess.store_broadcast_attrs = lambda attrs, http_session=None: (
+            uploaded.set(), store(attrs))[1]
+        sess.store_obj(Range1d())
+        self.assertTrue(uploaded.wait(5))
+
+    def test_failed_upload_is_retried(self):
+        sess = self.make_session()
+        r = Range1d(start=1, end=3)
+        sess.responses.append(Response(ok=False))
+        sess.store_obj(r)
+        self.assertFalse(sess.wait())
+        r.start = 2
+        sess.store_obj(r)
+        self.assertTrue(sess.wait())
+        self.assertEqual(len(sess.uploads), 2)
+        self.assertEqual(sess.uploads[1][0]["attributes"]["start"], 2)
+        # still has the attributes of the failed upload
+        self.assertEqual(sess.uploads[1][0]["attributes"]["end"], 3)
+
+    def test_stream_after_queued_models(self):
+        sess = self.make_session()
+        source = ColumnDataSource(data={"x" : [1]})
+        sess.store_obj(source)
+        sess._upload = lambda url, data, http_session=None: (
+            sess.uploads.append(url.rsplit("/", 1)[-1]) or Response())
+        sess.store_stream(source, {"x" : [2]})
+        self.assertEqual(len(sess.uploads), 2)
+        self.assertEqual(sess.uploads[1], "stream")
+
+    def test_session_collected(self):
+        sess = PlotServerSession(push_interval=0.01)
+        sess.docid = "doc"
+        worker = sess._push_worker = _PushWorker(sess, 0.01)
+        del sess
+        gc.collect()
+        worker._thread.join(5)
+        self.assertFalse(worker._thread.is_alive())
+        self.assertTrue(worker._stopped)
+
+    def test_synchronous_by_default(self):
+        sess = PlotServerSession()
+        sess.docid = "doc"
+        uploads = []
+        sess.store_broadcast_attrs = lambda attrs: uploads.append(attrs) or Response()
+        sess.store_obj(Range1d())
+        self.assertEqual(len(uploads), 1)
+        self.assertIsNone(sess._push_worker)
+        self.assertTrue(sess.wait())
+
+    def test_unlocked_while_uploading(self):
+        sess = PlotServerSession()
+        sess.docid = "doc"
+        locked = []
+        def try_lock():
+            acquired = sess._lock.acquire(False)
+            if acquired:
+                sess._lock.release()
+            locked.append(not acquired)
+        def upload(url, data, http_session=None):
+            thread = threading.Thread(target=try_lock)
+            thread.start()
+            thread.join()
+            return Response(ok=False)
+        sess._upload = upload
+        r = Range1d(start=1, end=3)
+        sess.add(r)
+        sess.store_all()
+        self.assertEqual(locked, [False])
+        # failed, so it's sent again, with what changed meanwhile
+        self.assertTrue(r._dirty)
+        self.assertIsNone(r.changes_since_push())
+        sess._upload = lambda url, data, http_session=None: Response()
+        sess.store_all()
+        r.start = 2
+        sess._upload = upload
+        sess.store_all()
+        self.assertEqual(r.changes_since_push(), set(["start"]))
+
+    def test_own_http_session(self):
+        sess = self.make_session()
+        sessions = []
+        sess.store_broadcast_attrs = lambda attrs, http_session=None: (
+            sessions.append(http_session) or Response())
+        sess.http_session.headers['Continuum-Clientid'] = 'me'
+        sess.store_obj(Range1d())
+        self.assertTrue(sess.wait())
+        self.assertEqual(sessions, [sess._push_worker._http_session])
+        self.assertIsNot(sessions[0], sess.http_session)
+        self.assertEqual(sessions[0].headers['Continuum-Clientid'], 'me')
+
+class DeferredTest(unittest.TestCase):
+
+    def make_session(self):
+        sess = PlotServerSession()
+        sess.docid = "doc"
+        sess.uploads = []
+        sess.store_broadcast_attrs = lambda attrs: (
+            sess.uploads.append(attrs) or Response())
+        return sess
+
+    def test_one_upload(self):
+        sess = self.make_session()
+        ranges = [Range1d(start=i) for i in range(5)]
+        sess.add(*ranges)
+        sess.store_all()
+        with sess.deferred():
+            for i in range(50):
+                ranges[0].end = i
+                self.assertEqual(sess.store_all(), [])
+                with sess.deferred():
+                    sess.store_all()
+            self.assertEqual(len(sess.uploads), 1)
+        self.assertEqual(len(sess.uploads), 2)
+        self.assertEqual(sess.uploads[1][0]["attributes"],
+                         {"id" : ranges[0]._id, "end" : 49, "doc" : "doc"})
+        self.assertEqual(len(sess.uploads[1]), 1)
+
+    def test_dropped_on_error(self):
+        sess = self.make_session()
+        r = Range1d()
+        sess.add(r)
+        with self.assertRaises(ValueError):
+            with sess.deferred():
+                sess.store_all()
+                raise ValueError
+        self.assertEqual(sess.uploads, [])
+        self.assertTrue(r._dirty)
+        sess.store_all()
+        self.assertEqual(len(sess.uploads), 1)
+
+    def test_defer(self):
+        sess = self.make_session()
+        calls = []
+        self.assertFalse(sess.defer("a", calls.append, 0))
+        with sess.deferred():
+            self.assertTrue(sess.defer("a", calls.append, 1))
+            sess.defer("b", calls.append, 2)
+            sess.defer("a", calls.append, 3)
+            self.assertEqual(calls, [])
+        self.assertEqual(calls, [3, 2])
+
+    def test_save(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        filename = os.path.join(tmpdir, "plot.html")
+        sess = HTMLFileSession(filename)
+        with sess.deferred():
+            sess.save(js="relative", css="relative")
+            self.assertFalse(os.path.exists(filename))
+        self.assertTrue(os.path.exists(filename))
+
+class SubscriberTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sess = PlotServerSession()
+        self.sess.docid = "doc"
+        self.subscriber = _Subscriber(self.sess, None)
+
+    def send(self, msgobj, binary=False):
+        if binary:
+            text, buffers = self.sess.serialize_buffers(msgobj)
+        else:
+            text, buffers = self.sess.serialize(msgobj), None
+        self.subscriber.handle("bokehplot:doc:" + text, buffers)
+
+    def test_modelpush(self):
+        r = Range1d(start=1, end=2)
+        self.sess.add(r)
+        r._mark_clean()
+        recorder = Recorder()
+        r.on_change("start", recorder, "changed")
+        self.send({'msgtype' : 'modelpush',
+                   'modelspecs' : [{'type' : 'Range1d', 'id' : r._id,
+                                    'attributes' : {'id' : r._id, 'start' : 5,
+                                                    'end' : 2}}]})
+        self.assertEqual(r.start, 5)
+        self.assertEqual(recorder.calls, [("start", 1, 5)])
+        self.assertFalse(r._dirty)
+        self.assertEqual(r.changes_since_push(), set())
+
+    def test_modelpush_keeps_local_changes(self):
+        r = Range1d(start=1, end=2)
+        self.sess.add(r)
+        r._mark_clean()
+        r.end = 10
+        self.send({'msgtype' : 'modelpush',
+                   'modelspecs' : [{'type' : 'Range1d', 'id' : r._id,
+                                    'attributes' : {'id' : r._id,
+                                                    'start' : 5}}]})
+        self.assertEqual((r.start, r.end), (5, 10))
+        self.assertTrue(r._dirty)
+        self.assertEqual(r.changes_since_push(), set(["end"]))
+
+    def test_new_model(self):
+        self.send({'msgtype' : 'modelpush',
+                   'modelspecs' : [{'type' : 'Range1d', 'id' : 'new',
+                                    'attributes' : {'id' : 'new', 'start' : 3}}]})
+        self.assertEqual(self.sess._models['new'].start, 3)
+
+    def test_patch_and_stream(self):
+        source = ColumnDataSource(data={"x" : [1, 2, 3]})
+        self.sess.add(source)
+        source._mark_clean()
+        recorder = Recorder()
+        source.on_change("data", recorder, "changed")
+        self.send({'msgtype' : 'modelpatch',
+                   'patches' : [{'type' : 'ColumnDataSource', 'id' : source._id,
+                                 'attr' : 'data',
+                                 'columns' : {'x' : {'indices' : [1],
+                                                     'values' : [20]}}}]})
+        self.assertEqual(list(source.data["x"]), [1, 20, 3])
+        self.send({'msgtype' : 'modelstream', 'type' : 'ColumnDataSource',
+                   'id' : source._id, 'attr' : 'data',
+                   'data' : {'x' : np.array([4.0, 5.0])}, 'rollover' : 4},
+                  binary=True)
+        self.assertEqual(list(source.data["x"]), [20, 3, 4, 5])
+        self.assertEqual(len(recorder.calls), 2)
+        self.assertEqual(source.changes_since_push(), set())
+
+    def push_start(self, r, start, version):
+        self.send({'msgtype' : 'modelpush', 'version' : version,
+                   'modelspecs' : [{'type' : 'Range1d', 'id' : r._id,
+                                    'attributes' : {'id' : r._id,
+                                                    'start' : start}}]})
+
+    def test_versions(self):
+        r = Range1d(start=1)
+        self.sess.add(r)
+        self.sess.version = 3
+        caught_up = []
+        self.sess.catch_up = lambda http_session: caught_up.append(True)
+        self.push_start(r, 2, 3)
+        self.assertEqual(r.start, 1)
+        self.push_start(r, 4, 4)
+        self.assertEqual((r.start, self.sess.version), (4, 4))
+        self.assertEqual(caught_up, [])
+        self.push_start(r, 6, 6)
+        self.assertEqual(caught_up, [True])
+        self.assertEqual(r.start, 4)
+
+    def test_catch_up(self):
+        r = Range1d(start=1)
+        self.sess.add(r)
+        self.sess.version = 3
+        requests = []
+        class Response(object):
+            def __init__(self, content):
+                self.content = content
+        responses = [{'version' : 5, 'changes' : [
+                         {'msgtype' : 'modelpush', 'version' : 4,
+                          'modelspecs' : [{'type' : 'Range1d', 'id' : r._id,
+                                           'attributes' : {'id' : r._id,
+                                                           'start' : 7}}]},
+                         {'msgtype' : 'modelpatch', 'version' : 5,
+                          'patches' : []}]},
+                     {'version' : 2000, 'resync' : True}]
+        self.sess.http_session.get = lambda url, params: (
+            requests.append((url, params)) or
+            Response(self.sess.serialize(responses.pop(0))))
+        self.assertTrue(self.sess.catch_up())
+        self.assertEqual(requests[0][1], {'since' : 3})
+        self.assertTrue(requests[0][0].endswith("/doc/changes"))
+        self.assertEqual((r.start, self.sess.version), (7, 5))
+        loaded = []
+        self.sess.load_all = lambda http_session: loaded.append(True)
+        self.assertFalse(self.sess.catch_up())
+        self.assertEqual(requests[1][1], {'since' : 5})
+        self.assertEqual(loaded, [True])
+
+    def test_own_changes(self):
+        r = Range1d(start=1)
+        self.sess.add(r)
+        self.sess.version = 3
+        class Response(object):
+            def __init__(self, content=None, headers={}):
+                self.content = content
+                self.headers = headers
+        self.sess._record_written(Response(headers={'X-Bokeh-Changes' : '4'}))
+        self.assertEqual(self.sess.version, 4)
+        # someone else's change came in between
+        self.sess._record_written(Response(headers={'X-Bokeh-Changes' : '6,7'}))
+        self.assertEqual(self.sess.version, 4)
+        self.sess.http_session.headers['Continuum-Clientid'] = 'me'
+        spec = lambda start: [{'type' : 'Range1d', 'id' : r._id,
+                               'attributes' : {'id' : r._id, 'start' : start}}]
+        changes = {'version' : 8, 'changes' : [
+            {'msgtype' : 'modelpush', 'version' : 5, 'modelspecs' : spec(5)},
+            {'msgtype' : 'modelpush', 'version' : 6, 'modelspecs' : spec(6)},
+            {'msgtype' : 'modelpush', 'version' : 7, 'modelspecs' : spec(7)},
+            {'msgtype' : 'modelpush', 'version' : 8, 'origin' : 'me',
+             'modelspecs' : spec(8)}]}
+        self.sess.http_session.get = lambda url, params: Response(
+            self.sess.serialize(changes))
+        applied = []
+        apply_message = self.sess.apply_message
+        self.sess.apply_message = lambda msgobj: (
+            applied.append(msgobj['version']), apply_message(msgobj))
+        self.assertTrue(self.sess.catch_up())
+        self.assertEqual(applied, [5])
+        self.assertEqual((r.start, self.sess.version), (5, 8))
+        self.assertEqual(self.sess._written, set())
+
+    def test_modeldel_and_unknown(self):
+        r = Range1d()
+        self.sess.add(r)
+        self.send({'msgtype' : 'docchange'})
+        self.send({'msgtype' : 'modeldel',
+                   'modelspecs' : [{'type' : 'Range1d', 'id' : r._id}]})
+        self.assertNotIn(r._id, self.sess._models)
+
+class TraversalTest(unittest.TestCase):
+
+    def make_context(self, n=50):
+        plots = [Plot(x_range=Range1d(), y_range=Range1d()) for i in range(n)]
+        # plots sharing a range, and a chain of nested contexts
+        plots[1].x_range = plots[0].x_range
+        inner = PlotContext(children=plots[n // 2:])
+        return PlotContext(children=plots[:n // 2] + [inner]), plots
+
+    def test_recursive_traversal(self):
+        context, plots = self.make_context()
+        objs = recursively_traverse_plot_object(context)
+        self.assertEqual(len(objs), 2 + 50 * 3 - 1)
+        self.assertTrue(set(plots) <= objs)
+
+    def test_deep_chain(self):
+        context = PlotContext()
+        for i in range(5000):
+            context = PlotContext(children=[context])
+        self.assertEqual(len(recursively_traverse_plot_object(context)), 5001)
+
+    def test_reference_graph(self):
+        sess = HTMLFileSession("unused.html")
+        context, plots = self.make_context()
+        graph = sess.reference_graph
+        self.assertIs(graph, sess.reference_graph)
+        objs = graph.reachable(context)
+        self.assertEqual(objs, recursively_traverse_plot_object(context))
+
+        scanned = []
+        for p in plots:
+            p.references = (lambda p: lambda: scanned.append(p) or
+                            Plot.references(p))(p)
+        new_range = Range1d()
+        plots[3].y_range = new_range
+        objs = graph.reachable(context)
+        self.assertEqual(scanned, [plots[3]])
+        self.assertIn(new_range, objs)
+
+        plots[4].renderers.append(new_range)
+        del scanned[:]
+        graph.reachable(context)
+        self.assertEqual(scanned, [plots[4]])
+
+class ResolveJsonTest(unittest.TestCase):
+
+    def test_no_copies_without_refs(self):
+        column = list(range(1000))
+        frag = {'data' : {'x' : column, 'y' : np.arange(3)},
+                'names' : ['a', 'b']}
+        self.assertIs(resolve_json(frag, {}), frag)
+
+    def test_refs_replaced(self):
+        r = Range1d()
+        plain = {'a' : [1, 2]}
+        frag = {'plain' : plain,
+                'items' : [1, {'type' : 'Range1d', 'id' : r._id}]}
+        resolved = resolve_json(frag, {r._id : r})
+        self.assertIs(resolved['items'][1], r)
+        self.assertIs(resolved['plain'], plain)
+        # the input is left alone
+        self.assertIsInstance(frag['items'][1], dict)
+
+    def test_refs_between_numbers(self):
+        r = Range1d()
+        ref = {'type' : 'Range1d', 'id' : r._id}
+        resolved = resolve_json({'items' : [1, ref, 2]}, {r._id : r})
+        self.assertEqual(resolved['items'], [1, r, 2])
+        self.assertEqual(json_find([1, [2, ref, 3], 4], is_ref), [ref])
+
+    def test_json_find(self):
+        r = Range1d()
+        frag = [{'a' : r}, [r, 1], np.arange(3), [1.0, 2.0]]
+        self.assertEqual(json_find(frag, lambda f: f is r), [r, r])
+
+class HydrationTest(unittest.TestCase):
+
+    def roundtrip(self, *models):
+        sess = PlotServerSession()
+        sess.docid = "doc"
+        attrs = protocol.deserialize_json(
+            sess.serialize(sess.broadcast_attrs(models)))
+        target = PlotServerSession()
+        target.docid = "doc"
+        loaded = target.load_broadcast_attrs(attrs, events=None)
+        return dict((m._id, m) for m in loaded)
+
+    def test_load(self):
+        source = ColumnDataSource(data={"x" : [1, 2, 3]})
+        r = Range1d(start=2, end=5)
+        context = PlotContext(children=[r])
+        loaded = self.roundtrip(source, r, context)
+        new_source, new_r = loaded[source._id], loaded[r._id]
+        self.assertEqual((new_r.start, new_r.end), (2, 5))
+        self.assertEqual(list(new_source.data["x"]), [1, 2, 3])
+        self.assertEqual(loaded[context._id].children, [new_r])
+        self.assertEqual(new_r.vm_serialize(), r.vm_serialize())
+        self.assertFalse(set(["start", "end"]) & new_r.dirty_vars())
+
+    def test_loaded_containers_observed(self):
+        source = ColumnDataSource(data={"x" : [1, 2, 3]})
+        new_source = self.roundtrip(source)[source._id]
+        new_source._mark_clean()
+        new_source.data["y"] = [4, 5, 6]
+        self.assertEqual(new_source.changes_since_push(), set(["data"]))
+
+class CollectTest(unittest.TestCase):
+
+    def make_plot(self):
+        return Plot(x_range=Range1d(), y_range=Range1d())
+
+    def test_collect(self):
+        sess = HTMLFileSession("unused.html")
+        shown = self.make_plot()
+        pinned = self.make_plot()
+        sess.plotcontext.children.append(shown)
+        sess.add(shown, shown.x_range, shown.y_range, pinned, pinned.x_range)
+        sess.add(*[self.make_plot() for i in range(10)])
+        sess.pin(pinned)
+        gc.collect()
+        self.assertEqual(sess.collect(), {'evicted': 10, 'freed': 10})
+        self.assertEqual(set(sess._models.values()),
+                         set([shown, shown.x_range, shown.y_range,
+                              pinned, pinned.x_range]))
+        sess.unpin(pinned)
+        self.assertEqual(sess.collect(), {'evicted': 2, 'freed': 0})
+
+    def test_collect_every(self):
+        sess = HTMLFileSession("unused.html")
+        sess.collect_every = 100
+        for i in range(2000):
+            plot = self.make_plot()
+            sess.add(plot, plot.x_range, plot.y_range)
+            sess.plotcontext.children = [plot]
+            # the plot which was just added is never evicted
+            self.assertIn(plot._id, sess._models)
+            self.assertLessEqual(len(sess._models), 2 * 100 + 3)
+        sess.plotcontext.children = []
+        sess.collect()
+        self.assertEqual(len(sess._models), 0)
+
+    def test_no_eviction_while_loading(self):
+        source = PlotServerSession()
+        source.docid = "doc"
+        source.root_url = "http://localhost:5006/"
+        plots = [self.make_plot() for i in range(10)]
+        for plot in plots:
+            source.add(plot, plot.x_range, plot.y_range)
+        # the ranges come first, nothing refers to them until their plot
+        attrs = source.broadcast_attrs(
+            [m for m in source._models.values() if not isinstance(m, Plot)] +
+            plots)
+        sess = PlotServerSession()
+        sess.collect_every = 3
+        models = sess.load_broadcast_attrs(json.loads(source.serialize(attrs)),
+                                           events=None)
+        self.assertEqual(len(models), 30)
+        for plot in models[20:]:
+            self.assertIs(plot.x_range, sess._models[plot.x_range._id])
+
+    def test_weak_models(self):
+        class WeakSession(HTMLFileSession):
+            weak_models = True
+        sess = WeakSession("unused.html")
+        shown = self.make_plot()
+        sess.plotcontext.children = [shown] + [self.make_plot()
+                                               for i in range(10)]
+        sess.add(*sess.plotcontext.children)
+        # the reference graph doesn't keep them alive either, once its
+        # last result is replaced
+        sess.reference_graph.reachable(sess.plotcontext)
+        sess.plotcontext.children = [shown]
+        sess.reference_graph.reachable(sess.plotcontext)
+        gc.collect()
+        self.assertEqual(list(sess._models.values()), [shown])
+        self.assertEqual(sess.collect(), {'evicted': 0, 'freed': 0})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -68,8 +68,7 @@ print("Stored to document line_animate at http://localhost:5006/bokeh")
 
 while True:
     for i in  np.linspace(-2*pi, 2*pi, 50):
-        source._data['x'] = x +i
-        source._dirty = True
+        source.data['x'] = x + i
         sess.store_all()
         time.sleep(0.05)
 
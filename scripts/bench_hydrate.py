@@ -0,0 +1,47 @@
+""" Measures loading a document into a session from its broadcast json,
+the way the plot server does on every request.
+
+    PYTHONPATH=. python scripts/bench_hydrate.py [number of models]
+"""
+from __future__ import print_function
+
+import sys
+import time
+
+from bokeh import protocol
+from bokeh.objects import Plot, Range1d, DataRange1d, ColumnDataSource
+from bokeh.session import PlotServerSession, PlotContext
+
+def make_document(nmodels):
+    """ a PlotContext holding plots with five models each: the plot, its
+    two ranges, a data range and the source it refers to
+    """
+    plots = []
+    for i in range(nmodels // 5):
+        source = ColumnDataSource(data={"x" : [1, 2, 3]})
+        plots.append(Plot(x_range=Range1d(start=0, end=1),
+                          y_range=Range1d(start=0, end=1),
+                          renderers=[DataRange1d(
+                              sources=[source.columns("x")])]))
+    return PlotContext(children=plots)
+
+def main(nmodels=10000, repeat=3):
+    sess = PlotServerSession()
+    sess.docid = "bench"
+    sess.root_url = "http://localhost:5006/"
+    context = make_document(nmodels)
+    sess.add(*sess.reference_graph.reachable(context))
+    text = sess.serialize(sess.broadcast_attrs(list(sess._models.values())))
+    best = None
+    for i in range(repeat):
+        attrs = protocol.deserialize_json(text)
+        target = PlotServerSession()
+        target.docid = "bench"
+        start = time.time()
+        models = target.load_broadcast_attrs(attrs, events=None)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print("loaded %d models in %.3f s" % (len(models), best))
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
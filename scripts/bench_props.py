@@ -0,0 +1,50 @@
+""" Measures the memory used per Plot and per Circle instance, and the
+cost of reading and writing their properties.
+
+    PYTHONPATH=. python scripts/bench_props.py
+"""
+from __future__ import print_function
+
+import gc
+import timeit
+import tracemalloc
+
+from bokeh.objects import Plot
+from bokeh.glyphs import Circle
+
+def make_plot():
+    return Plot(x_range=None, y_range=None, title="bench",
+                plot_width=300, plot_height=300)
+
+def make_circle():
+    return Circle(x="x", y="y", size=10, fill_color="red", line_alpha=0.5)
+
+def bytes_per_instance(factory, count=5000):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objs = [factory() for _ in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # don't count the list holding them
+    return (after - before - 8 * count) / float(count), objs
+
+def main(repeat=5):
+    print("%10s %12s %14s %14s %14s" % ("class", "bytes/inst", "create (us)",
+                                        "get (ns)", "set (ns)"))
+    for name, factory, prop in [("Plot", make_plot, "title"),
+                                ("Circle", make_circle, "fill_alpha")]:
+        size, objs = bytes_per_instance(factory)
+        obj = objs[0]
+        create = min(timeit.repeat(factory, number=1000, repeat=repeat))
+        get = min(timeit.repeat(lambda: getattr(obj, prop),
+                                number=100000, repeat=repeat))
+        value = getattr(obj, prop)
+        put = min(timeit.repeat(lambda: setattr(obj, prop, value),
+                                number=100000, repeat=repeat))
+        print("%10s %12.0f %14.2f %14.1f %14.1f" % (
+            name, size, create / 1000 * 1e6, get / 100000 * 1e9,
+            put / 100000 * 1e9))
+
+if __name__ == "__main__":
+    main()
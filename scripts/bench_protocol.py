@@ -0,0 +1,37 @@
+""" Compares the fixed layout data message framing in bokeh.protocol with
+the original pickled metadata format, across a range of array sizes.
+
+    python scripts/bench_protocol.py
+"""
+from __future__ import print_function
+
+import timeit
+import numpy as np
+
+from bokeh import protocol
+
+def roundtrip(serialize, deserialize, arrays):
+    frames = serialize(arrays)
+    # what comes off the wire is bytes, not arrays/memoryviews
+    frames = [memoryview(f).tobytes() for f in frames]
+    return deserialize(frames)
+
+def main(repeat=5):
+    print("%10s %8s %14s %14s %8s" % ("size", "count", "pickled (us)",
+                                      "framed (us)", "speedup"))
+    for size, count in [(1, 1000), (100, 1000), (10000, 100),
+                        (1000000, 5)]:
+        arrays = [np.random.random(size) for _ in range(count)]
+        timings = []
+        for ser, deser in [(protocol.pickle_serialize_data,
+                            protocol.pickle_deserialize_data),
+                           (protocol.default_serialize_data,
+                            protocol.default_deserialize_data)]:
+            t = min(timeit.repeat(lambda: roundtrip(ser, deser, arrays),
+                                  number=1, repeat=repeat))
+            timings.append(t / count * 1e6)
+        print("%10d %8d %14.2f %14.2f %7.1fx" % (
+            size, count, timings[0], timings[1], timings[0] / timings[1]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+""" Measures how long a script storing a 200 plot dashboard, one
+store_all() per plot like plotting's visual decorator does, is blocked by
+uploads to a plot server with the given latency (simulated).
+
+    PYTHONPATH=. python scripts/bench_push.py [number of plots] [latency in ms]
+"""
+from __future__ import print_function
+
+import sys
+import time
+
+from bokeh.objects import Range1d, DataRange1d, ColumnDataSource
+from bokeh.session import PlotServerSession, PlotContext
+
+class Response(object):
+    ok = True
+    status_code = 200
+
+def make_session(latency, push_interval):
+    sess = PlotServerSession(push_interval=push_interval)
+    sess.docid = "bench"
+    def store_broadcast_attrs(attrs):
+        sess.serialize(attrs)
+        time.sleep(latency)
+        return Response()
+    sess.store_broadcast_attrs = store_broadcast_attrs
+    sess.plotcontext = PlotContext()
+    return sess
+
+def build(sess, nplots):
+    for i in range(nplots):
+        source = ColumnDataSource(data={"x" : list(range(100))})
+        objs = [source, Range1d(start=0, end=1),
+                DataRange1d(sources=[source.columns("x")])]
+        sess.add(*objs)
+        sess.plotcontext.children.append(objs[-1])
+        sess.store_all()
+
+def main(nplots=200, latency=20):
+    for push_interval in (None, 0.05):
+        sess = make_session(latency / 1000.0, push_interval)
+        start = time.time()
+        build(sess, nplots)
+        blocked = time.time() - start
+        sess.wait()
+        total = time.time() - start
+        print("push_interval = %-5s blocked %6.2f s, all stored after %6.2f s"
+              % (push_interval, blocked, total))
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
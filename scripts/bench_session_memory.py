@@ -0,0 +1,47 @@
+""" Measures the memory held by a long-lived session while plots are
+created in a loop and each replaces the previous one in the plotcontext,
+with and without automatic collection.
+
+    PYTHONPATH=. python scripts/bench_session_memory.py [number of plots]
+"""
+from __future__ import print_function
+
+import gc
+import sys
+import tracemalloc
+
+from bokeh.objects import Plot, Range1d, DataRange1d, ColumnDataSource
+from bokeh.session import HTMLFileSession
+
+def make_plot():
+    source = ColumnDataSource(data={"x" : list(range(100))})
+    return Plot(x_range=Range1d(start=0, end=1),
+                y_range=DataRange1d(sources=[source.columns("x")]),
+                data_sources=[source])
+
+def run(sess, nplots):
+    sizes = []
+    for i in range(nplots):
+        plot = make_plot()
+        sess.add(plot, plot.x_range, plot.y_range, *plot.data_sources)
+        sess.plotcontext.children = [plot]
+        if (i + 1) % (nplots // 4) == 0:
+            gc.collect()
+            sizes.append((i + 1, len(sess._models),
+                          tracemalloc.get_traced_memory()[0]))
+    return sizes
+
+def main(nplots=10000):
+    for collect_every in (None, 1000):
+        sess = HTMLFileSession("unused.html")
+        sess.collect_every = collect_every
+        tracemalloc.start()
+        sizes = run(sess, nplots)
+        tracemalloc.stop()
+        print("collect_every = %s" % collect_every)
+        for count, nmodels, size in sizes:
+            print("  %6d plots %8d models %10.1f MB" % (count, nmodels,
+                                                       size / 1e6))
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
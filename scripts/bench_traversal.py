@@ -0,0 +1,51 @@
+""" Measures reachability walks over a large document: the iterative
+recursively_traverse_plot_object, and a session's ReferenceGraph before
+and after a small change.
+
+    PYTHONPATH=. python scripts/bench_traversal.py [number of models]
+"""
+from __future__ import print_function
+
+import sys
+import time
+
+from bokeh.objects import (Plot, Range1d, DataRange1d, ColumnDataSource,
+                           recursively_traverse_plot_object)
+from bokeh.session import HTMLFileSession, PlotContext
+
+def make_document(nmodels):
+    """ a PlotContext holding plots with five models each: the plot, its
+    two ranges, a data range and the source it refers to
+    """
+    plots = []
+    for i in range(nmodels // 5):
+        source = ColumnDataSource(data={"x" : [1, 2, 3]})
+        plots.append(Plot(x_range=Range1d(start=0, end=1),
+                          y_range=Range1d(start=0, end=1),
+                          renderers=[DataRange1d(
+                              sources=[source.columns("x")])]))
+    return PlotContext(children=plots), plots
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return time.time() - start, result
+
+def main(nmodels=50000):
+    context, plots = make_document(nmodels)
+    sess = HTMLFileSession("unused.html")
+    graph = sess.reference_graph
+
+    elapsed, objs = timed(recursively_traverse_plot_object, context)
+    print("%-32s %8.3f s  (%d models)" % ("full traversal", elapsed, len(objs)))
+    elapsed, objs = timed(graph.reachable, context)
+    print("%-32s %8.3f s" % ("graph, first walk", elapsed))
+    elapsed, objs = timed(graph.reachable, context)
+    print("%-32s %8.3f s" % ("graph, unchanged", elapsed))
+    plots[len(plots) // 2].renderers.append(DataRange1d())
+    elapsed, objs = timed(graph.reachable, context)
+    print("%-32s %8.3f s  (%d models)" % ("graph, after one change",
+                                          elapsed, len(objs)))
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])